@@ -1,21 +1,82 @@
-from flask import Flask, request, jsonify
+import functools
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import Flask, Response, request, jsonify, make_response, stream_with_context
 from flask_cors import CORS
-from utils.integration import find_flights_intersecting
+from utils.integration import run_find_flights_intersecting, run_find_flights_intersecting_multi, \
+    stream_flights_intersecting, FOV_ARGUMENTS
+from utils.compute_pool import compute_pool, ComputePoolSaturated
 from utils.localsidereal import get_utc_time
 import utils.fov as fov
-from astropy.time import Time, TimeDelta
+import utils.flight_api as flight_api
+import utils.flight_index as flight_index
+import utils.subscriptions as subscriptions
+import utils.simulated_fleet as simulated_fleet
+import utils.response_format as response_format
+import utils.metrics as metrics
+import utils.warmup as warmup
+from utils.results_cache import results_cache, results_cache_key
+from utils.coalescing import request_coalescer, coalescing_key
+from utils.track_sessions import get_track_session
+from utils.risk_map import run_find_crossings_grid, grid_axis, grid_region
 
 app = Flask(__name__)
 cors = CORS(app, origins='*')
+# keep live flights of FLIGHT_POLLER_REGION in memory, if configured
+flight_index.start_poller_from_env(flight_api.flight_provider)
 
 @app.route("/", methods=['GET'])
 def home ():
     return "hello world"
 
-@app.route("/api/flight-prediction", methods=['POST'])
-def flightPrediction():
-    data = request.get_json()
+def timed(endpoint: str):
+    """
+    Decorator collecting the stage timings of a view (see utils.metrics), sent back in a Server-Timing header
+    and added to the metrics served at /metrics.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with metrics.collect() as timings:
+                    response = make_response(view(*args, **kwargs))
+            except Exception:
+                metrics.requests_total.inc(endpoint=endpoint, status=500)
+                raise
+            total = time.perf_counter() - start
+
+            for name, seconds in timings.items():
+                metrics.stage_seconds.observe(seconds, endpoint=endpoint, stage=name)
+            metrics.request_seconds.observe(total, endpoint=endpoint)
+            metrics.requests_total.inc(endpoint=endpoint, status=response.status_code)
+            response.headers["Server-Timing"] = metrics.server_timing({**timings, "total": total})
+            return response
+        return wrapper
+    return decorator
 
+@app.route("/warmup", methods=['GET'])
+def warmupWorker():
+    """
+    Readiness probe: load the heavy modules and caches (see utils.warmup) and start the compute pool's workers,
+    which warm up as well. Only slow the first time.
+    """
+    timings = warmup.warm_up()
+    try:
+        compute_pool.start(warmup.warm_up)
+    except Exception as e:
+        return jsonify({"ready": False, "error": str(e)}), 503
+    return jsonify({"ready": True, "seconds": timings}), 200
+
+@app.route("/metrics", methods=['GET'])
+def prometheusMetrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+def parse_prediction_request(data: dict) -> dict:
+    """
+    Read the flight-prediction form into the arguments of find_flights_intersecting.
+    """
     focal_length = float(data.get('focalLength'))
     camera_sensor_size = float(data.get('cameraSensorSize'))
     barlow_reducer_factor = float(data.get('barlowReducerFactor'))
@@ -30,24 +91,319 @@ def flightPrediction():
     flight_data_type = data.get('flightDataType')
     simulated_time = data.get('datetime')
     simulated_flights = data.get('simulatedFlights')
+    simulated_fleet_id = data.get('simulatedFleetId')
+    time_step = float(data.get('timeStep', 5))
     
     if flight_data_type == "live":
+        from astropy.time import Time
         observer_time = Time.now() # gives current time in UTC
     else:
         observer_time = get_utc_time(latitude, longitude, simulated_time)
 
     fov_size = fov.calculate_fov_size(focal_length, camera_sensor_size, barlow_reducer_factor)
 
-    flights_position, flight_data = find_flights_intersecting (fov_size, exposure, fov_center_ra_h, fov_center_ra_m, 
-                                                               fov_center_ra_s, fov_center_dec, longitude, latitude, altitude, flight_data_type, simulated_flights, observer_time)
+    return {
+        "fov_size": fov_size, "exposure": exposure,
+        "fov_center_ra_h": fov_center_ra_h, "fov_center_ra_m": fov_center_ra_m, "fov_center_ra_s": fov_center_ra_s,
+        "fov_center_dec": fov_center_dec, "observer_lon": longitude, "observer_lat": latitude, "altitude": altitude,
+        "flight_data_type": flight_data_type, "simulated_flights": simulated_flights, "simulated_time": observer_time,
+        "time_step": time_step, "simulated_fleet_id": simulated_fleet_id,
+    }
+
+def parse_flag(data: dict, name: str) -> bool:
+    """
+    A boolean field of a form, false if absent.
+    :raise ValueError: If the field is neither a boolean nor "true" or "false".
+    """
+    value = data.get(name, False)
+    if isinstance(value, bool):
+        return value
+    if value in ("true", "false"):
+        return value == "true"
+    raise ValueError(f"{name} must be true or false.")
+
+def server_busy(error: Exception):
+    """ The response to a computation the compute pool could not accept, did not finish in time or lost to a dead worker. """
+    response = jsonify({"error": "Server busy, try again later", "detail": str(error)})
+    response.headers["Retry-After"] = "5"
+    return response, 503
+
+def prefetch_live_flights(arguments: dict):
+    """ With the compute pool, fetch the live flights here, where the flight cache is shared, and only do the math in a worker. """
+    if compute_pool.enabled:
+        with metrics.stage("fetch"):
+            arguments["live_flights"] = fov.find_live_flights_in_horizon(arguments["observer_lat"], arguments["observer_lon"],
+                                                                         arguments["fov_size"], arguments["exposure"])
+
+
+def compute_live_prediction(arguments: dict) -> tuple:
+    """ Fetch the live flights and compute the prediction, see run_find_flights_intersecting. """
+    prefetch_live_flights(arguments)
+    return compute_pool.run(run_find_flights_intersecting, arguments)
+
+@app.route("/api/flight-prediction", methods=['POST'])
+@timed("flight-prediction")
+def flightPrediction():
+    data = request.get_json()
+    arguments = parse_prediction_request(data)
+    try:
+        arguments["refine_events"] = parse_flag(data, 'refineEvents')
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    session_id = data.get('sessionId')
+    # concurrent identical live requests share the fetch and the computation
+    coalesced = arguments["flight_data_type"] == "live" and session_id is None and request_coalescer.enabled
+    hit = shared = False
+    try:
+        if arguments["flight_data_type"] == "live":
+            if not coalesced:
+                prefetch_live_flights(arguments)
+        elif arguments["flight_data_type"] == "simulated" and \
+                (arguments["simulated_flights"] is not None or arguments["simulated_fleet_id"] is not None):
+            # parse the fleet here, where the fleet cache is shared, its digest is also part of the results cache key
+            with metrics.stage("parse"):
+                arguments["simulated_flights"] = simulated_fleet.get_simulated_fleet(arguments["simulated_flights"],
+                                                                                     arguments["simulated_fleet_id"])
+            arguments["simulated_fleet_id"] = None
+
+        # simulated results only depend on the form, unless the client opts out with Cache-Control: no-cache
+        cached = arguments["flight_data_type"] == "simulated" and \
+            isinstance(arguments["simulated_flights"], simulated_fleet.SimulatedFleet) and \
+            not (request.cache_control.no_cache or request.cache_control.no_store)
+        if session_id is not None and not cached:
+            # the tracks of the session's previous poll are in this process, so compute in a thread of it
+            user_gps = {"latitude": arguments["observer_lat"], "longitude": arguments["observer_lon"], "altitude": arguments["altitude"]}
+            arguments["track_session"] = get_track_session(session_id, user_gps, arguments["time_step"], arguments["simulated_time"])
+            flights_position, flight_data, stats, timings = compute_pool.run_local(run_find_flights_intersecting, arguments)
+        elif cached:
+            (flights_position, flight_data, stats, timings), hit = results_cache.get_or_compute(
+                results_cache_key(arguments), lambda: compute_pool.run(run_find_flights_intersecting, arguments))
+            stats = {**stats, "cache": "hit" if hit else "miss"}
+            metrics.results_cache_total.inc(result="hit" if hit else "miss")
+        elif coalesced:
+            (flights_position, flight_data, stats, timings), shared = request_coalescer.run(
+                coalescing_key(arguments, request_coalescer.window), lambda: compute_live_prediction(arguments))
+            stats = {**stats, "coalesced": shared}
+            metrics.coalesced_total.inc(result="coalesced" if shared else "computed")
+        else:
+            flights_position, flight_data, stats, timings = compute_pool.run(run_find_flights_intersecting, arguments)
+    except (ComputePoolSaturated, TimeoutError, BrokenProcessPool) as e:
+        return server_busy(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    if not (hit or shared):
+        # collected where the computation ran, possibly a worker process
+        metrics.add_timings(timings)
+        metrics.flights_total.inc(stats["candidates"], stage="candidates")
+        metrics.flights_total.inc(stats["propagated"], stage="propagated")
+        metrics.timesteps_total.inc(len(flights_position))
+
+    # the legacy JSON shape unless the client asks for an available columnar format
+    mimetype = response_format.choose_format(request.accept_mimetypes)
+    if mimetype is None:
+        return jsonify({"error": "Not acceptable", "available": response_format.available_formats()}), 406
+    if mimetype != response_format.LEGACY_JSON:
+        with metrics.stage("encode"):
+            body = response_format.to_columnar(flights_position, flight_data, arguments["time_step"])
+            body.update({"fov_size": arguments["fov_size"], "stats": stats})
+            return Response(response_format.encode(body, mimetype), status=200, mimetype=mimetype)
 
-    flight_data=[flight.to_dict() for flight in flight_data if flight.entry]
+    with metrics.stage("encode"):
+        flight_data=[flight.to_dict() for flight in flight_data if flight.entry]
+
+        return jsonify({
+            "flights_position": flights_position,
+            "flight_data": flight_data,
+            "fov_size": arguments["fov_size"],
+            "stats": stats
+        }), 200
+
+@app.route("/api/flight-prediction/batch", methods=['POST'])
+@timed("flight-prediction-batch")
+def flightPredictionBatch():
+    """
+    Several telescopes at the same site. The body has the observer fields of /api/flight-prediction and a "fovs" list,
+    each with its own focalLength, cameraSensorSize, barlowReducerFactor, fovCenterRaH/M/S, fovCenterDec and,
+    optionally, exposure. The flights are fetched and propagated once for all of them.
+    """
+    data = request.get_json()
+    fovs = [parse_prediction_request({**data, **fov_definition}) for fov_definition in data.get('fovs', [])]
+    if not fovs:
+        return jsonify({"error": "At least one FOV must be provided"}), 400
+    try:
+        if parse_flag(data, 'refineEvents'):
+            return jsonify({"error": "refineEvents is not available for several FOVs"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    observer = fovs[0]
+    arguments = {"fovs": [{key: fov_arguments[key] for key in FOV_ARGUMENTS} for fov_arguments in fovs],
+                 **{key: observer[key] for key in ("observer_lon", "observer_lat", "altitude", "flight_data_type", "simulated_flights",
+                                                   "simulated_time", "time_step", "simulated_fleet_id")}}
+
+    try:
+        if arguments["flight_data_type"] == "live" and compute_pool.enabled:
+            # one horizon query large enough for every fov, like find_flights_intersecting_multi, see prefetch_live_flights
+            with metrics.stage("fetch"):
+                arguments["live_flights"] = fov.find_live_flights_in_horizon(
+                    observer["observer_lat"], observer["observer_lon"], max(fov_arguments["fov_size"] for fov_arguments in fovs),
+                    max(fov_arguments["exposure"] for fov_arguments in fovs))
+        elif arguments["flight_data_type"] == "simulated" and arguments["simulated_fleet_id"] is not None:
+            # the fleets kept under an id are in this process
+            arguments["simulated_flights"] = simulated_fleet.get_simulated_fleet(arguments["simulated_flights"],
+                                                                                 arguments["simulated_fleet_id"])
+            arguments["simulated_fleet_id"] = None
+        results, stats, timings = compute_pool.run(run_find_flights_intersecting_multi, arguments)
+    except (ComputePoolSaturated, TimeoutError, BrokenProcessPool) as e:
+        return server_busy(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    metrics.add_timings(timings)
+
+    return jsonify({
+        "fovs": [{
+            "flights_position": flights_position,
+            "flight_data": [flight.to_dict() for flight in flight_data if flight.entry],
+            "fov_size": fov_arguments["fov_size"],
+        } for fov_arguments, (flights_position, flight_data) in zip(fovs, results)],
+        "stats": stats
+    }), 200
+
+@app.route("/api/risk-map", methods=['POST'])
+@timed("risk-map")
+def riskMap():
+    """
+    Site planning: how many flights would cross the FOV during the exposure, for every site of a grid.
+    The body has the fields of /api/flight-prediction, without latitude and longitude, and "gridLatitudes" and
+    "gridLongitudes", each [start, stop, count]. The flights are fetched and propagated once for the whole grid.
+    """
+    data = request.get_json()
+    try:
+        latitudes = grid_axis(*data['gridLatitudes'])
+        longitudes = grid_axis(*data['gridLongitudes'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": "gridLatitudes and gridLongitudes must each be [start, stop, count]"}), 400
+    # the observer time is the one of the grid center
+    form = parse_prediction_request({**data, "latitude": latitudes.mean(), "longitude": longitudes.mean()})
+    arguments = {key: form[key] for key in FOV_ARGUMENTS + ("altitude", "flight_data_type", "simulated_flights", "simulated_time",
+                                                            "time_step", "simulated_fleet_id")}
+    arguments.update(latitudes=latitudes, longitudes=longitudes)
+
+    try:
+        if arguments["flight_data_type"] == "live" and compute_pool.enabled:
+            # fetch here, where the flight cache is shared, like prefetch_live_flights
+            with metrics.stage("fetch"):
+                arguments["live_flights"] = flight_api.find_flights_in_circ_boundary(*grid_region(latitudes, longitudes))
+        elif arguments["flight_data_type"] == "simulated" and arguments["simulated_fleet_id"] is not None:
+            # the fleets kept under an id are in this process
+            arguments["simulated_flights"] = simulated_fleet.get_simulated_fleet(arguments["simulated_flights"],
+                                                                                 arguments["simulated_fleet_id"])
+            arguments["simulated_fleet_id"] = None
+        risk_map, stats, timings = compute_pool.run(run_find_crossings_grid, arguments)
+    except (ComputePoolSaturated, TimeoutError, BrokenProcessPool) as e:
+        return server_busy(e)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    metrics.add_timings(timings)
 
     return jsonify({
-        "flights_position": flights_position,
-        "flight_data": flight_data,
-        "fov_size": fov_size
+        "latitudes": latitudes.tolist(),
+        "longitudes": longitudes.tolist(),
+        "crossings": risk_map["crossings"].tolist(),
+        "elevation": risk_map["elevation"].tolist(),
+        "fov_size": arguments["fov_size"],
+        "stats": stats
     }), 200
 
+@app.route("/api/flight-prediction/stream", methods=['POST'])
+def flightPredictionStream():
+    """
+    Same as /api/flight-prediction, but every timestep and every entry/exit event is sent as soon as it is computed.
+    Responds with newline-delimited JSON, or with server-sent events if the client accepts text/event-stream.
+    The last record has type "done" and carries the fov size and the stats, or type "error" if the computation
+    took longer than the compute pool's timeout.
+    """
+    data = request.get_json()
+    arguments = parse_prediction_request(data)
+    try:
+        if parse_flag(data, 'refineEvents'):
+            return jsonify({"error": "refineEvents is not available when streaming"}), 400
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # computed in this process while it is sent, within the compute pool's bound and timeout
+    try:
+        compute_pool.acquire()
+    except ComputePoolSaturated as e:
+        return server_busy(e)
+    deadline = time.monotonic() + compute_pool.timeout
+    try:
+        stats = dict()
+        records = stream_flights_intersecting(**arguments, stats=stats)
+    except ValueError as e:
+        compute_pool.release()
+        return jsonify({"error": str(e)}), 400
+    server_sent_events = request.accept_mimetypes.best_match(["application/x-ndjson", "text/event-stream"]) == "text/event-stream"
+
+    def generate():
+        for record in records:
+            yield format_stream_record(record, server_sent_events)
+            if time.monotonic() > deadline:
+                yield format_stream_record({"type": "error", "error": "Server busy, try again later"}, server_sent_events)
+                return
+        yield format_stream_record({"type": "done", "fov_size": arguments["fov_size"], "stats": stats}, server_sent_events)
+
+    mimetype = "text/event-stream" if server_sent_events else "application/x-ndjson"
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    response.call_on_close(compute_pool.release)
+    return response, 200
+
+@app.route("/api/subscriptions", methods=['POST'])
+def createSubscription():
+    """
+    Register a flight-prediction form once, then follow GET /api/subscriptions/<key> for its updates.
+    Forms that only differ in rounding share the same key, and the same computation.
+    """
+    try:
+        return jsonify({"key": subscriptions.hub.register(request.get_json())}), 201
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route("/api/subscriptions/<key>", methods=['GET'])
+def followSubscription(key):
+    """
+    Server-sent events with the changes of a registered form: the full state first, then
+    the flights added, updated and removed and the new entry/exit events at every refresh.
+    """
+    # subscribe before answering, the form may be dropped by a later register
+    try:
+        channel = subscriptions.hub.subscribe(key, compute_subscription)
+    except KeyError:
+        return jsonify({"error": "Unknown subscription"}), 404
+    except subscriptions.TooManySubscriptions as e:
+        return server_busy(e)
+
+    def generate():
+        for diff in subscriptions.hub.changes(channel):
+            # a comment line keeps idle connections open
+            yield ": keepalive\n\n" if diff is None else format_stream_record(diff, True)
+
+    response = Response(stream_with_context(generate()), mimetype="text/event-stream")
+    # also when the client leaves before the first change
+    response.call_on_close(lambda: subscriptions.hub.unsubscribe(channel))
+    return response, 200
+
+def compute_subscription(form: dict) -> dict:
+    """ One refresh of a subscription, in the compute pool like /api/flight-prediction. """
+    arguments = parse_prediction_request(form)
+    if arguments["flight_data_type"] == "live":
+        prefetch_live_flights(arguments)
+    flights_position, flight_data, _, _ = compute_pool.run(run_find_flights_intersecting, arguments)
+    return subscriptions.flight_states(flights_position, flight_data, arguments["time_step"])
+
+def format_stream_record(record: dict, server_sent_events: bool) -> str:
+    line = app.json.dumps(record)
+    return f"data: {line}\n\n" if server_sent_events else line + "\n"
+
 if __name__ == "__main__":
     app.run(debug=True, port=5000)
\ No newline at end of file
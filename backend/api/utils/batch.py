@@ -0,0 +1,228 @@
+"""
+File to evaluate the flight trajectory and coordinate conversion chain for many
+flights and many timesteps at once using numpy.
+
+Every function here mirrors a scalar function from flight_trajectory, conversion
+or fov and takes arrays that broadcast against each other, so the whole
+(flights x timesteps) grid is built in a single pass instead of one flight and
+one timestep at a time.
+
+Tolerance: the batch path uses the same formulas as the scalar path, so the
+RA/Dec it produces agree with the scalar path to within BATCH_TOLERANCE_DEG.
+A flight sitting exactly on the FOV boundary (within that tolerance) may be
+classified differently by the two paths.
+Unlike the scalar path, no ValueError is raised for degenerate positions (e.g.
+a flight passing exactly over a pole); those entries are NaN and are never
+reported as intersecting.
+RA/Dec are computed with an ObserverFrame (see observer_frame) rather than step by
+step through azimuth and elevation like aircraft_theta_phi_to_radec, which is
+kept as the reference for that chain.
+With MOTION_MODEL "great-circle" (see flight_motion), flights move along great
+circles instead of with flight_trajectory, and no position is degenerate.
+"""
+import math
+
+import numpy as np
+
+import utils.flight_motion as flight_motion
+from utils.observer_frame import ObserverFrame
+from utils.datatypes import ProcessedFlightInfo
+from utils.constants import EARTH_RADIUS_METER
+
+BATCH_TOLERANCE_DEG = 1e-6 # max RA/Dec difference to the scalar path, in degrees
+
+KNOTS_TO_METERS_PER_SECOND = 0.514444
+FEET_TO_METERS = 1 / 3.28084
+
+
+def flight_arrays(flight_data: list[ProcessedFlightInfo]) -> dict[str, np.ndarray]:
+    """
+    Convert a list of flights into column arrays of shape (flights, 1), ready to
+    broadcast against a row of elapsed times.
+    :param flight_data: The flights to convert.
+    :return: speed in m/s, altitude in meters, heading, latitude and longitude in degrees.
+    """
+    def column(values):
+        return np.asarray(values, dtype=float).reshape(-1, 1)
+
+    return {
+        "speed": column([flight.speed for flight in flight_data]) * KNOTS_TO_METERS_PER_SECOND,
+        "altitude": column([flight.altitude for flight in flight_data]) * FEET_TO_METERS,
+        "heading": column([flight.heading for flight in flight_data]),
+        "latitude": column([flight.latitude for flight in flight_data]),
+        "longitude": column([flight.longitude for flight in flight_data]),
+    }
+
+
+def phi_signed_current_position(speed, radius, height, bearing, time_shift, original_latitude) -> np.ndarray:
+    """
+    Batch version of flight_trajectory.phi_signed_current_position.
+    """
+    phi_speed = speed / (radius + height) * np.cos(np.radians(bearing))
+    return -phi_speed * time_shift + math.pi / 2 - np.radians(original_latitude)
+
+
+def phi_current_position(speed, radius, height, bearing, time_shift, original_latitude) -> np.ndarray:
+    """
+    Batch version of flight_trajectory.phi_current_position.
+    """
+    ret = np.abs(np.mod(phi_signed_current_position(speed, radius, height, bearing, time_shift, original_latitude), 2 * math.pi))
+    return np.where(ret > math.pi, 2 * math.pi - ret, ret)
+
+
+def theta_current_position(speed, radius, height, bearing, time_shift, original_latitude, original_longitude) -> np.ndarray:
+    """
+    Batch version of flight_trajectory.theta_current_position.
+    Entries where sin(phi) is 0 (the flight is exactly over a pole) are NaN.
+    """
+    phi = phi_current_position(speed, radius, height, bearing, time_shift, original_latitude)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        theta_speed = (speed * np.sin(np.radians(bearing))) / ((radius + height) * np.sin(phi))
+        ret = np.mod(theta_speed * time_shift + np.radians(np.mod(original_longitude, 360)), 2 * math.pi)
+    phi_signed = phi_signed_current_position(speed, radius, height, bearing, time_shift, original_latitude)
+    return np.where(phi_signed < 0, np.mod(ret + math.pi, 2 * math.pi), ret)
+
+
+def spherical_to_cartesian(r, theta, phi) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Batch version of conversion.spherical_to_cartesian, without range checks.
+    """
+    x = r * np.sin(phi) * np.cos(theta)
+    y = r * np.sin(phi) * np.sin(theta)
+    z = r * np.cos(phi)
+    return (x, y, z)
+
+
+def aircraft_theta_phi_to_radec(aircraft_theta, aircraft_phi, aircraft_alt, gps_lat: float, gps_lon: float, gps_alt: float,
+                                local_sidereal_time) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Batch version of conversion.aircraft_theta_phi_to_radec.
+    :param aircraft_theta: The theta angles in radians.
+    :param aircraft_phi: The phi angles in radians.
+    :param aircraft_alt: The altitudes of the aircraft in meters.
+    :param gps_lat: The latitude of the GPS location in degrees.
+    :param gps_lon: The longitude of the GPS location in degrees.
+    :param gps_alt: The altitude of the GPS location in meters.
+    :param local_sidereal_time: The local sidereal time in radians, broadcastable against the aircraft arrays.
+    :return: Right Ascension in degrees, Declination in degrees.
+    """
+    # observer position, see conversion.gps_cartesian
+    gps_phi = math.pi / 2 - math.radians(gps_lat)
+    gps_theta = math.radians(gps_lon % 360)
+    gps_x, gps_y, gps_z = spherical_to_cartesian(EARTH_RADIUS_METER + gps_alt, (gps_theta + math.pi / 2) % (2 * math.pi), gps_phi)
+
+    # aircraft position relative to the observer, see conversion.aircraft_vector_from_gps
+    aircraft_x, aircraft_y, aircraft_z = spherical_to_cartesian(
+        aircraft_alt + EARTH_RADIUS_METER, np.mod(aircraft_theta + math.pi / 2, 2 * math.pi), aircraft_phi)
+    aircraft_x, aircraft_y, aircraft_z = aircraft_x - gps_x, aircraft_y - gps_y, aircraft_z - gps_z
+
+    # align with longitude and latitude, see conversion.aircraft_vector_from_gps_aligned
+    sin_theta, cos_theta = math.sin(gps_theta), math.cos(gps_theta)
+    sin_phi, cos_phi = math.sin(gps_phi), math.cos(gps_phi)
+    x = cos_theta * aircraft_x + sin_theta * aircraft_y
+    y = -sin_theta * cos_phi * aircraft_x + cos_theta * cos_phi * aircraft_y - sin_phi * aircraft_z
+    z = -sin_theta * sin_phi * aircraft_x + cos_theta * sin_phi * aircraft_y + cos_phi * aircraft_z
+
+    # azimuth and elevation, see conversion.azimuth_elevation_from_vector
+    azimuth = np.mod(math.radians(450) - np.arctan2(-y, -x), 2 * math.pi)
+    elevation = np.arctan2(z, np.sqrt(x**2 + y**2))
+
+    # right ascension and declination, see conversion.aziele_to_radec
+    lat_rad = math.radians(gps_lat)
+    ha_y = -np.sin(azimuth) * np.cos(elevation)
+    ha_x = -np.cos(azimuth) * math.sin(lat_rad) * np.cos(elevation) + np.sin(elevation) * math.cos(lat_rad)
+    right_ascension = np.mod(local_sidereal_time - np.arctan2(ha_y, ha_x), 2 * math.pi)
+    declination = np.arcsin(np.clip(
+        math.sin(lat_rad) * np.sin(elevation) + math.cos(lat_rad) * np.cos(elevation) * np.cos(azimuth), -1, 1))
+
+    return (np.degrees(right_ascension), np.degrees(declination))
+
+
+def angular_distance(ra1, dec1, ra2, dec2) -> np.ndarray:
+    """
+    Batch version of fov.angular_distance, without range checks.
+    All angles are in degrees, the result is in degrees.
+    """
+    ra1_rad, dec1_rad = np.radians(ra1), np.radians(dec1)
+    ra2_rad, dec2_rad = np.radians(ra2), np.radians(dec2)
+
+    a = np.sin((dec2_rad - dec1_rad) / 2)**2 + np.cos(dec1_rad) * np.cos(dec2_rad) * np.sin((ra2_rad - ra1_rad) / 2)**2
+    return np.degrees(2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))))
+
+
+def is_intersecting(ra1, dec1, ra2, dec2, fov_size: float) -> np.ndarray:
+    """
+    Batch version of fov.is_intersecting. NaN positions are never intersecting.
+    """
+    with np.errstate(invalid="ignore"):
+        return angular_distance(ra1, dec1, ra2, dec2) < (fov_size / 2)
+
+
+def flights_ra_dec(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], elapsed_times,
+                   local_sidereal_times) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the Right Ascension and Declination of every flight at every elapsed time.
+    :param flight_data: The flights to convert.
+    :param user_gps: The user's GPS coordinates.
+    :param elapsed_times: The elapsed times in seconds, shape (timesteps,).
+    :param local_sidereal_times: The local sidereal time in radians at each elapsed time, shape (timesteps,).
+    :return: Right Ascension and Declination in degrees, each of shape (flights, timesteps).
+    """
+    elapsed_times = np.asarray(elapsed_times, dtype=float).reshape(1, -1)
+    local_sidereal_times = np.asarray(local_sidereal_times, dtype=float).reshape(1, -1)
+    return positions_ra_dec(flight_arrays(flight_data), user_gps, elapsed_times, local_sidereal_times)
+
+
+def positions_ra_dec(flights: dict[str, np.ndarray], user_gps: dict[str, float], elapsed_times,
+                     local_sidereal_times) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Compute the Right Ascension and Declination of flights given as column arrays (see flight_arrays).
+    The flight arrays, elapsed times and sidereal times only need to broadcast against each other,
+    e.g. one flight per element paired with one elapsed time per element.
+    :return: Right Ascension and Declination in degrees.
+    """
+    return ObserverFrame(user_gps, local_sidereal_times).ra_dec(*flight_ecef(flights, elapsed_times))
+
+
+def flights_equatorial(flight_data: list[ProcessedFlightInfo], frame: ObserverFrame,
+                       elapsed_times) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute the direction of every flight at every elapsed time, as seen by the observer, as equatorial unit vectors.
+    :param flight_data: The flights to convert.
+    :param frame: The observer frame, built with the local sidereal time at each elapsed time, shape (1, timesteps).
+    :param elapsed_times: The elapsed times in seconds, shape (timesteps,).
+    :return: The unit vectors (see observer_frame.unit_vector), each of shape (flights, timesteps).
+    """
+    elapsed_times = np.asarray(elapsed_times, dtype=float).reshape(1, -1)
+    return frame.equatorial(*flight_ecef(flight_arrays(flight_data), elapsed_times))
+
+
+def flight_ecef(flights: dict[str, np.ndarray], elapsed_times) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Move flights given as column arrays (see flight_arrays) with the configured flight_motion.MOTION_MODEL.
+    :param flights: The flights as column arrays.
+    :param elapsed_times: The elapsed times in seconds, broadcastable against the flight columns.
+    :return: The ECEF positions in meters, x towards longitude 0 and z towards the north pole.
+    """
+    if flight_motion.MOTION_MODEL == "great-circle":
+        return flight_motion.FlightMotion(flights).ecef(elapsed_times)
+    theta, phi = flight_positions(flights, elapsed_times)
+    return spherical_to_cartesian(EARTH_RADIUS_METER + flights["altitude"], theta, phi)
+
+
+def flight_positions(flights: dict[str, np.ndarray], elapsed_times) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Move flights given as column arrays (see flight_arrays) with the configured flight_motion.MOTION_MODEL.
+    :param flights: The flights as column arrays.
+    :param elapsed_times: The elapsed times in seconds, broadcastable against the flight columns.
+    :return: theta and phi in radians.
+    """
+    if flight_motion.MOTION_MODEL == "great-circle":
+        return flight_motion.FlightMotion(flights).theta_phi(elapsed_times)
+    if flight_motion.MOTION_MODEL != "dawson":
+        raise ValueError(f"Unknown motion model {flight_motion.MOTION_MODEL}, expected one of {flight_motion.MOTION_MODELS}.")
+    phi = phi_current_position(flights["speed"], EARTH_RADIUS_METER, flights["altitude"], flights["heading"],
+                               elapsed_times, flights["latitude"])
+    theta = theta_current_position(flights["speed"], EARTH_RADIUS_METER, flights["altitude"], flights["heading"],
+                                   elapsed_times, flights["latitude"], flights["longitude"])
+    return (theta, phi)
@@ -0,0 +1,86 @@
+"""
+File to share one computation between concurrent identical live predictions.
+
+When several observers at the same site ask for the same prediction at once,
+each request would fetch the flights and run the same computation. Live
+requests are keyed by their normalized form, with the observer time rounded
+down to a bucket of COALESCE_WINDOW seconds. The first request of a key
+computes, and the requests arriving with the same key while it runs wait for
+its result instead of computing their own. Nothing is kept once the
+computation is done: this is not a cache, see results_cache for that.
+
+Followers get the result computed for the first request's observer time, which
+is at most COALESCE_WINDOW seconds from theirs.
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import Future
+
+from utils.results_cache import RESULTS_CACHE_ARGUMENTS
+
+COALESCE_WINDOW = float(os.environ.get("COALESCE_WINDOW", 5)) # seconds of observer time requests are shared within, 0 disables coalescing
+
+
+def coalescing_key(arguments: dict, window: float = COALESCE_WINDOW) -> str:
+    """
+    Hash of the arguments of a live find_flights_intersecting call, with the observer time rounded down to the window.
+    Numbers are compared as floats, so 5 and 5.0 give the same key.
+    """
+    normalized = {name: float(arguments[name]) for name in RESULTS_CACHE_ARGUMENTS}
+    normalized["time_bucket"] = math.floor(arguments["simulated_time"].unix / window)
+    normalized["refine_events"] = bool(arguments.get("refine_events", False))
+    normalized["flight_data_type"] = arguments["flight_data_type"]
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class RequestCoalescer:
+    """
+    Runs at most one computation per key at a time, the callers with the same key wait for its result.
+    The shared results must not be modified.
+    """
+    def __init__(self, window: float = COALESCE_WINDOW):
+        self.window = window
+        self.computed = 0
+        self.coalesced = 0
+        self._in_flight: dict[str, Future] = dict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def __len__(self):
+        return len(self._in_flight)
+
+    def run(self, key: str, compute):
+        """
+        The result of compute(), or of the computation already running under key.
+        An exception raised by compute is raised to every caller waiting for it.
+        :return: The result and whether it was computed for another request.
+        """
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self._in_flight[key] = Future()
+                self.computed += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return future.result(), True
+
+        try:
+            future.set_result(compute())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+        return future.result(), False
+
+
+request_coalescer = RequestCoalescer()
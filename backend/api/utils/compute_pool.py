@@ -0,0 +1,175 @@
+"""
+File to run the CPU-heavy part of requests in a bounded pool of worker processes.
+
+Request threads keep doing the network I/O (the flight feed), where the
+snapshot cache and the poller are shared by every request, and hand the
+trajectory/astropy computation to a worker process, so a long computation does
+not hold the GIL for every other request. At most workers + queue_depth
+computations are accepted at once; beyond that run raises ComputePoolSaturated
+right away, so the server answers 503 instead of queuing without bound.
+Computations that need the state of the server process, e.g. the tracks of a
+session, run in a thread of it with run_local, within the same bound and
+timeout, and streams hold a slot with acquire while they are sent.
+
+The workers are not forked: the server process already runs threads (the
+poller, the subscriptions, the requests), and a worker forked while one of
+them holds a lock would start with that lock held forever. They are started
+with COMPUTE_START_METHOD instead, forkserver where available.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+COMPUTE_WORKERS = int(os.environ.get("COMPUTE_WORKERS", 0)) # worker processes, 0 computes in the request thread
+COMPUTE_QUEUE_DEPTH = int(os.environ.get("COMPUTE_QUEUE_DEPTH", 8)) # computations allowed to wait for a worker
+COMPUTE_TIMEOUT = float(os.environ.get("COMPUTE_TIMEOUT", 55)) # seconds a request waits for its computation
+COMPUTE_START_METHOD = os.environ.get("COMPUTE_START_METHOD",
+                                      "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn") # never "fork"
+
+
+def process_context() -> multiprocessing.context.BaseContext:
+    """
+    The context worker processes are started with, see the top of this file.
+    :raise ValueError: If COMPUTE_START_METHOD is "fork" or unknown.
+    """
+    if COMPUTE_START_METHOD == "fork":
+        raise ValueError("Worker processes cannot be forked from the threaded server, use forkserver or spawn.")
+    return multiprocessing.get_context(COMPUTE_START_METHOD)
+
+
+class ComputePoolSaturated(Exception):
+    """ Raised when every worker is busy and the queue is full. """
+
+
+class ComputePool:
+    """
+    A process pool that accepts at most workers + queue_depth computations at a time.
+    """
+    def __init__(self, workers: int = COMPUTE_WORKERS, queue_depth: int = COMPUTE_QUEUE_DEPTH, timeout: float = COMPUTE_TIMEOUT):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self.timeout = timeout
+        self.in_flight = 0
+        self.initializer = None # run by every worker process when it starts, see start
+        self._executor: ProcessPoolExecutor = None
+        self._local_executor: ThreadPoolExecutor = None # see run_local
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.workers > 0
+
+    def run(self, fn, *args, **kwargs):
+        """
+        Run fn(*args, **kwargs) in a worker process and return its result.
+        fn, its arguments and its result must be picklable.
+        Computes in the calling thread if the pool has no workers.
+        :raise ComputePoolSaturated: If workers + queue_depth computations are already running or waiting.
+        :raise TimeoutError: If the result is not ready after timeout seconds.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        self.acquire()
+        try:
+            with self._lock:
+                executor = self._get_executor()
+        except BaseException:
+            self.release()
+            raise
+        future = self._submit(executor, fn, *args, **kwargs)
+        try:
+            return future.result(self.timeout)
+        except BrokenProcessPool:
+            # a worker died, start a new pool for the next computations
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def run_local(self, fn, *args, **kwargs):
+        """
+        Same as run, but in a thread of this process, for computations that need its state.
+        fn and its arguments need not be picklable.
+        :raise ComputePoolSaturated: If workers + queue_depth computations are already running or waiting.
+        :raise TimeoutError: If the result is not ready after timeout seconds.
+        """
+        if not self.enabled:
+            return fn(*args, **kwargs)
+
+        self.acquire()
+        with self._lock:
+            if self._local_executor is None:
+                # never more threads than slots, so nothing waits for a thread
+                self._local_executor = ThreadPoolExecutor(max_workers=self.workers + self.queue_depth,
+                                                          thread_name_prefix="compute-local")
+            executor = self._local_executor
+        return self._submit(executor, fn, *args, **kwargs).result(self.timeout)
+
+    def acquire(self):
+        """
+        Take a slot for a computation, given back with release. run and run_local take their own.
+        Does nothing if the pool has no workers.
+        :raise ComputePoolSaturated: If workers + queue_depth computations are already running or waiting.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.in_flight >= self.workers + self.queue_depth:
+                raise ComputePoolSaturated(f"{self.in_flight} computations already running or waiting")
+            self.in_flight += 1
+
+    def release(self):
+        """ Give back a slot taken with acquire. """
+        if self.enabled:
+            self._done(None)
+
+    def _submit(self, executor, fn, *args, **kwargs):
+        """ Submit a computation whose slot was acquired, the slot is given back when it is done. """
+        try:
+            future = executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._done(None)
+            raise
+        # the slot is only freed when the computation is done, even if the caller stopped waiting for it
+        future.add_done_callback(self._done)
+        return future
+
+    def start(self, initializer=None):
+        """
+        Start the worker processes now instead of with the first computation.
+        :param initializer: Run by every worker process when it starts, including the ones replacing a broken pool.
+            Must be picklable.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if initializer is not None:
+                self.initializer = initializer
+            executor = self._get_executor()
+        # the processes are only spawned with the first task
+        executor.submit(int).result(self.timeout)
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        """ The executor, created if needed. Must be called with the lock held. """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=process_context(), initializer=self.initializer)
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            executors = (self._executor, self._local_executor)
+            self._executor = self._local_executor = None
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown(wait=True)
+
+    def _done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+
+
+compute_pool = ComputePool()
@@ -1,9 +1,7 @@
 """
 File to handle conversion between coordinate systems.
 """
-from astropy.time import Time
-from astropy import units as u
-from astropy.coordinates import SkyCoord
+from __future__ import annotations
 
 import math
 
@@ -100,6 +98,11 @@ def convert_ra_dec_to_lat_lon(*, ra: float | HMS, dec, time=None, ra_format="deg
     return: (lat, lon) : tuple of astropy.coordinates.Angle
     raise ValueError: If the input values are invalid.
     """
+    # astropy.coordinates is slow to import and only needed here
+    from astropy.time import Time
+    from astropy import units as u
+    from astropy.coordinates import SkyCoord
+
     # Handle the time input
     if time is None:
         time = Time.now()
@@ -243,9 +246,11 @@ def azimuth_elevation_from_vector(vector: tuple)->tuple[float, float]:
 
     return (azimuth, elevation)
 
-def aziele_to_radec(azele: tuple[float, float], gps_lat: float, gps_lon: float, time=None)->tuple[float, float]:
+def aziele_to_radec(azele: tuple[float, float], gps_lat: float, gps_lon: float, time=None, local_sidereal_time: float = None)->tuple[float, float]:
     """
     Convert the azimuth and elevation to right ascension and declination.
+    :param local_sidereal_time: The local sidereal time in radians, e.g. from a SiderealTimeTable.
+        If not given, it is computed from the time.
     :return: Right Ascension in degrees, Declination in degrees.
     :raise ValueError: If the latitude or longitude is out of range.
     :raise ValueError: If the azimuth or elevation is out of range.
@@ -275,7 +280,9 @@ def aziele_to_radec(azele: tuple[float, float], gps_lat: float, gps_lon: float,
     hour_angle = math.atan2(ha_y, ha_x)
 
     # step 3: calculate the right ascension
-    right_ascension = get_local_sidereal_time(gps_lat, gps_lon, time) - hour_angle
+    if local_sidereal_time is None:
+        local_sidereal_time = get_local_sidereal_time(gps_lat, gps_lon, time)
+    right_ascension = local_sidereal_time - hour_angle
     right_ascension = right_ascension % (2*math.pi)
 
     # Declination calculation
@@ -288,7 +295,7 @@ def aziele_to_radec(azele: tuple[float, float], gps_lat: float, gps_lon: float,
     return (right_ascension, declination)
 
     
-def aircraft_theta_phi_to_radec(aircraft_theta, aircraft_phi, aircraft_alt, gps_lat, gps_lon, gps_alt, time=None)->tuple[float, float]:
+def aircraft_theta_phi_to_radec(aircraft_theta, aircraft_phi, aircraft_alt, gps_lat, gps_lon, gps_alt, time=None, local_sidereal_time=None)->tuple[float, float]:
     """
     Convert the aircraft's latitude and longitude to right ascension and declination.
     :param aircraft_theta: The theta angle in radians.
@@ -298,6 +305,7 @@ def aircraft_theta_phi_to_radec(aircraft_theta, aircraft_phi, aircraft_alt, gps_
     :param gps_lon: The longitude of the GPS location in degrees.
     :param gps_alt: The altitude of the GPS location in meters.
     :param time: The time of observation.
+    :param local_sidereal_time: The local sidereal time in radians at the time of observation, computed from time if not given.
     :return: Right Ascension in degrees, Declination in degrees.
 
     The following exceptions are raised from the called functions:
@@ -310,4 +318,4 @@ def aircraft_theta_phi_to_radec(aircraft_theta, aircraft_phi, aircraft_alt, gps_
     aircraft_vector = aircraft_vector_from_gps(gps_cart, aircraft_cart)
     aircraft_vector_aligned = aircraft_vector_from_gps_aligned(aircraft_vector, gps_lat, gps_lon)
     azele = azimuth_elevation_from_vector(aircraft_vector_aligned)
-    return aziele_to_radec(azele, gps_lat, gps_lon, time)
\ No newline at end of file
+    return aziele_to_radec(azele, gps_lat, gps_lon, time, local_sidereal_time)
\ No newline at end of file
@@ -2,39 +2,58 @@ import uuid
 from datetime import datetime
 from dataclasses import dataclass
 
+# namespace of the flight ids, so the same flight gets the same id in every request
+FLIGHT_ID_NAMESPACE = uuid.UUID("6f1c1c52-2b8e-4c1e-9a43-5d6f4b0e7a21")
+
+
+def stable_flight_id(*identifier) -> uuid.UUID:
+    """
+    Deterministic id of a flight from what identifies it at its source,
+    e.g. stable_flight_id("fr24", fr24_flight_id) or stable_flight_id("simulated", index, flight_number).
+    """
+    return uuid.uuid5(FLIGHT_ID_NAMESPACE, ":".join(str(part) for part in identifier))
+
+
+@dataclass(frozen=True, slots=True)
 class ProcessedFlightInfo:
     """
     ProcessedFlightInfo class to represent a flight with processed
-    information.
+    information. Immutable, so flights can be shared between requests and caches;
+    what a request computes about a flight goes in a FlightResult.
     """
-    def __init__(self, id: uuid.UUID, flightNumber: str, latitude: float, 
-                 longitude: float, altitude: float, speed: float, heading: float):
-        self.id = id
-        self.flightNumber = flightNumber
-        self.latitude = latitude
-        self.longitude = longitude
-        self.altitude = altitude # in feet
-        self.speed = speed # in knots
-        self.heading = heading # 0 is north, 90 is east, 180 is south, 270 is west
-        
-        self.entry : datetime = 0
-        self.exit : datetime = 0
-        self.RA = -1 # init to -1 to indicate not set
-        self.Dec = -1 # caution, declination can also be -1
+    id: uuid.UUID
+    flightNumber: str
+    latitude: float
+    longitude: float
+    altitude: float # in feet
+    speed: float # in knots
+    heading: float # 0 is north, 90 is east, 180 is south, 270 is west
 
     def __str__(self):
         return f"{self.id} {self.flightNumber} {self.latitude} {self.longitude} {self.altitude} {self.speed} {self.heading}"
-    
+
+
+@dataclass(slots=True)
+class FlightResult:
+    """
+    What one request found out about a flight.
+    """
+    flight: ProcessedFlightInfo
+    entry: datetime = 0
+    exit: datetime = 0
+    RA: float = -1 # init to -1 to indicate not set
+    Dec: float = -1 # caution, declination can also be -1
+
     def to_dict(self):
         """ Convert object to JSON-serializable dictionary. """
         return {
-            "id": self.id,
-            "flight_number": self.flightNumber,
-            "altitude": self.altitude,
-            "heading": self.heading,
-            "latitude": self.latitude,
-            "longitude": self.longitude,
-            "speed": self.speed,
+            "id": str(self.flight.id),
+            "flight_number": self.flight.flightNumber,
+            "altitude": self.flight.altitude,
+            "heading": self.flight.heading,
+            "latitude": self.flight.latitude,
+            "longitude": self.flight.longitude,
+            "speed": self.flight.speed,
             "entry": self.entry.isoformat() if self.entry else None,  # Convert datetime to string
             "exit": self.exit.isoformat() if self.exit else None,  # Convert datetime to string
         }
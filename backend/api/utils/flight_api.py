@@ -1,11 +1,23 @@
 ### Functions that interact with the flight API ###
+from __future__ import annotations
 
 ## API documentation: https://jeanextreme002.github.io/FlightRadarAPI/
 ## Note: Coordinates are in the format (latitude, longitude). Latitude is y, longitude is x. Positive is east/north, negative is west/south. E.g. Toronto's coordinates are (43.7, -79.42).
 
-from FlightRadar24 import FlightRadar24API
-from utils.datatypes import ProcessedFlightInfo
-import uuid
+from utils.datatypes import ProcessedFlightInfo, stable_flight_id
+from utils.constants import EARTH_RADIUS_METER
+from concurrent.futures import Future
+from typing import TYPE_CHECKING
+import math
+import os
+import threading
+import time
+
+if TYPE_CHECKING:
+    from FlightRadar24 import FlightRadar24API
+
+FLIGHT_CACHE_TTL = float(os.environ.get("FLIGHT_CACHE_TTL", 10)) # seconds a snapshot of a tile is served from the cache
+FLIGHT_CACHE_TILE_SIZE = float(os.environ.get("FLIGHT_CACHE_TILE_SIZE", 2)) # tile size in degrees of latitude/longitude
 
 # Given a list of flight objects obtained from calling the FR24 API, 
 # return a list of dictionaries with the flight's flight number, coordinates, altitude, speed, and heading
@@ -13,7 +25,7 @@ def get_flight_info(flights):
     flight_info: list[ProcessedFlightInfo] = []
     for flight in flights:
         flight_info.append(ProcessedFlightInfo(
-            id=uuid.uuid4(),
+            id=stable_flight_id("fr24", flight.id),
             flightNumber=flight.number,
             latitude=flight.latitude,
             longitude=flight.longitude,
@@ -25,22 +37,224 @@ def get_flight_info(flights):
     return flight_info
 
 
+class FlightRadar24Provider:
+    """
+    Fetches flights from FlightRadar24, reusing a single API client.
+    """
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def client(self) -> FlightRadar24API:
+        with self._lock:
+            if self._client is None:
+                # slow to import, and not needed by simulated predictions
+                from FlightRadar24 import FlightRadar24API
+                self._client = FlightRadar24API()
+            return self._client
+
+    def get_flights(self, north: float, south: float, west: float, east: float) -> list[ProcessedFlightInfo]:
+        bounds = f"{north},{south},{west},{east}"
+        return get_flight_info(self.client().get_flights(bounds=bounds))
+
+
+class StaticFlightProvider:
+    """
+    Local stand-in for FlightRadar24 that serves a fixed list of flights, so the
+    snapshot cache can be used and tested offline. Counts the upstream calls it receives.
+    """
+    def __init__(self, flights: list[ProcessedFlightInfo], delay: float = 0):
+        self.flights = flights
+        self.delay = delay # seconds each call takes, to simulate the network
+        self.calls = 0
+        self.bounds = [] # north, south, west, east of each call
+
+    def get_flights(self, north: float, south: float, west: float, east: float) -> list[ProcessedFlightInfo]:
+        self.calls += 1
+        self.bounds.append((north, south, west, east))
+        if self.delay:
+            time.sleep(self.delay)
+        return [flight for flight in self.flights
+                if south <= flight.latitude <= north and west <= flight.longitude <= east]
+
+
+class FlightSnapshotCache:
+    """
+    Snapshots of the flights in each geographic tile, kept for ttl seconds.
+    A request fetches every missing or expired tile it needs in one upstream call (two across the antimeridian);
+    concurrent requests that need a tile being fetched wait for that fetch instead of starting their own.
+
+    Only the part of the tiles inside the requested rectangle is fetched, so a
+    fetch never covers more than the rectangle itself, however it falls on the
+    tiles. Each snapshot keeps the bounds it covers, and serves the later
+    requests that need no more of its tile than that.
+    """
+    def __init__(self, provider, ttl: float = FLIGHT_CACHE_TTL, tile_size: float = FLIGHT_CACHE_TILE_SIZE, clock=time.monotonic):
+        self.provider = provider
+        self.ttl = ttl
+        self.tile_size = tile_size
+        self.clock = clock
+        # tile -> (fetched at, flights, north/south/west/east of the part of the tile fetched)
+        self._tiles: dict[tuple[int, int], tuple[float, list[ProcessedFlightInfo], tuple[float, float, float, float]]] = {}
+        self._pending: dict[tuple[int, int], Future] = {}
+        self._lock = threading.Lock()
+
+    def tiles_in_rect(self, min_lon, min_lat, max_lon, max_lat) -> list[tuple[int, int]]:
+        """
+        The tiles covering a rectangle. min_lon can be greater than max_lon if the rectangle crosses the antimeridian.
+        """
+        rows = range(self._row(max(min_lat, -90)), self._row(min(max_lat, 90)) + 1)
+        columns = self._column_range(min_lon, max_lon)
+        return [(row, column) for row in rows for column in columns]
+
+    def get_flights_in_rect(self, min_lon, min_lat, max_lon, max_lat) -> list[ProcessedFlightInfo]:
+        """
+        All flights within a rectangle, from snapshots at most ttl seconds old.
+        """
+        needs = {tile: self._tile_part(tile, min_lon, min_lat, max_lon, max_lat)
+                 for tile in self.tiles_in_rect(min_lon, min_lat, max_lon, max_lat)}
+        flights = []
+        for tile_flights in self._get_tiles(needs):
+            flights.extend(tile_flights)
+        return [flight for flight in flights if min_lat <= flight.latitude <= max_lat and
+                (min_lon <= flight.longitude <= max_lon if min_lon <= max_lon else not max_lon < flight.longitude < min_lon)]
+
+    def get_flights_in_circ_boundary(self, lat, lon, radius) -> list[ProcessedFlightInfo]:
+        """
+        All flights within the bounding box of a circle of radius meters around a point, like FR24's get_bounds_by_point.
+        """
+        delta_lat = math.degrees(radius / EARTH_RADIUS_METER)
+        cos_lat = math.cos(math.radians(lat))
+        delta_lon = 180 if cos_lat < 1e-6 else min(math.degrees(radius / (EARTH_RADIUS_METER * cos_lat)), 180)
+        if delta_lon >= 180:
+            return self.get_flights_in_rect(-180, lat - delta_lat, 180, lat + delta_lat)
+        min_lon = (lon - delta_lon + 180) % 360 - 180
+        max_lon = (lon + delta_lon + 180) % 360 - 180
+        return self.get_flights_in_rect(min_lon, lat - delta_lat, max_lon, lat + delta_lat)
+
+    def clear(self):
+        with self._lock:
+            self._tiles.clear()
+
+    def _row(self, lat) -> int:
+        return min(math.floor((lat + 90) / self.tile_size), math.ceil(180 / self.tile_size) - 1)
+
+    def _column(self, lon) -> int:
+        return min(math.floor((lon + 180) / self.tile_size), self._columns() - 1)
+
+    def _columns(self) -> int:
+        return math.ceil(360 / self.tile_size)
+
+    def _column_range(self, min_lon, max_lon) -> list[int]:
+        first, last = self._column(min_lon), self._column(max_lon)
+        if min_lon <= max_lon:
+            return list(range(first, last + 1))
+        return list(range(first, self._columns())) + list(range(0, last + 1))
+
+    def _tile_bounds(self, tiles) -> tuple[float, float, float, float]:
+        """ north, south, west, east of a set of tiles that does not cross the antimeridian """
+        rows = [row for row, _ in tiles]
+        columns = [column for _, column in tiles]
+        return (min((max(rows) + 1) * self.tile_size - 90, 90), min(rows) * self.tile_size - 90,
+                min(columns) * self.tile_size - 180, min((max(columns) + 1) * self.tile_size - 180, 180))
+
+    def _tile_part(self, tile, min_lon, min_lat, max_lon, max_lat) -> tuple[float, float, float, float]:
+        """ north, south, west, east of the part of a tile inside a rectangle, see tiles_in_rect """
+        north, south, west, east = self._tile_bounds([tile])
+        if min_lon > max_lon:
+            # the tile is on one side of the antimeridian, or holds both ends of the rectangle
+            west_side, east_side = tile[1] >= self._column(min_lon), tile[1] <= self._column(max_lon)
+            min_lon, max_lon = (west, east) if west_side and east_side else (min_lon, east) if west_side else (west, max_lon)
+        return min(max_lat, north), max(min_lat, south), max(min_lon, west), min(max_lon, east)
+
+    @staticmethod
+    def _covers(bounds, part) -> bool:
+        return bounds[0] >= part[0] and bounds[1] <= part[1] and bounds[2] <= part[2] and bounds[3] >= part[3]
+
+    def _get_tiles(self, needs: dict[tuple[int, int], tuple[float, float, float, float]]) -> list[list[ProcessedFlightInfo]]:
+        """ The flights of each tile, from a snapshot covering at least the part of it needed, see _tile_part. """
+        now = self.clock()
+        owned, waiting, results = [], [], {}
+        with self._lock:
+            for tile, part in needs.items():
+                cached = self._tiles.get(tile)
+                if cached is not None and now - cached[0] < self.ttl and self._covers(cached[2], part):
+                    results[tile] = cached[1]
+                elif tile in self._pending:
+                    waiting.append(tile)
+                else:
+                    self._pending[tile] = Future()
+                    owned.append(tile)
+            futures = {tile: self._pending[tile] for tile in owned + waiting}
+
+        if owned:
+            self._fetch({tile: needs[tile] for tile in owned}, futures)
+        missing = {}
+        for tile in owned + waiting:
+            flights, bounds = futures[tile].result()
+            if self._covers(bounds, needs[tile]):
+                results[tile] = flights
+            else:
+                # the fetch we waited for was for another part of the tile
+                missing[tile] = needs[tile]
+        if missing:
+            results.update(zip(missing, self._get_tiles(missing)))
+        return [results[tile] for tile in needs]
+
+    def _fetch(self, needs, futures):
+        tiles = list(needs)
+        # one upstream call per side of the antimeridian
+        half = self._columns() / 2
+        groups = [group for group in ([tile for tile in tiles if tile[1] < half], [tile for tile in tiles if tile[1] >= half]) if group]
+        if len(groups) == 2 and not (any(tile[1] == 0 for tile in tiles) and any(tile[1] == self._columns() - 1 for tile in tiles)):
+            groups = [tiles]
+
+        try:
+            fetched = {tile: [] for tile in tiles}
+            bounds = {}
+            for group in groups:
+                # the smallest box around the parts needed, within the requested rectangle
+                parts = [needs[tile] for tile in group]
+                box = (max(part[0] for part in parts), min(part[1] for part in parts), min(part[2] for part in parts),
+                       max(part[3] for part in parts))
+                for tile in group:
+                    north, south, west, east = self._tile_bounds([tile])
+                    bounds[tile] = (min(box[0], north), max(box[1], south), max(box[2], west), min(box[3], east))
+                for flight in self.provider.get_flights(*box):
+                    tile = (self._row(flight.latitude), self._column(flight.longitude))
+                    if tile in fetched:
+                        fetched[tile].append(flight)
+        except Exception as e:
+            with self._lock:
+                for tile in tiles:
+                    self._pending.pop(tile, None)
+            for tile in tiles:
+                futures[tile].set_exception(e)
+            return
+
+        fetched_at = self.clock()
+        with self._lock:
+            for tile in tiles:
+                self._tiles[tile] = (fetched_at, fetched[tile], bounds[tile])
+                self._pending.pop(tile, None)
+        for tile in tiles:
+            futures[tile].set_result((fetched[tile], bounds[tile]))
+
+
+flight_provider = FlightRadar24Provider()
+flight_cache = FlightSnapshotCache(flight_provider)
+
+
 # Given the min and max lat/lon points of a rectangle, 
 # return all flights that are within that rectangle along with their coordinates, altitude, speed, and heading
 def find_flights_in_rect_boundary(min_lon, min_lat, max_lon, max_lat) -> list[ProcessedFlightInfo]:
-    fr_api = FlightRadar24API()
-    bounds = f"{max_lat},{min_lat},{min_lon},{max_lon}" #north, south, west, east
-    flights = fr_api.get_flights(bounds=bounds)
-    return get_flight_info(flights)
+    return flight_cache.get_flights_in_rect(min_lon, min_lat, max_lon, max_lat)
 
 
 # Given a lat/lon point and a radius in meters, 
 # return all flights that are within that radius of that point
 def find_flights_in_circ_boundary(lat, lon, radius) -> list[ProcessedFlightInfo]:
-    fr_api = FlightRadar24API()
-    bounds = fr_api.get_bounds_by_point(lat, lon, radius)
-    flights = fr_api.get_flights(bounds=bounds)
-    return get_flight_info(flights)
+    return flight_cache.get_flights_in_circ_boundary(lat, lon, radius)
 
 if __name__ == "__main__":
     # Example usage
@@ -0,0 +1,234 @@
+"""
+File to record snapshots of live flights on disk and replay them offline, for predictions at past times.
+
+A recording is a directory of flat binary column files, one value per flight
+of every snapshot appended one after the other (see HISTORY_COLUMNS), and a
+time index of two more columns: the unix time of every snapshot and the row
+where it ends. FlightRecorder appends a snapshot to the columns first and to
+the index last, so a reader never sees a snapshot that is only partly written.
+
+FlightHistory memory-maps the files instead of loading them, so a request for
+a past time only reads the time index, found by binary search, and the rows of
+one snapshot. The flights of the latest snapshot at or before the requested
+time are moved forward to it with the configured motion model, like the
+snapshots of the live poller (see flight_index). Nothing is fetched, so
+historical predictions work offline.
+
+Recording: set FLIGHT_RECORDER_PATH to record every snapshot of the live
+poller (see flight_index.start_poller_from_env), or run this file with a region.
+"""
+import os
+import threading
+import uuid
+from dataclasses import dataclass
+
+import numpy as np
+
+import utils.batch as batch
+from utils.datatypes import ProcessedFlightInfo
+from utils.flight_index import dead_reckon, haversine
+
+FLIGHT_HISTORY_PATH = os.environ.get("FLIGHT_HISTORY_PATH") # recording answering "historical" requests
+FLIGHT_HISTORY_MAX_GAP = float(os.environ.get("FLIGHT_HISTORY_MAX_GAP", 60)) # seconds a snapshot is used after it was taken
+
+# column files of a recording, one row per flight of every snapshot
+HISTORY_COLUMNS = {
+    "flight_id": np.dtype("V16"), # ProcessedFlightInfo.id
+    "flight_number": np.dtype("S16"),
+    "latitude": np.dtype("<f8"),
+    "longitude": np.dtype("<f8"),
+    "altitude": np.dtype("<f4"), # feet
+    "speed": np.dtype("<f4"), # knots
+    "heading": np.dtype("<f4"),
+}
+# time index, one row per snapshot
+INDEX_COLUMNS = {
+    "snapshot_time": np.dtype("<f8"), # unix time
+    "snapshot_end": np.dtype("<i8"), # row after the last flight of the snapshot
+}
+
+
+def column_path(path: str, name: str) -> str:
+    return os.path.join(path, f"{name}.bin")
+
+
+class FlightRecorder:
+    """
+    Appends snapshots of flights to a recording, created if needed.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.rows = self._recover()
+
+    def _recover(self) -> int:
+        """ Drop what an interrupted append wrote past the last indexed snapshot, and return its end row. """
+        ends_path = column_path(self.path, "snapshot_end")
+        snapshots = os.path.getsize(ends_path) // INDEX_COLUMNS["snapshot_end"].itemsize if os.path.exists(ends_path) else 0
+        rows = int(np.fromfile(ends_path, dtype=INDEX_COLUMNS["snapshot_end"], offset=(snapshots - 1) * INDEX_COLUMNS["snapshot_end"].itemsize)[0]) if snapshots else 0
+        for columns, count in ((HISTORY_COLUMNS, rows), (INDEX_COLUMNS, snapshots)):
+            for name, dtype in columns.items():
+                with open(column_path(self.path, name), "ab") as file:
+                    file.truncate(count * dtype.itemsize)
+        return rows
+
+    def append(self, snapshot_time: float, flights: list[ProcessedFlightInfo]):
+        """
+        Record the flights seen at a time, which must not be before the last recorded snapshot.
+        :param snapshot_time: unix time of the snapshot.
+        """
+        columns = {
+            "flight_id": np.array([flight.id.bytes for flight in flights], dtype=HISTORY_COLUMNS["flight_id"]),
+            "flight_number": np.array([str(flight.flightNumber).encode()[:16] for flight in flights], dtype=HISTORY_COLUMNS["flight_number"]),
+        }
+        for name in ("latitude", "longitude", "altitude", "speed", "heading"):
+            columns[name] = np.array([getattr(flight, name) for flight in flights], dtype=HISTORY_COLUMNS[name])
+
+        with self._lock:
+            last_time = self._last_time()
+            if last_time is not None and snapshot_time < last_time:
+                raise ValueError(f"Snapshot at {snapshot_time} is before the last recorded snapshot at {last_time}.")
+            for name, values in columns.items():
+                with open(column_path(self.path, name), "ab") as file:
+                    file.write(values.tobytes())
+            self.rows += len(flights)
+            # the index last, once the rows it points to are written
+            for name, value in (("snapshot_time", snapshot_time), ("snapshot_end", self.rows)):
+                with open(column_path(self.path, name), "ab") as file:
+                    file.write(np.array([value], dtype=INDEX_COLUMNS[name]).tobytes())
+
+    def _last_time(self) -> float:
+        path = column_path(self.path, "snapshot_time")
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as file:
+            file.seek(-INDEX_COLUMNS["snapshot_time"].itemsize, os.SEEK_END)
+            return float(np.frombuffer(file.read(), dtype=INDEX_COLUMNS["snapshot_time"])[0])
+
+
+@dataclass(slots=True)
+class HistoricalSnapshot:
+    """
+    The recorded flights of one snapshot, as read-only views on the memory-mapped columns.
+    """
+    snapshot_time: float
+    columns: dict[str, np.ndarray]
+
+    def __len__(self):
+        return len(self.columns["latitude"])
+
+    def flights_in_radius(self, lat: float, lon: float, radius: float, at_time: float) -> list[ProcessedFlightInfo]:
+        """
+        Flights within radius meters of a point at a given time, see FlightIndex.flights_in_radius.
+        :param at_time: unix time the flights are moved forward to.
+        :return: The flights at their dead-reckoned position, in the order they were recorded.
+        """
+        flights = {
+            "speed": np.asarray(self.columns["speed"], dtype=float).reshape(-1, 1) * batch.KNOTS_TO_METERS_PER_SECOND,
+            "altitude": np.asarray(self.columns["altitude"], dtype=float).reshape(-1, 1) * batch.FEET_TO_METERS,
+            "heading": np.asarray(self.columns["heading"], dtype=float).reshape(-1, 1),
+            "latitude": np.asarray(self.columns["latitude"]).reshape(-1, 1),
+            "longitude": np.asarray(self.columns["longitude"]).reshape(-1, 1),
+        }
+        time_shift = max(at_time - self.snapshot_time, 0)
+        # the recorded positions are exact at the time of the snapshot
+        latitude, longitude = dead_reckon(flights, time_shift) if time_shift else (flights["latitude"], flights["longitude"])
+        latitude, longitude = latitude.reshape(-1), longitude.reshape(-1)
+        inside = np.flatnonzero(haversine(lat, lon, latitude, longitude) <= radius)
+
+        return [ProcessedFlightInfo(id=uuid.UUID(bytes=self.columns["flight_id"][index].tobytes()),
+                                    flightNumber=self.columns["flight_number"][index].decode(),
+                                    latitude=float(latitude[index]), longitude=float(longitude[index]),
+                                    altitude=float(self.columns["altitude"][index]), speed=float(self.columns["speed"][index]),
+                                    heading=float(self.columns["heading"][index]))
+                for index in inside]
+
+
+class FlightHistory:
+    """
+    Read-only access to a recording, which may still be appended to by a FlightRecorder.
+    """
+    def __init__(self, path: str, max_gap: float = FLIGHT_HISTORY_MAX_GAP):
+        self.path = path
+        self.max_gap = max_gap
+        self._maps: dict[str, np.ndarray] = dict()
+        self._sizes: dict[str, int] = dict()
+        self._lock = threading.Lock()
+
+    def _column(self, name: str, dtype: np.dtype) -> np.ndarray:
+        """ The memory-mapped column, mapped again if the recording grew. """
+        path = column_path(self.path, name)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        with self._lock:
+            if self._sizes.get(name) != size:
+                rows = size // dtype.itemsize
+                self._maps[name] = np.memmap(path, dtype=dtype, mode="r", shape=(rows,)) if rows else np.zeros(0, dtype=dtype)
+                self._sizes[name] = size
+            return self._maps[name]
+
+    def __len__(self):
+        """ The number of snapshots. """
+        return len(self._column("snapshot_end", INDEX_COLUMNS["snapshot_end"]))
+
+    def time_range(self) -> tuple[float, float]:
+        """ The unix times of the first and the last snapshot, None if there is none. """
+        times = self._column("snapshot_time", INDEX_COLUMNS["snapshot_time"])
+        return (float(times[0]), float(times[-1])) if len(times) else None
+
+    def snapshot_at(self, at_time: float) -> HistoricalSnapshot:
+        """
+        The latest snapshot taken at or before a time.
+        :param at_time: unix time.
+        :raise ValueError: If no snapshot was taken in the max_gap seconds before the time.
+        """
+        ends = self._column("snapshot_end", INDEX_COLUMNS["snapshot_end"])
+        # the times may have one more row than the ends while a snapshot is being written
+        times = self._column("snapshot_time", INDEX_COLUMNS["snapshot_time"])[:len(ends)]
+        index = int(np.searchsorted(times, at_time, side="right")) - 1
+        if index < 0 or at_time - times[index] > self.max_gap:
+            raise ValueError(f"No flights were recorded in the {self.max_gap:g} seconds before the requested time.")
+
+        start, end = (int(ends[index - 1]) if index else 0), int(ends[index])
+        columns = {name: self._column(name, dtype)[start:end] for name, dtype in HISTORY_COLUMNS.items()}
+        return HistoricalSnapshot(float(times[index]), columns)
+
+
+_history: FlightHistory = None
+
+
+def get_flight_history() -> FlightHistory:
+    """
+    The recording at FLIGHT_HISTORY_PATH.
+    :raise ValueError: If FLIGHT_HISTORY_PATH is not set.
+    """
+    global _history
+    if FLIGHT_HISTORY_PATH is None:
+        raise ValueError("Historical flights are not available, FLIGHT_HISTORY_PATH is not set.")
+    if _history is None or _history.path != FLIGHT_HISTORY_PATH:
+        _history = FlightHistory(FLIGHT_HISTORY_PATH)
+    return _history
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    import utils.flight_api as flight_api
+    from utils.flight_index import FlightFeedPoller, FLIGHT_POLLER_INTERVAL
+
+    parser = argparse.ArgumentParser(description="Record the live flights of a region for historical predictions.")
+    parser.add_argument("path", help="directory of the recording, appended to if it exists")
+    parser.add_argument("--region", required=True, help="latitude,longitude,radius in meters")
+    parser.add_argument("--interval", type=float, default=FLIGHT_POLLER_INTERVAL, help="seconds between two snapshots")
+    args = parser.parse_args()
+
+    lat, lon, radius = (float(value) for value in args.region.split(","))
+    recorder = FlightRecorder(args.path)
+    poller = FlightFeedPoller(flight_api.flight_provider, lat, lon, radius, args.interval, recorder=recorder)
+    while True:
+        try:
+            poller.poll_once()
+        except Exception as e:
+            print(f"Snapshot failed: {e}")
+        time.sleep(args.interval)
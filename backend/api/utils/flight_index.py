@@ -0,0 +1,227 @@
+"""
+File to keep live flights in memory, refreshed by a background poller, so live
+requests can be answered without waiting on the flight API.
+
+The flights of a configured region are fetched every few seconds and stored in
+a FlightIndex, a lat/lon grid of flight indices. A radius query only looks at
+the grid cells around the point, and moves every candidate forward from the
+time of the snapshot to the time of the request with the configured motion model.
+"""
+import math
+import multiprocessing
+import os
+import threading
+import time
+import dataclasses
+
+import numpy as np
+
+import utils.batch as batch
+from utils.datatypes import ProcessedFlightInfo
+from utils.constants import EARTH_RADIUS_METER, AIRPLANE_MAX_SPEED
+
+FLIGHT_INDEX_CELL_SIZE = 0.5 # degrees of latitude/longitude per grid cell
+FLIGHT_POLLER_INTERVAL = float(os.environ.get("FLIGHT_POLLER_INTERVAL", 5)) # seconds between two fetches
+FLIGHT_POLLER_MAX_AGE = 3 # number of intervals after which a snapshot is too old to be used
+
+
+def dead_reckon(flights: dict[str, np.ndarray], time_shift) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Move flights forward in time with the configured motion model, see batch.flight_positions.
+    :param flights: The flights as column arrays, see batch.flight_arrays.
+    :param time_shift: Seconds to move the flights forward.
+    :return: The new latitudes and longitudes in degrees.
+    """
+    theta, phi = batch.flight_positions(flights, time_shift)
+    latitude = 90 - np.degrees(phi)
+    longitude = np.degrees(theta)
+    # keep the original position where the model is undefined (over a pole)
+    latitude = np.where(np.isnan(theta), flights["latitude"], latitude)
+    longitude = np.where(np.isnan(theta), flights["longitude"], np.where(longitude > 180, longitude - 360, longitude))
+    return latitude, longitude
+
+
+def haversine(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    Batch version of fov.haversine, in meters.
+    """
+    lat1, lon1, lat2, lon2 = map(np.radians, [lat1, lon1, lat2, lon2])
+    a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon1 - lon2) / 2)**2
+    return 2 * np.arcsin(np.sqrt(np.clip(a, 0, 1))) * EARTH_RADIUS_METER
+
+
+class FlightIndex:
+    """
+    Immutable snapshot of flights, bucketed by lat/lon grid cell.
+    """
+    def __init__(self, flights: list[ProcessedFlightInfo], snapshot_time: float, cell_size: float = FLIGHT_INDEX_CELL_SIZE):
+        self.flights = flights
+        self.snapshot_time = snapshot_time # unix time of the snapshot
+        self.cell_size = cell_size
+        self.arrays = batch.flight_arrays(flights)
+        self.max_speed = max(float(self.arrays["speed"].max(initial=0)), AIRPLANE_MAX_SPEED / 3.6)
+
+        cells: dict[tuple[int, int], list[int]] = {}
+        for index, flight in enumerate(flights):
+            cells.setdefault(self._cell(flight.latitude, flight.longitude), []).append(index)
+        self.cells = {cell: np.array(indices) for cell, indices in cells.items()}
+
+    def __len__(self):
+        return len(self.flights)
+
+    def _cell(self, lat, lon) -> tuple[int, int]:
+        return (math.floor(lat / self.cell_size), math.floor(((lon + 180) % 360) / self.cell_size))
+
+    def _candidates(self, lat, lon, radius) -> np.ndarray:
+        """ indices of the flights in every cell that touches the bounding box of the circle """
+        if radius >= math.pi * EARTH_RADIUS_METER / 2:
+            return np.arange(len(self.flights))
+        delta_lat = math.degrees(radius / EARTH_RADIUS_METER)
+        cos_lat = math.cos(math.radians(min(abs(lat) + delta_lat, 90)))
+        delta_lon = 180 if cos_lat < 1e-6 else min(math.degrees(radius / (EARTH_RADIUS_METER * cos_lat)), 180)
+
+        rows = range(math.floor((lat - delta_lat) / self.cell_size), math.floor((lat + delta_lat) / self.cell_size) + 1)
+        columns_count = math.ceil(360 / self.cell_size)
+        if delta_lon >= 180:
+            columns = range(columns_count)
+        else:
+            first = math.floor((lon - delta_lon + 180) / self.cell_size)
+            last = math.floor((lon + delta_lon + 180) / self.cell_size)
+            columns = sorted({column % columns_count for column in range(first, last + 1)})
+
+        found = [self.cells[(row, column)] for row in rows for column in columns if (row, column) in self.cells]
+        return np.concatenate(found) if found else np.zeros(0, dtype=int)
+
+    def flights_in_radius(self, lat: float, lon: float, radius: float, at_time: float = None) -> list[ProcessedFlightInfo]:
+        """
+        Flights within radius meters of a point at a given time.
+        :param at_time: unix time the flights are moved forward to, default is now.
+        :return: The flights at their dead-reckoned position.
+        """
+        if at_time is None:
+            at_time = time.time()
+        time_shift = max(at_time - self.snapshot_time, 0)
+
+        # a flight may have flown into the circle since the snapshot
+        candidates = self._candidates(lat, lon, radius + self.max_speed * time_shift)
+        if not len(candidates):
+            return []
+
+        flights = {key: value[candidates] for key, value in self.arrays.items()}
+        latitude, longitude = dead_reckon(flights, time_shift)
+        inside = haversine(lat, lon, latitude, longitude).reshape(-1) <= radius
+
+        result = []
+        for index, flight_lat, flight_lon in zip(candidates[inside], latitude.reshape(-1)[inside], longitude.reshape(-1)[inside]):
+            result.append(dataclasses.replace(self.flights[index], latitude=float(flight_lat), longitude=float(flight_lon)))
+        return result
+
+
+class FlightFeedPoller:
+    """
+    Refreshes the flights of a region into a FlightIndex in a background thread.
+    """
+    def __init__(self, provider, lat: float, lon: float, radius: float, interval: float = FLIGHT_POLLER_INTERVAL,
+                 clock=time.time, recorder=None):
+        """
+        :param recorder: If given, every snapshot is also appended to it, see flight_history.FlightRecorder.
+        """
+        self.provider = provider
+        self.lat, self.lon, self.radius = lat, lon, radius
+        self.interval = interval
+        self.clock = clock
+        self.recorder = recorder
+        self.index: FlightIndex = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def covers(self, lat: float, lon: float, radius: float) -> bool:
+        """ Whether a query circle lies entirely within the polled region. """
+        return float(haversine(self.lat, self.lon, lat, lon)) + radius <= self.radius
+
+    def fresh_index(self) -> FlightIndex:
+        """ The latest index, or None if there is none or it is too old to be used. """
+        index = self.index
+        if index is None or self.clock() - index.snapshot_time > FLIGHT_POLLER_MAX_AGE * self.interval:
+            return None
+        return index
+
+    def poll_once(self):
+        snapshot_time = self.clock()
+        delta_lat = math.degrees(self.radius / EARTH_RADIUS_METER)
+        cos_lat = max(math.cos(math.radians(min(abs(self.lat) + delta_lat, 90))), 1e-6)
+        delta_lon = min(math.degrees(self.radius / (EARTH_RADIUS_METER * cos_lat)), 180)
+        west, east = self.lon - delta_lon, self.lon + delta_lon
+        # a region across the antimeridian is fetched as two boxes, one on each side
+        if delta_lon >= 180:
+            boxes = [(-180, 180)]
+        elif west < -180:
+            boxes = [(west + 360, 180), (-180, east)]
+        elif east > 180:
+            boxes = [(west, 180), (-180, east - 360)]
+        else:
+            boxes = [(west, east)]
+        # a flight on the antimeridian is in both boxes
+        flights = list({flight.id: flight for min_lon, max_lon in boxes
+                        for flight in self.provider.get_flights(min(self.lat + delta_lat, 90), max(self.lat - delta_lat, -90),
+                                                                min_lon, max_lon)}.values())
+        self.index = FlightIndex(flights, snapshot_time)
+        if self.recorder is not None:
+            self.recorder.append(snapshot_time, flights)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="flight-feed-poller", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.poll_once()
+            except Exception:
+                # keep serving the previous snapshot until it gets too old, then requests fall back to the flight api
+                pass
+            self._stop.wait(self.interval)
+
+
+poller: FlightFeedPoller = None
+
+
+def start_poller_from_env(provider) -> FlightFeedPoller:
+    """
+    Start the background poller if FLIGHT_POLLER_REGION is set to "latitude,longitude,radius in meters".
+    Its snapshots are recorded for historical predictions if FLIGHT_RECORDER_PATH is set (see flight_history).
+    """
+    global poller
+    region = os.environ.get("FLIGHT_POLLER_REGION")
+    # worker processes (see compute_pool) import the app again, only the server polls
+    if not region or poller is not None or multiprocessing.parent_process() is not None:
+        return poller
+    lat, lon, radius = (float(value) for value in region.split(","))
+    recorder = None
+    if os.environ.get("FLIGHT_RECORDER_PATH"):
+        # flight_history imports this module
+        from utils.flight_history import FlightRecorder
+        recorder = FlightRecorder(os.environ["FLIGHT_RECORDER_PATH"])
+    poller = FlightFeedPoller(provider, lat, lon, radius, recorder=recorder)
+    poller.start()
+    return poller
+
+
+def find_flights_in_radius(lat: float, lon: float, radius: float) -> list[ProcessedFlightInfo]:
+    """
+    Flights within radius meters of a point from the background poller's index,
+    or None if the poller is not running, has no recent snapshot, or does not cover the circle.
+    """
+    if poller is None or not poller.covers(lat, lon, radius):
+        return None
+    index = poller.fresh_index()
+    if index is None:
+        return None
+    return index.flights_in_radius(lat, lon, radius, poller.clock())
@@ -0,0 +1,90 @@
+"""
+File to move flights along great circles, as a rotation of their position about a fixed axis.
+
+A flight flying straight at constant speed and altitude stays on the great circle
+through its position along its heading. In Earth-centered Earth-fixed (ECEF)
+coordinates, that is a rotation of the initial position about the circle's axis
+at a constant angular rate. FlightMotion computes, once per flight, the initial
+unit position p0, the unit direction of travel d (the axis crossed with p0) and
+the angular rate w, so the position at any elapsed time t is
+
+    (R + h) * (p0 * cos(w t) + d * sin(w t))
+
+for all flights and timesteps at once, with no special case at the poles.
+
+Agreement with flight_trajectory: both start at the same position with the same
+heading and speed, so they agree to first order in time. The flight_trajectory
+model keeps the angular speeds of its first instant, so the two drift apart as
+the great circle turns away from the initial heading: for |latitude| <= 70 the
+difference stays under MOTION_MODEL_TOLERANCE of the distance flown for
+exposures up to MOTION_MODEL_VALID_SECONDS. Beyond that, and near the poles
+where flight_trajectory is undefined, the great circle is the better model.
+"""
+import math
+import os
+
+import numpy as np
+
+from utils.constants import EARTH_RADIUS_METER
+
+MOTION_MODEL = os.environ.get("MOTION_MODEL", "dawson") # "dawson" (flight_trajectory) or "great-circle" (FlightMotion)
+MOTION_MODELS = ("dawson", "great-circle")
+MOTION_MODEL_VALID_SECONDS = 120 # exposure over which both models agree within MOTION_MODEL_TOLERANCE
+MOTION_MODEL_TOLERANCE = 0.01 # max position difference between the models, as a fraction of the distance flown
+
+
+class FlightMotion:
+    """
+    The great-circle motion of flights given as column arrays (see batch.flight_arrays).
+    All arrays keep the shape of the flight columns, so positions broadcast against elapsed times
+    the same way as the flight_trajectory functions of batch.
+    """
+    def __init__(self, flights: dict[str, np.ndarray]):
+        """
+        :param flights: speed in m/s, altitude in meters, heading, latitude and longitude in degrees.
+        """
+        latitude, longitude = np.radians(flights["latitude"]), np.radians(flights["longitude"])
+        heading = np.radians(flights["heading"])
+        sin_lat, cos_lat = np.sin(latitude), np.cos(latitude)
+        sin_lon, cos_lon = np.sin(longitude), np.cos(longitude)
+        sin_heading, cos_heading = np.sin(heading), np.cos(heading)
+
+        self.radius = EARTH_RADIUS_METER + flights["altitude"]
+        self.rate = flights["speed"] / self.radius # radians per second
+        # initial position on the unit sphere
+        self.position = (cos_lat * cos_lon, cos_lat * sin_lon, sin_lat)
+        # direction of travel, the heading measured from north towards east
+        self.direction = (-cos_heading * sin_lat * cos_lon - sin_heading * sin_lon,
+                          -cos_heading * sin_lat * sin_lon + sin_heading * cos_lon,
+                          cos_heading * cos_lat)
+
+    def ecef(self, elapsed_times) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The ECEF positions of the flights, x towards longitude 0 and z towards the north pole.
+        :param elapsed_times: The elapsed times in seconds, broadcastable against the flight columns.
+        :return: x, y and z in meters.
+        """
+        angle = self.rate * elapsed_times
+        cos_angle, sin_angle = np.cos(angle), np.sin(angle)
+        return tuple(self.radius * (position * cos_angle + direction * sin_angle)
+                     for position, direction in zip(self.position, self.direction))
+
+    def theta_phi(self, elapsed_times) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The positions of the flights in the angles of flight_trajectory.
+        :param elapsed_times: The elapsed times in seconds, broadcastable against the flight columns.
+        :return: theta (longitude in [0, 2pi)) and phi (colatitude in [0, pi]) in radians.
+        """
+        x, y, z = self.ecef(elapsed_times)
+        theta = np.mod(np.arctan2(y, x), 2 * math.pi)
+        phi = np.arctan2(np.hypot(x, y), z)
+        return (theta, phi)
+
+    def lat_lon(self, elapsed_times) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The positions of the flights in degrees.
+        :param elapsed_times: The elapsed times in seconds, broadcastable against the flight columns.
+        :return: latitude and longitude (in [-180, 180]) in degrees.
+        """
+        x, y, z = self.ecef(elapsed_times)
+        return (np.degrees(np.arctan2(z, np.hypot(x, y))), np.degrees(np.arctan2(y, x)))
@@ -1,9 +1,16 @@
 import math
+import numpy as np
 import utils.flight_api as fa
-from utils.datatypes import ProcessedFlightInfo
-import uuid
+import utils.flight_index as flight_index
+import utils.batch as batch
+import utils.simulated_fleet as simulated_fleet
+from utils.datatypes import ProcessedFlightInfo, stable_flight_id
+from utils.localsidereal import SIDEREAL_RATE
 from utils.constants import EARTH_RADIUS_METER, AIRPLANE_MAX_ALT, AIRPLANE_MAX_SPEED
 
+# distance beyond which a flight at the max altitude is below the horizon, in meters
+HORIZON_RADIUS = math.sqrt(math.pow(EARTH_RADIUS_METER + AIRPLANE_MAX_ALT, 2) - math.pow(EARTH_RADIUS_METER, 2))
+
 def calculate_fov_size(focal_length : float, camera_sensor_size : float, barlow_reducer_factor : float) -> float:
     """
     Calculate the field of view size of a telescope.
@@ -37,27 +44,22 @@ def haversine(lat1, lon1, lat2, lon2):
     return c * EARTH_RADIUS_METER
 
 # Determines which simulated flights are inside the boundary.
-def find_simulated_flights_in_horizon(observer_lat, observer_lon, simulated_flights):
-    simulated_flights = [convert_to_processed_flight(flight, idx) for idx, flight in enumerate(simulated_flights)]
-
-    flight_data = []
-    query_radius = math.sqrt(math.pow(EARTH_RADIUS_METER + AIRPLANE_MAX_ALT, 2) - math.pow(EARTH_RADIUS_METER, 2))
-    
-    for flight in simulated_flights:
-        flight_lat = flight.latitude
-        flight_lon = flight.longitude
-        distance = haversine(observer_lat, observer_lon, flight_lat, flight_lon)
-        
-        # If the distance is less than or equal to the radius, the flight is in the horizon
-        if distance <= query_radius:
-            flight_data.append(flight)
-        
-    return flight_data
+# The fleet is parsed into arrays and tested in bulk; only the flights in the horizon become ProcessedFlightInfo.
+# With a fleet_id, the parsed fleet is kept and reused by later requests that send the same id.
+def find_simulated_flights_in_horizon(observer_lat, observer_lon, simulated_flights, fleet_id=None):
+    if isinstance(simulated_flights, simulated_fleet.SimulatedFleet):
+        fleet = simulated_flights
+    else:
+        fleet = simulated_fleet.get_simulated_fleet(simulated_flights, fleet_id)
+    return fleet.processed_flights(fleet.indices_in_radius(observer_lat, observer_lon, HORIZON_RADIUS))
 
 def find_live_flights_in_horizon (observer_lat, observer_lon, fov_size, exposure_time):
     # multiply by 1.5 for extra safety margin
     query_radius = (fov_degrees_to_meters(fov_size, AIRPLANE_MAX_ALT) + (AIRPLANE_MAX_SPEED * exposure_time/3600)) * 1.5
-    flight_data = fa.find_flights_in_circ_boundary(observer_lat, observer_lon, query_radius)    
+    # answer from the background poller's snapshot if it has one, otherwise ask the flight api
+    flight_data = flight_index.find_flights_in_radius(observer_lat, observer_lon, query_radius)
+    if flight_data is None:
+        flight_data = fa.find_flights_in_circ_boundary(observer_lat, observer_lon, query_radius)    
     return flight_data
 
 def remove_ground_flights(flight_data: list[ProcessedFlightInfo]):
@@ -66,9 +68,50 @@ def remove_ground_flights(flight_data: list[ProcessedFlightInfo]):
     """
     return [flight for flight in flight_data if flight.altitude > 1000]  # Filter out flights with altitude <= 1000 feet
 
+def remove_unreachable_flights(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], fov_center: dict[str, float],
+                               fov_size: float, exposure: float, local_sidereal_time: float) -> list[ProcessedFlightInfo]:
+    """
+    remove flights that cannot come within fov_size/2 of the fov center during the exposure.
+    The bound is conservative: a flight is only removed if it is provably out of the fov at every time.
+
+    Starting from its current position, an aircraft flying at most max(speed, AIRPLANE_MAX_SPEED) stays within
+    (|cos(heading)| + |sin(heading)|) * speed * exposure meters, since the trajectory model moves it north-south
+    and east-west separately.
+    Seen from the observer, that ball covers at most asin(travel / distance) around the current direction,
+    and the earth's rotation moves the RA/Dec by at most the sidereal rate times the exposure on top of that.
+    :param local_sidereal_time: The observer's local sidereal time at the start of the exposure, in radians.
+    """
+    if not flight_data:
+        return flight_data
+
+    flights = batch.flight_arrays(flight_data)
+    ra, dec = batch.positions_ra_dec(flights, user_gps, 0, local_sidereal_time)
+    distance = batch.angular_distance(ra, dec, fov_center["RA"], fov_center["Dec"]).reshape(-1)
+
+    # distance between the observer and the aircraft now
+    gps_x, gps_y, gps_z = batch.spherical_to_cartesian(EARTH_RADIUS_METER + user_gps["altitude"],
+                                                       math.radians(user_gps["longitude"]), math.pi / 2 - math.radians(user_gps["latitude"]))
+    aircraft_x, aircraft_y, aircraft_z = batch.spherical_to_cartesian(EARTH_RADIUS_METER + flights["altitude"],
+                                                                      np.radians(flights["longitude"]), np.pi / 2 - np.radians(flights["latitude"]))
+    slant_range = np.sqrt((aircraft_x - gps_x)**2 + (aircraft_y - gps_y)**2 + (aircraft_z - gps_z)**2).reshape(-1)
+
+    max_speed = np.maximum(flights["speed"].reshape(-1), AIRPLANE_MAX_SPEED / 3.6)
+    heading = np.radians(flights["heading"].reshape(-1))
+    travel = (np.abs(np.cos(heading)) + np.abs(np.sin(heading))) * max_speed * max(exposure, 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        reach = np.where(travel < slant_range, np.degrees(np.arcsin(np.clip(travel / slant_range, 0, 1))), 180)
+    reach = reach + math.degrees(SIDEREAL_RATE * max(exposure, 0))
+
+    # the trajectory model is not reliable close to the poles, keep those flights
+    travel_degrees = np.degrees(travel / EARTH_RADIUS_METER)
+    near_pole = np.abs(flights["latitude"].reshape(-1)) + travel_degrees >= 89
+
+    reachable = near_pole | np.isnan(distance) | (distance - reach <= fov_size / 2 + batch.BATCH_TOLERANCE_DEG)
+    return [flight for flight, keep in zip(flight_data, reachable) if keep]
+
 def convert_to_processed_flight(flight_data, flight_number=0):
     return ProcessedFlightInfo(
-        id=uuid.uuid4(),  # Generate a unique ID
+        id=stable_flight_id("simulated", flight_number, flight_data["flightNumber"]),  # same flight, same ID
         flightNumber=flight_data["flightNumber"],
         latitude=float(flight_data["latitude"]),
         longitude=float(flight_data["longitude"]),
@@ -1,18 +1,46 @@
 
-from utils.datatypes import ProcessedFlightInfo, HMS
-from utils.localsidereal import get_local_time
-from astropy.time import Time, TimeDelta
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+from utils.datatypes import ProcessedFlightInfo, FlightResult, HMS
+from utils.localsidereal import get_local_times, get_timezone_name, SiderealTimeTable
 import utils.flight_trajectory as flight_trajectory
+import utils.batch as batch
+import utils.refinement as refinement
+import utils.observer_frame as observer_frame
+import utils.sharding as sharding
 import utils.conversion as conversion
 import utils.fov as fov
+import utils.simulated_fleet as simulated_fleet
+import utils.flight_history as flight_history
+from utils.metrics import stage, collect
+from utils.track_sessions import TrackSession
+from utils.observer_frame import ObserverFrame
 from utils.constants import EARTH_RADIUS_METER
 
 from datetime import datetime
+import os
+import uuid
+import numpy as np
+
+if TYPE_CHECKING:
+    from astropy.time import Time
+
+STREAM_CHUNK_SIZE = 60 # timesteps propagated at once by stream_flights_intersecting
+MAX_TIMESTEPS = int(os.environ.get("MAX_TIMESTEPS", 20000)) # timesteps of one exposure, exposure / time step
+
+# what defines one fov in find_flights_intersecting_multi, the rest of the arguments is shared
+FOV_ARGUMENTS = ("fov_size", "exposure", "fov_center_ra_h", "fov_center_ra_m", "fov_center_ra_s", "fov_center_dec")
+
 # todo: create data class
 #TODO: HMS should directly be input to this class to get type checkings
 def find_flights_intersecting (fov_size: float, exposure: float, 
                                fov_center_ra_h: float, fov_center_ra_m: float, fov_center_ra_s: float, fov_center_dec: float,
-                               observer_lon: float, observer_lat: float, altitude: float, flight_data_type: str, simulated_flights, simulated_time: Time):
+                               observer_lon: float, observer_lat: float, altitude: float, flight_data_type: str, simulated_flights, simulated_time: Time,
+                               vectorized: bool = True, time_step: float = 5, refine_events: bool = False, stats: dict = None,
+                               simulated_fleet_id: str = None, live_flights: list[ProcessedFlightInfo] = None,
+                               track_session: TrackSession = None):
     """
     Function to find flights intersecting the field of view of the telescope.
     :param fov_size: The field of view size.
@@ -24,60 +52,333 @@ def find_flights_intersecting (fov_size: float, exposure: float,
     :param observer_lon: The observer's longitude.
     :param observer_lat: The observer's latitude.
     :param altitude: The observer's altitude.
-    :param flight_data_type: The type of flight data (live or simulated).
+    :param flight_data_type: The type of flight data: live, simulated, or historical (replayed from the recording
+        at FLIGHT_HISTORY_PATH at the simulated time, see utils.flight_history).
     :param simulated_flights: The simulated flights.
     :param simulated_time: The simulated time.
-    :return: The list of flight positions and the flight data.
+    :param vectorized: Evaluate all flights and timesteps at once with the batch engine (see utils.batch),
+        otherwise walk flights and timesteps one at a time with the scalar reference path.
+        Either way, large scenes are split across processes if sharding is configured (see utils.sharding).
+    :param time_step: The time between two reported flight positions, in seconds.
+    :param refine_events: Find entry/exit times to within refinement.EVENT_TIME_TOLERANCE by bisection instead
+        of rounding them to the timestep, and catch flights crossing the FOV between two timesteps.
+        Only available with the batch engine.
+    :param stats: If given, filled with the number of candidate flights and how many each filtering stage removed,
+        and the number of shards if the scene was split across processes.
+    :param simulated_fleet_id: Keep the parsed simulated flights under this id, or reuse the ones kept under it
+        when simulated_flights is None.
+    :param live_flights: The live flights in the horizon, if already fetched with fov.find_live_flights_in_horizon.
+    :param track_session: Reuse the tracks of the previous poll of this session (see utils.track_sessions).
+        The simulated time is snapped to the nearest timestep of the session. Only used with the batch engine.
+    :return: The list of flight positions and the results of the flights, in the same order as the flights.
+    :raise ValueError: If the input values are invalid.
+    """
+    if stats is None:
+        stats = dict()
+    if track_session is not None and vectorized and not refine_events:
+        simulated_time, first_step, origin = track_session.snap(simulated_time)
+    else:
+        track_session = None
+    flight_data, user_gps, fov_center, elapsed_times, sidereal_table = prepare_flights_intersecting(
+        fov_size, exposure, fov_center_ra_h, fov_center_ra_m, fov_center_ra_s, fov_center_dec, observer_lon, observer_lat, altitude,
+        flight_data_type, simulated_flights, simulated_time, time_step, stats, simulated_fleet_id, live_flights)
+
+    # loop through flights to check for intersections
+    flights_in_fov = set()
+    flights_position = list()
+    events = list()
+    results = flight_results(flight_data)
+
+    with stage("propagate"):
+        if refine_events:
+            check_intersection_refined(flight_data, user_gps, elapsed_times, exposure, fov_size, fov_center, flights_position,
+                                       sidereal_table, events, results)
+        elif track_session is not None:
+            ra, dec = track_session.flights_ra_dec(flight_data, first_step, origin, elapsed_times, sidereal_table.at(elapsed_times), stats)
+            intersecting = batch.is_intersecting(ra, dec, fov_center["RA"], fov_center["Dec"], fov_size)
+            record_intersections(flight_data, elapsed_times, ra, dec, intersecting, flights_in_fov, flights_position, events, results)
+        elif sharding.shard_pool.enabled_for(len(flight_data)):
+            check_intersection_sharded(flight_data, user_gps, elapsed_times, fov_size, fov_center, flights_in_fov, flights_position,
+                                       sidereal_table, events, results, vectorized)
+            stats["shards"] = sharding.shard_pool.workers
+        elif vectorized:
+            check_intersection_batch(flight_data, user_gps, simulated_time, elapsed_times, fov_size, fov_center, flights_in_fov, flights_position,
+                                     sidereal_table, events, results)
+        else:
+            for elapsed_time in elapsed_times: 
+                check_intersection(flight_data, user_gps, simulated_time, elapsed_time, fov_size, fov_center, flights_in_fov, flights_position,
+                                   sidereal_table, events, results)    
+
+    # entry and exit times are reported in the observer's timezone, converted all at once
+    if events:
+        with stage("timezone"):
+            set_event_local_times(events, simulated_time, get_timezone_name(observer_lat, observer_lon))
+
+    return flights_position, list(results.values())
+
+
+def flight_results(flight_data: list[ProcessedFlightInfo]) -> dict[uuid.UUID, FlightResult]:
+    """
+    Empty results for the flights of a request, by flight id, in the order of the flights.
+    """
+    return {flight.id: FlightResult(flight) for flight in flight_data}
+
+
+def run_find_flights_intersecting(arguments: dict) -> tuple[list, list[FlightResult], dict]:
+    """
+    find_flights_intersecting for a worker process (see utils.compute_pool), which cannot fill the caller's stats dict
+    or stage timings.
+    :param arguments: The keyword arguments of find_flights_intersecting, without stats.
+    :return: The list of flight positions, the results of the flights, the stats and the stage timings (see utils.metrics).
+    """
+    stats = dict()
+    with collect() as timings:
+        flights_position, flight_data = find_flights_intersecting(**arguments, stats=stats)
+    return flights_position, flight_data, stats, timings
+
+
+def run_find_flights_intersecting_multi(arguments: dict) -> tuple[list[tuple[list, list[FlightResult]]], dict, dict]:
+    """
+    find_flights_intersecting_multi for a worker process, like run_find_flights_intersecting.
+    :param arguments: The keyword arguments of find_flights_intersecting_multi, without stats.
+    :return: The results of every fov, the stats and the stage timings (see utils.metrics).
+    """
+    stats = dict()
+    with collect() as timings:
+        results = find_flights_intersecting_multi(**arguments, stats=stats)
+    return results, stats, timings
+
+
+def stream_flights_intersecting(fov_size: float, exposure: float,
+                                fov_center_ra_h: float, fov_center_ra_m: float, fov_center_ra_s: float, fov_center_dec: float,
+                                observer_lon: float, observer_lat: float, altitude: float, flight_data_type: str, simulated_flights,
+                                simulated_time: Time, time_step: float = 5, stats: dict = None, simulated_fleet_id: str = None,
+                                chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Streaming variant of find_flights_intersecting with the batch engine.
+    The input is validated and the flights are fetched right away; the returned generator then propagates
+    chunk_size timesteps at a time, so memory does not grow with the exposure.
+    The generator yields, in time order:
+        {"type": "timestep", "elapsedTime": ..., "flights_position": [...]} for every timestep, and
+        {"type": "entry" or "exit", "elapsedTime": ..., "time": ..., "ID": ..., "FlightNumber": ...} for every event,
+    right after the timestep it happened at.
+    See find_flights_intersecting for the parameters.
+    :raise ValueError: If the input values are invalid.
+    """
+    if stats is None:
+        stats = dict()
+    flight_data, user_gps, fov_center, elapsed_times, sidereal_table = prepare_flights_intersecting(
+        fov_size, exposure, fov_center_ra_h, fov_center_ra_m, fov_center_ra_s, fov_center_dec, observer_lon, observer_lat, altitude,
+        flight_data_type, simulated_flights, simulated_time, time_step, stats, simulated_fleet_id)
+    tz_name = get_timezone_name(observer_lat, observer_lon)
+
+    def generate():
+        # carried over from one chunk to the next, so a flight in the fov across chunks is only entered once
+        flights_in_fov = set()
+        results = flight_results(flight_data)
+        for first in range(0, len(elapsed_times), chunk_size):
+            chunk = elapsed_times[first:first + chunk_size]
+            flights_position, events = list(), list()
+            check_intersection_batch(flight_data, user_gps, simulated_time, chunk, fov_size, fov_center, flights_in_fov, flights_position,
+                                     sidereal_table, events, results)
+            set_event_local_times(events, simulated_time, tz_name)
+
+            events_by_time = dict()
+            for result, event, elapsed_time in events:
+                events_by_time.setdefault(elapsed_time, []).append({
+                    "type": event, "elapsedTime": elapsed_time, "time": getattr(result, event).isoformat(),
+                    "ID": result.flight.id, "FlightNumber": result.flight.flightNumber,
+                })
+            for elapsed_time, curr_flight_positions in zip(chunk, flights_position):
+                yield {"type": "timestep", "elapsedTime": elapsed_time, "flights_position": curr_flight_positions}
+                yield from events_by_time.get(elapsed_time, [])
+
+    return generate()
+
+
+def find_flights_intersecting_multi(fovs: list[dict], observer_lon: float, observer_lat: float, altitude: float, flight_data_type: str,
+                                    simulated_flights, simulated_time: Time, time_step: float = 5, stats: dict = None,
+                                    simulated_fleet_id: str = None, live_flights: list[ProcessedFlightInfo] = None):
+    """
+    find_flights_intersecting for several telescopes at the same site.
+    The flights are fetched once and their positions are computed once, for every flight that can reach at least
+    one of the fovs, then every fov is tested against the same positions.
+    :param fovs: One dict per fov with the keys of FOV_ARGUMENTS.
+    :param stats: If given, filled with the shared candidate, horizon and ground counts, the number of flights propagated,
+        and under "fovs" the number of flights that cannot reach each fov.
+    See find_flights_intersecting for the other parameters.
+    :return: One (flight positions, flight results) pair per fov, as find_flights_intersecting returns them.
+    :raise ValueError: If the input values are invalid.
+    """
+    if not fovs:
+        raise ValueError("At least one FOV must be provided.")
+    check_observer_input(observer_lat, observer_lon, flight_data_type, simulated_flights, time_step, simulated_fleet_id,
+                         max(fov_definition["exposure"] for fov_definition in fovs))
+    for fov_definition in fovs:
+        if fov_definition["fov_center_dec"] < -90 or fov_definition["fov_center_dec"] > 90:
+            raise ValueError("FOV center declination must be in the range [-90, 90].")
+    if stats is None:
+        stats = dict()
+
+    # one horizon query large enough for every fov
+    exposure = max(fov_definition["exposure"] for fov_definition in fovs)
+    flight_data = find_horizon_flights(observer_lat, observer_lon, max(fov_definition["fov_size"] for fov_definition in fovs), exposure,
+                                       flight_data_type, simulated_flights, stats, simulated_fleet_id, live_flights, simulated_time)
+
+    user_gps = {"latitude": observer_lat, "longitude": observer_lon, "altitude": altitude}
+    elapsed_times = np.arange(0, int(exposure), time_step).tolist()
+    sidereal_table = SiderealTimeTable(observer_lat, observer_lon, simulated_time, elapsed_times)
+
+    # the flights each fov can see, and the union of them that is propagated
+    fov_centers, reachable = list(), list()
+    for fov_definition in fovs:
+        fov_center_ra = HMS(fov_definition["fov_center_ra_h"], fov_definition["fov_center_ra_m"], fov_definition["fov_center_ra_s"])
+        fov_centers.append({"RA": fov_center_ra.to_degrees(), "Dec": fov_definition["fov_center_dec"]})
+        reachable.append({flight.id for flight in fov.remove_unreachable_flights(
+            flight_data, user_gps, fov_centers[-1], fov_definition["fov_size"], fov_definition["exposure"], sidereal_table[0])})
+    remaining = len(flight_data)
+    flight_data = [flight for flight in flight_data if any(flight.id in ids for ids in reachable)]
+    stats["culled"]["unreachable"] = remaining - len(flight_data) # cannot reach any of the fovs
+    stats["fovs"] = [{"unreachable": remaining - len(ids)} for ids in reachable]
+    stats["propagated"] = len(flight_data)
+
+    frame = ObserverFrame(user_gps, sidereal_table.at(elapsed_times).reshape(1, -1))
+    directions = batch.flights_equatorial(flight_data, frame, elapsed_times)
+    ra, dec = observer_frame.ra_dec(*directions)
+    tz_name = get_timezone_name(observer_lat, observer_lon)
+
+    fov_results = list()
+    for fov_definition, fov_center, ids in zip(fovs, fov_centers, reachable):
+        steps = len(np.arange(0, int(fov_definition["exposure"]), time_step))
+        results = flight_results(flight_data)
+        can_reach = np.array([flight.id in ids for flight in flight_data], dtype=bool).reshape(-1, 1)
+        intersecting = observer_frame.is_intersecting(*(direction[:, :steps] for direction in directions), fov_center,
+                                                      fov_definition["fov_size"]) & can_reach
+
+        flights_position, events = list(), list()
+        if steps:
+            record_intersections(flight_data, elapsed_times[:steps], ra[:, :steps], dec[:, :steps], intersecting, set(),
+                                 flights_position, events, results)
+        set_event_local_times(events, simulated_time, tz_name)
+        fov_results.append((flights_position, [result for flight_id, result in results.items() if flight_id in ids]))
+
+    return fov_results
+
+
+def prepare_flights_intersecting(fov_size: float, exposure: float,
+                                 fov_center_ra_h: float, fov_center_ra_m: float, fov_center_ra_s: float, fov_center_dec: float,
+                                 observer_lon: float, observer_lat: float, altitude: float, flight_data_type: str, simulated_flights,
+                                 simulated_time: Time, time_step: float, stats: dict, simulated_fleet_id: str = None,
+                                 live_flights: list[ProcessedFlightInfo] = None):
+    """
+    Validate the input of find_flights_intersecting, find the flights in the horizon and remove the ones that cannot
+    reach the fov. Shared by find_flights_intersecting and stream_flights_intersecting, see there for the parameters.
+    :return: The remaining flights, the user's GPS coordinates, the fov center, the elapsed times and the sidereal table.
     :raise ValueError: If the input values are invalid.
     """
     # check input values
+    check_observer_input(observer_lat, observer_lon, flight_data_type, simulated_flights, time_step, simulated_fleet_id, exposure)
+    if fov_center_dec < -90 or fov_center_dec > 90:
+        raise ValueError("FOV center declination must be in the range [-90, 90].")
+    
+    flight_data = find_horizon_flights(observer_lat, observer_lon, fov_size, exposure, flight_data_type, simulated_flights, stats,
+                                       simulated_fleet_id, live_flights, simulated_time)
+
+    user_gps = {"latitude": observer_lat, "longitude": observer_lon, "altitude": altitude}
+    # the ra already have type checkings
+    fov_center_ra = HMS(fov_center_ra_h, fov_center_ra_m, fov_center_ra_s) 
+    fov_center = {"RA": fov_center_ra.to_degrees(), "Dec": fov_center_dec} 
+
+    elapsed_times = np.arange(0, int(exposure), time_step).tolist()
+    # sidereal time only depends on the observer and the timestep, so compute it once per request
+    with stage("sidereal"):
+        sidereal_table = SiderealTimeTable(observer_lat, observer_lon, simulated_time, elapsed_times)
+
+    # remove flights that cannot reach the fov before the end of the exposure
+    remaining = len(flight_data)
+    with stage("cull"):
+        flight_data = fov.remove_unreachable_flights(flight_data, user_gps, fov_center, fov_size, exposure, sidereal_table[0])
+    stats["culled"]["unreachable"] = remaining - len(flight_data)
+    stats["propagated"] = len(flight_data)
+
+    return flight_data, user_gps, fov_center, elapsed_times, sidereal_table
+
+
+def check_observer_input(observer_lat: float, observer_lon: float, flight_data_type: str, simulated_flights, time_step: float,
+                         simulated_fleet_id: str = None, exposure: float = 0):
+    """
+    :param exposure: The longest exposure, which must not have more than MAX_TIMESTEPS timesteps.
+    :raise ValueError: If the observer, the flight data or the time step are invalid.
+    """
     if observer_lat < -90 or observer_lat > 90:
         raise ValueError("Observer latitude must be in the range [-90, 90].")
     if observer_lon < -180 or observer_lon > 180:
         raise ValueError("Observer longitude must be in the range [-180, 180].")
-    if fov_center_dec < -90 or fov_center_dec > 90:
-        raise ValueError("FOV center declination must be in the range [-90, 90].")
-    if flight_data_type == "simulated" and simulated_flights is None:
+    if flight_data_type == "simulated" and simulated_flights is None and not simulated_fleet.has_simulated_fleet(simulated_fleet_id):
         raise ValueError("Simulated flights must be provided")
-    
+    if flight_data_type == "historical":
+        flight_history.get_flight_history() # raises if there is no recording
+    if time_step <= 0:
+        raise ValueError("Time step must be positive.")
+    if exposure / time_step > MAX_TIMESTEPS:
+        raise ValueError(f"An exposure may have at most {MAX_TIMESTEPS} timesteps, use a longer time step.")
+
+
+def find_horizon_flights(observer_lat: float, observer_lon: float, fov_size: float, exposure: float, flight_data_type: str,
+                         simulated_flights, stats: dict, simulated_fleet_id: str = None,
+                         live_flights: list[ProcessedFlightInfo] = None, observer_time: Time = None) -> list[ProcessedFlightInfo]:
+    """
+    The flights in the observer's horizon that are not on the ground, live, historical or simulated.
+    For live flights, the query covers what a fov of fov_size can see during the exposure.
+    Historical flights are replayed from the recorded snapshot before observer_time (see utils.flight_history).
+    See find_flights_intersecting for the other parameters.
+    """
     # get horizon
     if flight_data_type == "live":
-        flight_data = fov.find_live_flights_in_horizon(observer_lat, observer_lon, fov_size, exposure)
+        flight_data = live_flights
+        if flight_data is None:
+            with stage("fetch"):
+                flight_data = fov.find_live_flights_in_horizon(observer_lat, observer_lon, fov_size, exposure)
+        stats["candidates"] = len(flight_data)
+        stats["culled"] = {"horizon": 0} # done by the flight api query
+    elif flight_data_type == "historical":
+        with stage("horizon"):
+            snapshot = flight_history.get_flight_history().snapshot_at(observer_time.unix)
+            flight_data = snapshot.flights_in_radius(observer_lat, observer_lon, fov.HORIZON_RADIUS, observer_time.unix)
+        stats["candidates"] = len(snapshot)
+        stats["culled"] = {"horizon": len(snapshot) - len(flight_data)}
     else:
         #TODO: check return type of flight_data, don't see anywhere that converts it to a list of ProcessedFlightInfo
-        flight_data = fov.find_simulated_flights_in_horizon(observer_lat, observer_lon, simulated_flights)
+        with stage("horizon"):
+            fleet = simulated_fleet.get_simulated_fleet(simulated_flights, simulated_fleet_id)
+            flight_data = fov.find_simulated_flights_in_horizon(observer_lat, observer_lon, fleet)
+        stats["candidates"] = len(fleet)
+        stats["culled"] = {"horizon": len(fleet) - len(flight_data)}
 
     # remove flights that are too low
-    flight_data = fov.remove_ground_flights(flight_data)
+    remaining = len(flight_data)
+    with stage("ground"):
+        flight_data = fov.remove_ground_flights(flight_data)
+    stats["culled"]["ground"] = remaining - len(flight_data)
 
-    user_gps = {"latitude": observer_lat, "longitude": observer_lon, "altitude": altitude}
-    # the ra already have type checkings
-    fov_center_ra = HMS(fov_center_ra_h, fov_center_ra_m, fov_center_ra_s) 
-    fov_center = {"RA": fov_center_ra.to_degrees(), "Dec": fov_center_dec} 
-
-    # loop through flights to check for intersections
-    flights_in_fov = set()
-    flights_position = list()
-
-    #TODO: play around with the timestep
-    for elapsed_time in range(0, int(exposure), 5): 
-        check_intersection(flight_data, user_gps, simulated_time, elapsed_time, fov_size, fov_center, flights_in_fov, flights_position)    
-
-    return flights_position, flight_data
+    return flight_data
 
 
 # helper function to convert flight's lat, lon, alt to RA, Dec
-def convert_flight_lat_lon_to_ra_dec(flight: ProcessedFlightInfo, updated_observer_time: Time, elapsed_time: int, user_gps: dict[str, float]) -> tuple[float, float]:
+def convert_flight_lat_lon_to_ra_dec(flight: ProcessedFlightInfo, updated_observer_time: Time, elapsed_time: int, user_gps: dict[str, float],
+                                     local_sidereal_time: float = None) -> tuple[float, float]:
     """
         Convert the flight's latitude, longitude, altitude to Right Ascension and Declination.
         :param flight: The flight to convert.
         :param updated_observer_time: The updated observer time.
         :param elapsed_time: The elapsed time.
         :param user_gps: The user's GPS coordinates.
+        :param local_sidereal_time: The observer's local sidereal time at the updated observer time, in radians.
+            Only needed if updated_observer_time is not provided.
         :return: The flight's Right Ascension and Declination.
-        :raise ValueError: If the observer time is not provided.
+        :raise ValueError: If neither the observer time nor the local sidereal time is provided.
     """
-    if updated_observer_time is None:
+    if updated_observer_time is None and local_sidereal_time is None:
         raise ValueError("updated observer time must be provided.")
 
     flight_speed: float = flight.speed * 0.514444 # convert speed from knots to m/s
@@ -90,37 +391,186 @@ def convert_flight_lat_lon_to_ra_dec(flight: ProcessedFlightInfo, updated_observ
 
     # TODO: get user altitude from frontend
     return conversion.aircraft_theta_phi_to_radec(
-        theta, phi, flight_alt, user_gps["latitude"], user_gps["longitude"], user_gps["altitude"], updated_observer_time)
+        theta, phi, flight_alt, user_gps["latitude"], user_gps["longitude"], user_gps["altitude"], updated_observer_time, local_sidereal_time)
+
+
+
+def set_event_local_times(events: list, observer_time: Time, tz_name: str):
+    """
+    Set the entry/exit times of flights from the events recorded by check_intersection.
+    :param events: (flight result, "entry" or "exit", elapsed time) tuples.
+    :param observer_time: The observer time at elapsed time 0.
+    :param tz_name: The timezone the local times are reported in.
+    """
+    if not events:
+        return
+
+    from astropy.time import TimeDelta
+    elapsed_times = np.array([elapsed_time for _, _, elapsed_time in events], dtype=float)
+    local_times = get_local_times(observer_time + TimeDelta(elapsed_times, format='sec'), tz_name)
+    for (result, event, _), local_time in zip(events, local_times):
+        setattr(result, event, local_time)
 
-    
 
 def check_intersection(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], observer_time: Time, \
-                       elapsed_time: int, fov_size: float, fov_center: dict[str, float], flights_in_fov: set, flights_position: list):
-    #calculate the updated time after the elapsed time
-    delta = TimeDelta(elapsed_time, format='sec')
-    updated_time = observer_time + delta
+                       elapsed_time: int, fov_size: float, fov_center: dict[str, float], flights_in_fov: set, flights_position: list,
+                       sidereal_table: SiderealTimeTable = None, events: list = None,
+                       results: dict[uuid.UUID, FlightResult] = None):
+    """
+    Update the flights' positions at the elapsed time and record which flights enter or exit the fov.
+    If events is given, (flight result, "entry" or "exit", elapsed time) tuples are appended to it and the
+    caller sets the local times with set_event_local_times, otherwise they are set right away.
+    :param results: The results of the flights by flight id, see flight_results, updated with the positions and entry/exit times.
+    """
+    step_events = events if events is not None else list()
+    if results is None:
+        results = flight_results(flight_data)
+
+    # the sidereal time is the same for every flight at this timestep
+    if sidereal_table is None:
+        sidereal_table = SiderealTimeTable(user_gps["latitude"], user_gps["longitude"], observer_time, [elapsed_time])
+    local_sidereal_time = sidereal_table[elapsed_time]
 
     curr_flight_positions = list()
         
     for flight in flight_data:
+        result = results[flight.id]
 
-        flight.RA, flight.Dec = convert_flight_lat_lon_to_ra_dec(flight, updated_time, elapsed_time, user_gps)
+        result.RA, result.Dec = convert_flight_lat_lon_to_ra_dec(flight, None, elapsed_time, user_gps, local_sidereal_time)
         
-        is_intersecting = fov.is_intersecting(flight.RA, flight.Dec, fov_center["RA"], fov_center["Dec"], fov_size)
+        is_intersecting = fov.is_intersecting(result.RA, result.Dec, fov_center["RA"], fov_center["Dec"], fov_size)
 
         # add flight if entering/exiting the fov
         if is_intersecting:
             if flight.id not in flights_in_fov: # enter time
                 flights_in_fov.add(flight.id)
-                flight.entry = get_local_time(flight.latitude, flight.longitude, updated_time)
+                step_events.append((result, "entry", elapsed_time))
         else:
             if flight.id in flights_in_fov: # exit time
                 flights_in_fov.discard(flight.id)
-                flight.exit = get_local_time(flight.latitude, flight.longitude, updated_time) 
+                step_events.append((result, "exit", elapsed_time))
 
         # add position of the flight if in fov
         if flight.id in flights_in_fov:
-            curr_flight_positions.append({"ID": flight.id, "FlightNumber": flight.flightNumber, "RA": flight.RA, "Dec": flight.Dec, "Heading": flight.heading})
+            curr_flight_positions.append({"ID": flight.id, "FlightNumber": flight.flightNumber, "RA": result.RA, "Dec": result.Dec, "Heading": flight.heading})
 
     # add all of the flight positions of flights within the fov at this timestamp
     flights_position.append(curr_flight_positions)
+
+    if events is None:
+        set_event_local_times(step_events, observer_time, get_timezone_name(user_gps["latitude"], user_gps["longitude"]))
+
+
+def check_intersection_batch(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], observer_time: Time, \
+                             elapsed_times, fov_size: float, fov_center: dict[str, float], flights_in_fov: set, flights_position: list,
+                             sidereal_table: SiderealTimeTable = None, events: list = None,
+                             results: dict[uuid.UUID, FlightResult] = None):
+    """
+    Same as calling check_intersection for every elapsed time, but the positions of all flights at all
+    elapsed times are computed in one pass with the batch engine.
+    """
+    step_events = events if events is not None else list()
+    if results is None:
+        results = flight_results(flight_data)
+    elapsed_times = list(elapsed_times)
+    if not elapsed_times:
+        return
+
+    if sidereal_table is None:
+        sidereal_table = SiderealTimeTable(user_gps["latitude"], user_gps["longitude"], observer_time, elapsed_times)
+    frame = ObserverFrame(user_gps, sidereal_table.at(elapsed_times).reshape(1, -1))
+    directions = batch.flights_equatorial(flight_data, frame, elapsed_times)
+    ra, dec = observer_frame.ra_dec(*directions)
+    intersecting = observer_frame.is_intersecting(*directions, fov_center, fov_size)
+    record_intersections(flight_data, elapsed_times, ra, dec, intersecting, flights_in_fov, flights_position, step_events, results)
+
+    if events is None:
+        set_event_local_times(step_events, observer_time, get_timezone_name(user_gps["latitude"], user_gps["longitude"]))
+
+
+def check_intersection_sharded(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], elapsed_times, fov_size: float,
+                               fov_center: dict[str, float], flights_in_fov: set, flights_position: list, sidereal_table: SiderealTimeTable,
+                               events: list, results: dict[uuid.UUID, FlightResult], vectorized: bool = True):
+    """
+    Same as check_intersection_batch (or check_intersection for every elapsed time if not vectorized), but the flights
+    are split across the worker processes of sharding.shard_pool. The events are appended to events.
+    """
+    elapsed_times = list(elapsed_times)
+    if not elapsed_times:
+        return
+
+    ra, dec, intersecting = sharding.shard_pool.intersections(flight_data, user_gps, elapsed_times, sidereal_table.at(elapsed_times),
+                                                              fov_center, fov_size, vectorized)
+    record_intersections(flight_data, elapsed_times, ra, dec, intersecting, flights_in_fov, flights_position, events, results)
+
+
+def record_intersections(flight_data: list[ProcessedFlightInfo], elapsed_times: list, ra: np.ndarray, dec: np.ndarray,
+                         intersecting: np.ndarray, flights_in_fov: set, flights_position: list, events: list,
+                         results: dict[uuid.UUID, FlightResult]):
+    """
+    Walk precomputed positions like check_intersection: append the positions in the fov at every elapsed time to
+    flights_position and the (flight result, "entry" or "exit", elapsed time) tuples to events.
+    :param ra: Right Ascension of every flight at every elapsed time, shape (flights, timesteps).
+    :param dec: Declination of every flight at every elapsed time, shape (flights, timesteps).
+    :param intersecting: Whether every flight is in the fov at every elapsed time, shape (flights, timesteps).
+    """
+    # flights that never intersect only need their last position
+    for index, flight in enumerate(flight_data):
+        results[flight.id].RA, results[flight.id].Dec = float(ra[index, -1]), float(dec[index, -1])
+    # flights already in the fov from a previous call may exit at any of these elapsed times
+    in_fov = np.array([flight.id in flights_in_fov for flight in flight_data], dtype=bool)
+    candidates = np.flatnonzero(intersecting.any(axis=1) | in_fov)
+
+    for step, elapsed_time in enumerate(elapsed_times):
+        curr_flight_positions = list()
+
+        for index in candidates:
+            flight = flight_data[index]
+
+            # add flight if entering/exiting the fov
+            if intersecting[index, step]:
+                if flight.id not in flights_in_fov: # enter time
+                    flights_in_fov.add(flight.id)
+                    events.append((results[flight.id], "entry", elapsed_time))
+            else:
+                if flight.id in flights_in_fov: # exit time
+                    flights_in_fov.discard(flight.id)
+                    events.append((results[flight.id], "exit", elapsed_time))
+
+            # add position of the flight if in fov
+            if flight.id in flights_in_fov:
+                curr_flight_positions.append({"ID": flight.id, "FlightNumber": flight.flightNumber, 
+                                              "RA": float(ra[index, step]), "Dec": float(dec[index, step]), "Heading": flight.heading})
+
+        flights_position.append(curr_flight_positions)
+
+
+def check_intersection_refined(flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], elapsed_times, exposure: float,
+                               fov_size: float, fov_center: dict[str, float], flights_position: list,
+                               sidereal_table: SiderealTimeTable, events: list, results: dict[uuid.UUID, FlightResult]):
+    """
+    Like check_intersection_batch, but the entry/exit times are refined between timesteps (see utils.refinement)
+    and appended to events as (flight result, "entry" or "exit", elapsed time) tuples.
+    Flight positions are still reported at the elapsed times only.
+    """
+    elapsed_times = list(elapsed_times)
+    sample_times = refinement.sample_times_with_end(elapsed_times, exposure)
+
+    flights = batch.flight_arrays(flight_data)
+    ra, dec = batch.positions_ra_dec(flights, user_gps, sample_times.reshape(1, -1), sidereal_table.at(sample_times).reshape(1, -1))
+    distance = refinement.fov_distance_from_ra_dec(ra, dec, fov_center, fov_size)
+
+    crossings, _ = refinement.find_fov_crossings(flights, user_gps, sidereal_table, fov_center, fov_size, sample_times, distance)
+    for index, event, elapsed_time in crossings:
+        events.append((results[flight_data[index].id], event, elapsed_time))
+
+    if elapsed_times:
+        for index, flight in enumerate(flight_data):
+            results[flight.id].RA, results[flight.id].Dec = float(ra[index, len(elapsed_times) - 1]), float(dec[index, len(elapsed_times) - 1])
+
+    for step in range(len(elapsed_times)):
+        flights_position.append([
+            {"ID": flight_data[index].id, "FlightNumber": flight_data[index].flightNumber,
+             "RA": float(ra[index, step]), "Dec": float(dec[index, step]), "Heading": flight_data[index].heading}
+            for index in np.flatnonzero(distance[:, step] < 0)
+        ])
@@ -1,12 +1,58 @@
+from __future__ import annotations
+
 import pytz
-from astropy.coordinates import EarthLocation
-from astropy.time import Time
-from astropy import units as u
+import numpy as np
+import math
 
 from datetime import datetime
+from functools import lru_cache
+import threading
 
-from timezonefinder import TimezoneFinder
 from pytz import timezone
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    # astropy and timezonefinder are slow to import, they are imported by the functions that need them
+    from astropy.time import Time
+    from timezonefinder import TimezoneFinder
+
+SIDEREAL_RATE = 1.00273790935 * 2 * math.pi / 86400 # radians of sidereal time per second of UT
+TIMEZONE_CACHE_PRECISION = 4 # decimal places of lat/lon kept in the timezone cache key (~10 m)
+
+_timezone_finder = None
+_timezone_finder_lock = threading.Lock()
+
+def get_timezone_finder() -> TimezoneFinder:
+    """
+    Get the shared TimezoneFinder. Building one loads the timezone polygon data,
+    so it is only done once per process.
+    """
+    global _timezone_finder
+    with _timezone_finder_lock:
+        if _timezone_finder is None:
+            from timezonefinder import TimezoneFinder
+            _timezone_finder = TimezoneFinder()
+        return _timezone_finder
+
+@lru_cache(maxsize=4096)
+def _timezone_name_at(lat: float, lon: float) -> str:
+    tf = get_timezone_finder()
+    with _timezone_finder_lock:
+        return tf.timezone_at(lng=lon, lat=lat)
+
+def get_timezone_name(lat: float, lon: float) -> str:
+    """
+    Get the timezone name at a given gps location, e.g. "America/Toronto".
+    Lookups are cached, so resolving the same location again is a dictionary hit.
+    :param lat: latitude
+    :param lon: longitude
+    :return: the timezone name
+    :raise ValueError: If no timezone is found for the location.
+    """
+    tz_name = _timezone_name_at(round(lat, TIMEZONE_CACHE_PRECISION), round(lon, TIMEZONE_CACHE_PRECISION))
+    if tz_name is None:
+        raise ValueError(f"Could not determine timezone for lat: {lat}, lon: {lon}")
+    return tz_name
 
 def get_local_sidereal_time(lat: float, lon: float, time: datetime = None) -> float:
     """
@@ -18,27 +64,78 @@ def get_local_sidereal_time(lat: float, lon: float, time: datetime = None) -> fl
     """
     if not time:
         # step 1: get the timezone
-        tf = TimezoneFinder()
-        tz = tf.timezone_at(lng=lon, lat=lat)
-        tz_target = timezone(tz)
+        tz_target = timezone(get_timezone_name(lat, lon))
         today = datetime.now()
         time = tz_target.localize(today)
 
     # step 2: get the LST
+    from astropy.coordinates import EarthLocation
+    from astropy.time import Time
+    from astropy import units as u
     observing_location = EarthLocation(lat=lat*u.deg, lon=lon*u.deg)
     observing_time = Time(time, scale='utc', location=observing_location)
     LST = observing_time.sidereal_time('mean')
     return LST.rad
 
+def get_local_sidereal_times(lat: float, lon: float, observer_time: Time, elapsed_times) -> np.ndarray:
+    """
+    Get the local sidereal time at a given gps location for many elapsed times at once
+    :param lat: latitude
+    :param lon: longitude
+    :param observer_time: time at elapsed time 0, in UTC
+    :param elapsed_times: seconds elapsed since observer_time
+    :return: LST in radians, one per elapsed time
+    """
+    from astropy.coordinates import EarthLocation
+    from astropy.time import Time, TimeDelta
+    from astropy import units as u
+    observing_location = EarthLocation(lat=lat*u.deg, lon=lon*u.deg)
+    observing_times = Time(observer_time + TimeDelta(np.asarray(elapsed_times, dtype=float), format='sec'),
+                           scale='utc', location=observing_location)
+    LST = observing_times.sidereal_time('mean')
+    return np.atleast_1d(LST.rad)
+
+class SiderealTimeTable:
+    """
+    Local sidereal time of one observer for every timestep of a request.
+    The table is filled with a single astropy call, so the conversion functions can look
+    the LST up instead of building a new EarthLocation and Time for every flight.
+    Elapsed times that are not in the table are extrapolated from the closest entry
+    using the sidereal rate, which is exact to well below a microradian over a few minutes.
+    """
+    def __init__(self, lat: float, lon: float, observer_time: Time, elapsed_times):
+        self.elapsed_times = np.asarray(list(elapsed_times), dtype=float)
+        if len(self.elapsed_times) == 0:
+            self.elapsed_times = np.zeros(1)
+        order = np.argsort(self.elapsed_times)
+        self.elapsed_times = self.elapsed_times[order]
+        self.local_sidereal_times = get_local_sidereal_times(lat, lon, observer_time, self.elapsed_times)
+
+    def __getitem__(self, elapsed_time: float) -> float:
+        return float(self.at(elapsed_time))
+
+    def at(self, elapsed_times) -> np.ndarray:
+        """
+        Look up the LST for any number of elapsed times.
+        :param elapsed_times: seconds elapsed since the observer time, scalar or array
+        :return: LST in radians in the range [0, 2pi), same shape as elapsed_times
+        """
+        elapsed_times = np.asarray(elapsed_times, dtype=float)
+        index = np.clip(np.searchsorted(self.elapsed_times, elapsed_times), 1, len(self.elapsed_times)) - 1
+        # pick whichever neighbour is closer
+        upper = np.minimum(index + 1, len(self.elapsed_times) - 1)
+        closer = np.abs(self.elapsed_times[upper] - elapsed_times) < np.abs(self.elapsed_times[index] - elapsed_times)
+        index = np.where(closer, upper, index)
+
+        delta = elapsed_times - self.elapsed_times[index]
+        return np.mod(self.local_sidereal_times[index] + SIDEREAL_RATE * delta, 2 * math.pi)
+
 def get_utc_time(lat: float, lon: float, local_time: str) -> float:
     # Convert string to datetime
     local_time = datetime.strptime(local_time, "%Y-%m-%dT%H:%M")
 
     # Get the timezone for the given latitude and longitude
-    tf = TimezoneFinder()
-    tz_name = tf.timezone_at(lng=lon, lat=lat)  # Find timezone name
-    if tz_name is None:
-        raise ValueError(f"Could not determine timezone for lat: {lat}, lon: {lon}")
+    tz_name = get_timezone_name(lat, lon)
     
     # Get the target timezone
     tz_target = timezone(tz_name)
@@ -51,6 +148,7 @@ def get_utc_time(lat: float, lon: float, local_time: str) -> float:
     utc_time = local_time.astimezone(pytz.utc)
 
     # Convert to astropy Time object
+    from astropy.time import Time
     utc_astropy_time = Time(utc_time, scale='utc')
 
     return utc_astropy_time
@@ -60,10 +158,7 @@ def get_local_time(lat: float, lon: float, utc_time: Time) -> Time:
     utc_time = utc_time.to_datetime(timezone=pytz.utc)
 
     # Get the timezone for the given latitude and longitude
-    tf = TimezoneFinder()
-    tz_name = tf.timezone_at(lng=lon, lat=lat)  # Find timezone name
-    if tz_name is None:
-        raise ValueError(f"Could not determine timezone for lat: {lat}, lon: {lon}")
+    tz_name = get_timezone_name(lat, lon)
 
     # Get the target timezone
     tz_target = pytz.timezone(tz_name)
@@ -71,4 +166,15 @@ def get_local_time(lat: float, lon: float, utc_time: Time) -> Time:
     # Convert UTC time to local time
     local_time = utc_time.astimezone(tz_target)
 
-    return local_time
\ No newline at end of file
+    return local_time
+
+def get_local_times(utc_times: Time, tz_name: str) -> list[datetime]:
+    """
+    Convert many UTC times to local times in one go.
+    :param utc_times: astropy Time array in UTC
+    :param tz_name: the target timezone name, see get_timezone_name
+    :return: timezone-aware datetimes, one per UTC time
+    """
+    tz_target = pytz.timezone(tz_name)
+    utc_datetimes = np.atleast_1d(utc_times.to_datetime(timezone=pytz.utc))
+    return [utc_datetime.astimezone(tz_target) for utc_datetime in utc_datetimes]
\ No newline at end of file
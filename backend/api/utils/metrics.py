@@ -0,0 +1,149 @@
+"""
+File to time the stages of a request and export them as Prometheus metrics.
+
+stage(name) wraps one stage of a prediction (fetching the flights, horizon and
+ground filtering, sidereal time, propagation, timezone lookup, encoding). The
+duration is added to the timings of the current request, a contextvar set by
+collect(), so app.py can send them back in a Server-Timing header and observe
+them in the latency histograms served at /metrics. Outside of collect(), a
+stage only costs two perf_counter calls.
+"""
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30) # seconds
+
+_timings: contextvars.ContextVar[dict] = contextvars.ContextVar("timings", default=None)
+
+
+@contextmanager
+def collect():
+    """
+    Collect the stage timings of the code run inside, e.g. one request.
+    Yields the dict of seconds by stage name, filled as the stages end.
+    """
+    timings = dict()
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+
+
+@contextmanager
+def stage(name: str):
+    """ Time the code run inside as the stage name of the current collect(), if any. Repeated stages add up. """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = _timings.get()
+        if timings is not None:
+            timings[name] = timings.get(name, 0) + time.perf_counter() - start
+
+
+def add_timings(timings: dict[str, float]):
+    """ Add timings collected elsewhere, e.g. in a worker process, to the current collect(). """
+    current = _timings.get()
+    if current is not None:
+        for name, seconds in timings.items():
+            current[name] = current.get(name, 0) + seconds
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """ The value of a Server-Timing header, durations in milliseconds. """
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings.items())
+
+
+class Counter:
+    """
+    A Prometheus counter, optionally with labels.
+    """
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = dict()
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels[label]) for label in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels[label]) for label in self.labelnames), 0)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    """
+    A Prometheus histogram, optionally with labels.
+    """
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: dict[tuple, list] = dict() # bucket counts (not cumulative), then +Inf count and sum
+        self._lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[label]) for label in self.labelnames)
+        with self._lock:
+            counts = self._values.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            index = next((index for index, bound in enumerate(self.buckets) if value <= bound), len(self.buckets))
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, **labels) -> int:
+        return sum(self._values.get(tuple(str(labels[label]) for label in self.labelnames), [0])[:-1])
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_labels(self.labelnames + ('le',), key + (str(bound),))} {cumulative}")
+                lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+                lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {counts[-1]}")
+        return lines
+
+
+def _labels(names: tuple[str, ...], values: tuple) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+registry: list = list()
+
+
+def render() -> str:
+    """ All metrics in the Prometheus text format. """
+    return "\n".join(line for metric in registry for line in metric.render()) + "\n"
+
+
+request_seconds = Histogram("flight_prediction_request_seconds", "Time to answer a request.", ("endpoint",))
+stage_seconds = Histogram("flight_prediction_stage_seconds", "Time spent in each stage of a request.", ("endpoint", "stage"))
+requests_total = Counter("flight_prediction_requests_total", "Requests answered.", ("endpoint", "status"))
+flights_total = Counter("flight_prediction_flights_total", "Flights considered by computed predictions, by stage reached.", ("stage",))
+timesteps_total = Counter("flight_prediction_timesteps_total", "Timesteps evaluated by computed predictions.")
+results_cache_total = Counter("flight_prediction_results_cache_total", "Simulated predictions answered from the results cache or not.",
+                              ("result",))
+coalesced_total = Counter("flight_prediction_coalesced_total",
+                          "Live predictions that waited for the computation of a concurrent identical request or computed their own.",
+                          ("result",))
@@ -0,0 +1,102 @@
+"""
+File to convert aircraft ECEF positions to the equatorial frame of an observer, with one matrix multiply.
+
+conversion.aircraft_theta_phi_to_radec goes from the aircraft position to the
+vector from the observer, to the observer's local frame, to azimuth and
+elevation, then back through the hour angle to RA/Dec, recomputing the observer
+position and the trig of every rotation for each flight and timestep.
+
+On the spherical Earth of the model, the local frame and the hour angle cancel
+out: the direction from the observer to the aircraft, in Earth-centered
+Earth-fixed (ECEF) coordinates, only has to be turned about the polar axis by
+the angle between the observer's meridian and the vernal equinox, i.e. the
+local sidereal time minus the observer's longitude. ObserverFrame builds the
+observer position and that rotation matrix for every timestep once per request.
+Each position then becomes an RA/Dec unit vector with one matrix multiply, and
+being in the FOV is a dot product with the unit vector of the FOV center.
+
+ECEF coordinates here have x towards longitude 0 and z towards the north pole,
+as in flight_motion.
+"""
+import math
+
+import numpy as np
+
+from utils.constants import EARTH_RADIUS_METER
+
+
+def unit_vector(ra, dec) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Convert equatorial coordinates to unit vectors.
+    :param ra: The Right Ascension in degrees.
+    :param dec: The Declination in degrees.
+    :return: x (towards RA 0), y (towards RA 90) and z (towards Dec 90).
+    """
+    ra_rad, dec_rad = np.radians(ra), np.radians(dec)
+    return (np.cos(dec_rad) * np.cos(ra_rad), np.cos(dec_rad) * np.sin(ra_rad), np.sin(dec_rad))
+
+
+def ra_dec(x, y, z) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Convert unit vectors to equatorial coordinates.
+    :return: Right Ascension in [0, 360) and Declination in degrees.
+    """
+    return (np.mod(np.degrees(np.arctan2(y, x)), 360), np.degrees(np.arcsin(np.clip(z, -1, 1))))
+
+
+def is_intersecting(x, y, z, fov_center: dict[str, float], fov_size: float) -> np.ndarray:
+    """
+    Same as batch.is_intersecting, for unit vectors (see ObserverFrame.equatorial): the angle to the FOV center
+    is less than half the FOV size when the dot product with the unit vector of the center is greater than its cosine.
+    NaN positions are never intersecting.
+    :param fov_center: The RA and Dec of the FOV center in degrees.
+    :param fov_size: The FOV size in degrees.
+    """
+    center_x, center_y, center_z = unit_vector(fov_center["RA"], fov_center["Dec"])
+    with np.errstate(invalid="ignore"):
+        return x * center_x + y * center_y + z * center_z > math.cos(math.radians(fov_size / 2))
+
+
+class ObserverFrame:
+    """
+    The position of an observer and the rotations from ECEF to the equatorial frame at its sidereal times.
+    """
+    def __init__(self, user_gps: dict[str, float], local_sidereal_times):
+        """
+        :param user_gps: The observer's GPS coordinates, altitude in meters.
+        :param local_sidereal_times: The local sidereal times in radians, e.g. one per timestep.
+            The rotations keep their shape, so they broadcast the same way against the positions.
+        """
+        latitude, longitude = math.radians(user_gps["latitude"]), math.radians(user_gps["longitude"])
+        radius = EARTH_RADIUS_METER + user_gps["altitude"]
+        self.position = (radius * math.cos(latitude) * math.cos(longitude), radius * math.cos(latitude) * math.sin(longitude),
+                         radius * math.sin(latitude))
+
+        angle = np.asarray(local_sidereal_times, dtype=float) - longitude
+        cos_angle, sin_angle = np.cos(angle), np.sin(angle)
+        zeros, ones = np.zeros_like(angle), np.ones_like(angle)
+        # rotation about the polar axis, of shape local_sidereal_times.shape + (3, 3)
+        self.rotation = np.stack([np.stack([cos_angle, -sin_angle, zeros], axis=-1),
+                                  np.stack([sin_angle, cos_angle, zeros], axis=-1),
+                                  np.stack([zeros, zeros, ones], axis=-1)], axis=-2)
+
+    def equatorial(self, x, y, z) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        The directions of ECEF positions, as seen by the observer, as equatorial unit vectors.
+        :param x: The ECEF positions in meters, broadcastable against the sidereal times.
+        :return: The unit vectors, see unit_vector.
+        """
+        x, y, z = x - self.position[0], y - self.position[1], z - self.position[2]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            norm = np.sqrt(x**2 + y**2 + z**2)
+            x, y, z = x / norm, y / norm, z / norm
+        rotation = self.rotation
+        return tuple(rotation[..., row, 0] * x + rotation[..., row, 1] * y + rotation[..., row, 2] * z for row in range(3))
+
+    def ra_dec(self, x, y, z) -> tuple[np.ndarray, np.ndarray]:
+        """
+        The Right Ascension and Declination of ECEF positions, as seen by the observer.
+        :param x: The ECEF positions in meters, broadcastable against the sidereal times.
+        :return: Right Ascension and Declination in degrees.
+        """
+        return ra_dec(*self.equatorial(x, y, z))
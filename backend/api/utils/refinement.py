@@ -0,0 +1,138 @@
+"""
+File to find the times flights enter and exit the field of view more precisely
+than the sampling timestep.
+
+The sky is first sampled on a coarse grid. Every interval between two samples
+where the flight changes from outside to inside the FOV (or back) brackets a
+crossing, and is narrowed down by bisection. An interval where the flight is
+outside at both ends can still hide a short pass through the FOV, so it is
+split as well unless a bound on how fast the flight can move across the sky
+proves it never comes close enough. The same goes for a short exit between
+two samples inside the FOV.
+"""
+import numpy as np
+
+import utils.batch as batch
+from utils.localsidereal import SiderealTimeTable, SIDEREAL_RATE
+
+EVENT_TIME_TOLERANCE = 0.1 # seconds, how precisely entry and exit times are found
+MIN_SLANT_RANGE_METER = 100 # lower bound on the observer to aircraft distance for the angular speed bound
+
+
+def max_angular_speed(flights: dict[str, np.ndarray], observer_alt: float) -> np.ndarray:
+    """
+    Upper bound on how fast each flight can move across the sky, as seen by the observer.
+    The aircraft moves at its speed, and is at least its height above the observer away,
+    so its direction changes by at most speed / distance. The earth's rotation moves the
+    RA/Dec of any direction by at most the sidereal rate on top of that.
+    :param flights: The flights as column arrays, see batch.flight_arrays.
+    :param observer_alt: The observer's altitude in meters.
+    :return: The angular speed bound in degrees per second, one per flight.
+    """
+    slant_range = np.maximum(flights["altitude"] - observer_alt, MIN_SLANT_RANGE_METER)
+    return np.degrees(flights["speed"] / slant_range + SIDEREAL_RATE).reshape(-1)
+
+
+def fov_distance(flights: dict[str, np.ndarray], user_gps: dict[str, float], sidereal_table: SiderealTimeTable,
+                 fov_center: dict[str, float], fov_size: float, elapsed_times) -> np.ndarray:
+    """
+    Angular distance of the flights from the edge of the field of view.
+    Negative inside the FOV, positive outside, infinite where the position is undefined.
+    """
+    ra, dec = batch.positions_ra_dec(flights, user_gps, elapsed_times, sidereal_table.at(elapsed_times))
+    return fov_distance_from_ra_dec(ra, dec, fov_center, fov_size)
+
+
+def fov_distance_from_ra_dec(ra, dec, fov_center: dict[str, float], fov_size: float) -> np.ndarray:
+    """
+    Same as fov_distance, for positions that are already converted to RA/Dec.
+    """
+    distance = batch.angular_distance(ra, dec, fov_center["RA"], fov_center["Dec"]) - fov_size / 2
+    return np.where(np.isnan(distance), np.inf, distance)
+
+
+def find_fov_crossings(flights: dict[str, np.ndarray], user_gps: dict[str, float], sidereal_table: SiderealTimeTable,
+                       fov_center: dict[str, float], fov_size: float, sample_times, sample_distance: np.ndarray = None,
+                       tolerance: float = EVENT_TIME_TOLERANCE) -> tuple[list[tuple[int, str, float]], int]:
+    """
+    Find every time a flight enters or exits the field of view.
+    :param flights: The flights as column arrays, see batch.flight_arrays.
+    :param user_gps: The user's GPS coordinates.
+    :param sidereal_table: The observer's sidereal time table.
+    :param fov_center: The center of the FOV, RA and Dec in degrees.
+    :param fov_size: The FOV size in degrees.
+    :param sample_times: The coarse elapsed times to start from, in increasing order.
+    :param sample_distance: fov_distance at the sample times, if already computed.
+    :param tolerance: The largest error allowed on the entry/exit times, in seconds.
+    :return: (flight index, "entry" or "exit", elapsed time) tuples sorted by time, and the number of
+        position evaluations used on top of the samples.
+    """
+    sample_times = np.asarray(sample_times, dtype=float)
+    if sample_distance is None:
+        sample_distance = fov_distance(flights, user_gps, sidereal_table, fov_center, fov_size, sample_times.reshape(1, -1))
+
+    events = []
+    # a flight already in the fov at the first sample enters at that time
+    for index in np.flatnonzero(sample_distance[:, 0] < 0):
+        events.append((int(index), "entry", float(sample_times[0])))
+
+    # open intervals, one element per interval
+    flight_index = np.repeat(np.arange(sample_distance.shape[0]), len(sample_times) - 1)
+    start = np.tile(sample_times[:-1], sample_distance.shape[0])
+    end = np.tile(sample_times[1:], sample_distance.shape[0])
+    start_distance = sample_distance[:, :-1].reshape(-1)
+    end_distance = sample_distance[:, 1:].reshape(-1)
+
+    speed_bound = max_angular_speed(flights, user_gps["altitude"])
+    evaluations = 0
+
+    while len(flight_index):
+        crossing = (start_distance < 0) != (end_distance < 0)
+        # closest the flight can get to the fov edge from either end of the interval
+        reach = speed_bound[flight_index] * (end - start)
+        with np.errstate(invalid="ignore"):
+            hidden_pass = ~crossing & (start_distance >= 0) & ((start_distance + end_distance - reach) / 2 < 0)
+            hidden_exit = ~crossing & (start_distance < 0) & ((start_distance + end_distance + reach) / 2 >= 0)
+        narrow = (end - start) <= tolerance
+
+        # crossings narrowed down to the tolerance are placed by linear interpolation
+        done = crossing & narrow
+        with np.errstate(invalid="ignore", divide="ignore"):
+            fraction = np.clip(start_distance / (start_distance - end_distance), 0, 1)
+        fraction = np.where(np.isfinite(fraction), fraction, 1)
+        for index, time, entering in zip(flight_index[done], (start + fraction * (end - start))[done], end_distance[done] < 0):
+            events.append((int(index), "entry" if entering else "exit", float(time)))
+
+        # split every interval that still may contain a crossing
+        split = (crossing | hidden_pass | hidden_exit) & ~narrow
+        flight_index, start, end = flight_index[split], start[split], end[split]
+        start_distance, end_distance = start_distance[split], end_distance[split]
+        if not len(flight_index):
+            break
+
+        middle = (start + end) / 2
+        middle_flights = {key: value[flight_index, 0] for key, value in flights.items()}
+        middle_distance = fov_distance(middle_flights, user_gps, sidereal_table, fov_center, fov_size, middle)
+        evaluations += len(middle)
+
+        flight_index = np.concatenate([flight_index, flight_index])
+        start, end = np.concatenate([start, middle]), np.concatenate([middle, end])
+        start_distance = np.concatenate([start_distance, middle_distance])
+        end_distance = np.concatenate([middle_distance, end_distance])
+
+    events.sort(key=lambda event: (event[2], event[0]))
+    return events, evaluations
+
+
+def sample_times_with_end(elapsed_times, exposure: float) -> np.ndarray:
+    """
+    The sampling grid plus the end of the exposure, so a crossing after the last
+    timestep (or an exposure shorter than one timestep) is not missed.
+    """
+    elapsed_times = np.asarray(list(elapsed_times), dtype=float)
+    if len(elapsed_times) == 0:
+        return np.array([0.0, float(exposure)]) if exposure > 0 else np.zeros(1)
+    if exposure > elapsed_times[-1]:
+        return np.append(elapsed_times, float(exposure))
+    return elapsed_times
+
@@ -0,0 +1,131 @@
+"""
+File to encode flight-prediction results in the format the client asks for.
+
+The legacy JSON shape repeats the ID, flight number and heading of a flight at
+every timestep it is in the fov. The columnar shape lists every flight once,
+with one RA and one Dec array per flight indexed by timestep (null where the
+flight is not in the fov). It can be sent as compact JSON, MessagePack or an
+Arrow IPC stream; the encoders are optional dependencies, a format whose
+encoder is not installed is simply not offered.
+"""
+import json
+import math
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+LEGACY_JSON = "application/json"
+COLUMNAR_JSON = "application/vnd.flight-prediction.columnar+json"
+MSGPACK = "application/msgpack"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+COLUMNAR_FORMATS = (COLUMNAR_JSON, MSGPACK, ARROW_STREAM)
+
+# flight metadata sent once per flight, in this order
+FLIGHT_COLUMNS = ("id", "flight_number", "altitude", "heading", "latitude", "longitude", "speed", "entry", "exit")
+
+
+def available_formats() -> list[str]:
+    """ The formats that can be produced, the legacy one first so it is the default. """
+    formats = [LEGACY_JSON, COLUMNAR_JSON]
+    if msgpack is not None:
+        formats.append(MSGPACK)
+    if pyarrow is not None:
+        formats.append(ARROW_STREAM)
+    return formats
+
+
+def choose_format(accept) -> str:
+    """
+    The format to answer with, given the Accept header.
+    :param accept: The parsed Accept header, e.g. flask.request.accept_mimetypes.
+    :return: The best available format, the legacy JSON if the client accepts none of them (like before the
+        columnar formats existed), or None if the client only asked for columnar formats that cannot be produced.
+    """
+    if not accept:
+        return LEGACY_JSON
+    mimetype = accept.best_match(available_formats())
+    if mimetype is None and any(value in COLUMNAR_FORMATS for value, _ in accept):
+        return None
+    return mimetype or LEGACY_JSON
+
+
+def to_columnar(flights_position: list[list[dict]], flight_results: list, time_step: float) -> dict:
+    """
+    Convert the result of find_flights_intersecting to the columnar shape.
+    :return: {"elapsed_times": [...], "flights": {column: [...]}, "ra": [[...]], "dec": [[...]]}, with one row of
+        "ra"/"dec" per flight and one element per elapsed time, None where the flight is not in the fov.
+    """
+    steps = len(flights_position)
+    flights = [result.to_dict() for result in flight_results if result.entry]
+    rows = {flight["id"]: row for row, flight in enumerate(flights)}
+    ra = [[None] * steps for _ in flights]
+    dec = [[None] * steps for _ in flights]
+
+    for step, curr_flight_positions in enumerate(flights_position):
+        for position in curr_flight_positions:
+            row = rows.get(str(position["ID"]))
+            if row is not None:
+                ra[row][step], dec[row][step] = position["RA"], position["Dec"]
+
+    return {
+        "elapsed_times": [step * time_step for step in range(steps)],
+        "flights": {column: [flight[column] for flight in flights] for column in FLIGHT_COLUMNS},
+        "ra": ra,
+        "dec": dec,
+    }
+
+
+def encode(body: dict, mimetype: str) -> bytes:
+    """
+    Encode a response body, see available_formats for the mimetypes.
+    The body must only contain JSON types; NaN floats are sent as null.
+    """
+    if mimetype == MSGPACK:
+        return msgpack.packb(_without_nan(body))
+    if mimetype == ARROW_STREAM:
+        return _encode_arrow(body)
+    if orjson is not None:
+        return orjson.dumps(body)
+    return json.dumps(_without_nan(body), separators=(",", ":")).encode()
+
+
+def _without_nan(value):
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _without_nan(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_without_nan(item) for item in value]
+    return value
+
+
+def _encode_arrow(body: dict) -> bytes:
+    """
+    One record batch with a row per flight: the flight columns plus "ra" and "dec" as lists of floats.
+    Everything else in the body (elapsed times, fov size, stats) goes in the schema metadata as JSON.
+    """
+    columns = dict(body["flights"])
+    columns["ra"], columns["dec"] = body["ra"], body["dec"]
+    metadata = {key: json.dumps(value) for key, value in body.items() if key not in ("flights", "ra", "dec")}
+
+    table = pyarrow.table({
+        **{column: pyarrow.array(values, type=pyarrow.string() if column in ("id", "flight_number", "entry", "exit") else pyarrow.float64())
+           for column, values in columns.items() if column not in ("ra", "dec")},
+        "ra": pyarrow.array(columns["ra"], type=pyarrow.list_(pyarrow.float64())),
+        "dec": pyarrow.array(columns["dec"], type=pyarrow.list_(pyarrow.float64())),
+    }).replace_schema_metadata(metadata)
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
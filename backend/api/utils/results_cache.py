@@ -0,0 +1,79 @@
+"""
+File to reuse the results of simulated flight predictions.
+
+In simulated mode find_flights_intersecting only depends on its arguments:
+the observer, the fov, the exposure, the time and the simulated fleet. Clients
+such as regression dashboards send the same form over and over, so the results
+are kept in an LRU cache keyed by a hash of those arguments, where the fleet is
+identified by the hash of its content (SimulatedFleet.digest). Live predictions
+depend on the flight feed and are never cached.
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+RESULTS_CACHE_SIZE = int(os.environ.get("RESULTS_CACHE_SIZE", 128)) # number of results kept, 0 disables the cache
+
+# arguments of find_flights_intersecting that are part of the key, besides the time and the fleet
+RESULTS_CACHE_ARGUMENTS = ("fov_size", "exposure", "fov_center_ra_h", "fov_center_ra_m", "fov_center_ra_s", "fov_center_dec",
+                           "observer_lon", "observer_lat", "altitude", "time_step")
+
+
+def results_cache_key(arguments: dict) -> str:
+    """
+    Hash of the arguments of a simulated find_flights_intersecting call, whose simulated_flights must be a SimulatedFleet.
+    Numbers are compared as floats, so 5 and 5.0 give the same key.
+    """
+    normalized = {name: float(arguments[name]) for name in RESULTS_CACHE_ARGUMENTS}
+    normalized["simulated_time"] = arguments["simulated_time"].utc.isot
+    normalized["refine_events"] = bool(arguments.get("refine_events", False))
+    normalized["flight_data_type"] = arguments["flight_data_type"]
+    normalized["fleet"] = arguments["simulated_flights"].digest
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+class ResultsCache:
+    """
+    Size-bounded LRU of computed results, with hit and miss counters.
+    The cached results are shared by every caller and must not be modified.
+    """
+    def __init__(self, max_size: int = RESULTS_CACHE_SIZE):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._results = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._results)
+
+    def get_or_compute(self, key: str, compute):
+        """
+        The result cached under key, or compute() which is then cached.
+        compute is called without holding the lock, so two identical misses may both compute.
+        :return: The result and whether it came from the cache.
+        """
+        with self._lock:
+            if key in self._results:
+                self.hits += 1
+                self._results.move_to_end(key)
+                return self._results[key], True
+            self.misses += 1
+
+        result = compute()
+        if self.max_size > 0:
+            with self._lock:
+                self._results[key] = result
+                self._results.move_to_end(key)
+                while len(self._results) > self.max_size:
+                    self._results.popitem(last=False)
+        return result, False
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+
+results_cache = ResultsCache()
@@ -0,0 +1,168 @@
+"""
+File to count, for a whole grid of candidate observer sites, how many flights would cross a pointing during an exposure.
+
+Calling find_flights_intersecting once per site would fetch and propagate the
+same flights again for every site. Here the flights around the grid are fetched
+once and moved once, as ECEF positions at every timestep (see batch.flight_ecef),
+and only the geometry of each observer is evaluated per site, in batches of
+sites against all flights and timesteps at once.
+
+The rotation from ECEF to the equatorial frame (see observer_frame) turns by the
+local sidereal time minus the observer's longitude, which is the Greenwich mean
+sidereal time for every site. So the FOV center is turned into ECEF once per
+timestep and shared by every site: a flight is in the FOV of a site when the
+direction from the site to the flight is within fov_size / 2 of it.
+
+A site counts a flight like find_flights_intersecting would report it: the
+flight is in the site's horizon (within fov.HORIZON_RADIUS) at the start, and
+in the FOV, above the site's horizon, at one of the timesteps at least.
+"""
+import math
+import os
+
+import numpy as np
+
+import utils.batch as batch
+import utils.fov as fov
+import utils.flight_api as flight_api
+import utils.flight_history as flight_history
+import utils.simulated_fleet as simulated_fleet
+from utils.constants import EARTH_RADIUS_METER
+from utils.datatypes import HMS, ProcessedFlightInfo
+from utils.flight_index import haversine
+from utils.integration import check_observer_input
+from utils.localsidereal import get_local_sidereal_times
+from utils.metrics import collect, stage
+from utils.observer_frame import ObserverFrame, unit_vector
+
+RISK_MAP_MAX_SITES = int(os.environ.get("RISK_MAP_MAX_SITES", 10000)) # sites one request may ask for
+RISK_MAP_BATCH_SIZE = int(os.environ.get("RISK_MAP_BATCH_SIZE", 2_000_000)) # site x flight x timestep elements evaluated at once
+
+
+def grid_axis(start: float, stop: float, count: int) -> np.ndarray:
+    """
+    count evenly spaced values from start to stop, both included.
+    :raise ValueError: If count is not positive.
+    """
+    if int(count) < 1:
+        raise ValueError("A grid axis must have at least one value.")
+    return np.linspace(float(start), float(stop), int(count))
+
+
+def grid_flights(flight_data_type: str, simulated_flights, simulated_fleet_id: str, lat: float, lon: float, radius: float,
+                 observer_time) -> tuple[list[ProcessedFlightInfo], int]:
+    """
+    The flights within radius meters of a point, live, historical or simulated, see find_flights_intersecting.
+    :return: The flights, and the number of flights they were selected from.
+    """
+    if flight_data_type == "live":
+        flight_data = flight_api.find_flights_in_circ_boundary(lat, lon, radius)
+        return flight_data, len(flight_data)
+    if flight_data_type == "historical":
+        snapshot = flight_history.get_flight_history().snapshot_at(observer_time.unix)
+        return snapshot.flights_in_radius(lat, lon, radius, observer_time.unix), len(snapshot)
+    fleet = simulated_fleet.get_simulated_fleet(simulated_flights, simulated_fleet_id)
+    return fleet.processed_flights(fleet.indices_in_radius(lat, lon, radius)), len(fleet)
+
+
+def grid_region(latitudes: np.ndarray, longitudes: np.ndarray) -> tuple[float, float, float]:
+    """
+    The circle the flights of a grid are fetched in, covering the horizon of every site.
+    :return: The latitude and longitude of its center in degrees, and its radius in meters.
+    """
+    site_lat, site_lon = np.meshgrid(latitudes, longitudes, indexing="ij")
+    center_lat, center_lon = float(latitudes.mean()), float(np.degrees(np.arctan2(np.sin(np.radians(longitudes)).mean(),
+                                                                                np.cos(np.radians(longitudes)).mean())))
+    return center_lat, center_lon, float(haversine(center_lat, center_lon, site_lat, site_lon).max()) + fov.HORIZON_RADIUS
+
+
+def find_crossings_grid(fov_size: float, exposure: float,
+                        fov_center_ra_h: float, fov_center_ra_m: float, fov_center_ra_s: float, fov_center_dec: float,
+                        latitudes, longitudes, altitude: float, flight_data_type: str, simulated_flights, simulated_time,
+                        time_step: float = 5, stats: dict = None, simulated_fleet_id: str = None,
+                        live_flights: list[ProcessedFlightInfo] = None) -> dict[str, np.ndarray]:
+    """
+    Count the flights crossing a pointing for every site of a lat/lon grid.
+    :param latitudes: The latitudes of the rows of the grid, in degrees.
+    :param longitudes: The longitudes of the columns of the grid, in degrees.
+    :param altitude: The altitude of every site, in meters.
+    See find_flights_intersecting for the other parameters.
+    :param stats: If given, filled with the number of candidate flights, the flights around the grid and the sites.
+    :param live_flights: The live flights around the grid, if already fetched in grid_region.
+    :return: "crossings", the number of flights crossing the fov seen from each site, and "elevation", the elevation
+        of the fov center in degrees at the start of the exposure, each of shape (latitudes, longitudes).
+    :raise ValueError: If the input values are invalid.
+    """
+    latitudes, longitudes = np.asarray(latitudes, dtype=float).reshape(-1), np.asarray(longitudes, dtype=float).reshape(-1)
+    if not len(latitudes) or not len(longitudes) or len(latitudes) * len(longitudes) > RISK_MAP_MAX_SITES:
+        raise ValueError(f"The grid must have between 1 and {RISK_MAP_MAX_SITES} sites.")
+    if np.any(np.abs(latitudes) > 90) or np.any(np.abs(longitudes) > 180):
+        raise ValueError("Grid latitudes must be in the range [-90, 90] and longitudes in the range [-180, 180].")
+    check_observer_input(float(latitudes[0]), float(longitudes[0]), flight_data_type, simulated_flights, time_step, simulated_fleet_id,
+                         exposure)
+    if fov_center_dec < -90 or fov_center_dec > 90:
+        raise ValueError("FOV center declination must be in the range [-90, 90].")
+    if stats is None:
+        stats = dict()
+
+    site_lat, site_lon = (grid.reshape(-1) for grid in np.meshgrid(latitudes, longitudes, indexing="ij"))
+    stats["sites"] = len(site_lat)
+
+    # one query around the grid covers the horizon of every site
+    if flight_data_type == "live" and live_flights is not None:
+        flight_data, stats["candidates"] = live_flights, len(live_flights)
+    else:
+        with stage("fetch"):
+            flight_data, stats["candidates"] = grid_flights(flight_data_type, simulated_flights, simulated_fleet_id,
+                                                            *grid_region(latitudes, longitudes), simulated_time)
+    flight_data = fov.remove_ground_flights(flight_data)
+    stats["propagated"] = len(flight_data)
+
+    elapsed_times = np.arange(0, int(exposure), time_step)
+    fov_center = unit_vector(HMS(fov_center_ra_h, fov_center_ra_m, fov_center_ra_s).to_degrees(), fov_center_dec)
+    with stage("sidereal"):
+        # at longitude 0, the rotation of every site (see the top of this file)
+        rotation = ObserverFrame({"latitude": 0, "longitude": 0, "altitude": 0},
+                                 get_local_sidereal_times(0, 0, simulated_time, elapsed_times if len(elapsed_times) else np.zeros(1))).rotation
+    # the fov center in ECEF at every timestep, each of shape (timesteps,), with the transposed rotations
+    center = tuple(sum(rotation[:, row, column] * fov_center[row] for row in range(3)) for column in range(3))
+
+    # the up direction of the sites in ECEF, longitude and latitude play the part of RA and Dec
+    site_up = unit_vector(site_lon, site_lat)
+    site_position = tuple((EARTH_RADIUS_METER + altitude) * component for component in site_up)
+    elevation = np.degrees(np.arcsin(np.clip(sum(up * component[0] for up, component in zip(site_up, center)), -1, 1)))
+    crossings = np.zeros(len(site_lat), dtype=int)
+
+    if flight_data and len(elapsed_times):
+        with stage("propagate"):
+            flights = batch.flight_arrays(flight_data)
+            positions = batch.flight_ecef(flights, elapsed_times.reshape(1, -1))
+            cos_fov = math.cos(math.radians(fov_size / 2))
+
+            sites_per_batch = max(1, RISK_MAP_BATCH_SIZE // (len(flight_data) * len(elapsed_times)))
+            for start in range(0, len(site_lat), sites_per_batch):
+                part = slice(start, start + sites_per_batch)
+                # flights in the horizon of the site at the start, like find_horizon_flights, shape (sites, flights)
+                in_horizon = haversine(site_lat[part, None], site_lon[part, None], flights["latitude"].reshape(1, -1),
+                                       flights["longitude"].reshape(1, -1)) <= fov.HORIZON_RADIUS
+                # from the sites to the flights, shape (sites, flights, timesteps)
+                direction = tuple(position[None] - site[part, None, None] for position, site in zip(positions, site_position))
+                distance = np.sqrt(sum(component**2 for component in direction))
+                above_horizon = sum(component * up[part, None, None] for component, up in zip(direction, site_up)) > 0
+                in_fov = sum(component * center_component for component, center_component in zip(direction, center)) > cos_fov * distance
+                crossings[part] = np.count_nonzero((in_fov & above_horizon).any(axis=2) & in_horizon, axis=1)
+
+    shape = (len(latitudes), len(longitudes))
+    return {"crossings": crossings.reshape(shape), "elevation": elevation.reshape(shape)}
+
+
+def run_find_crossings_grid(arguments: dict) -> tuple[dict[str, np.ndarray], dict, dict]:
+    """
+    find_crossings_grid for a worker process (see utils.compute_pool), like integration.run_find_flights_intersecting.
+    :param arguments: The keyword arguments of find_crossings_grid, without stats.
+    :return: The risk map, the stats and the stage timings (see utils.metrics).
+    """
+    stats = dict()
+    with collect() as timings:
+        risk_map = find_crossings_grid(**arguments, stats=stats)
+    return risk_map, stats, timings
@@ -0,0 +1,144 @@
+"""
+File to split the flights of large scenes across worker processes.
+
+Every flight is propagated and tested against the FOV independently of the
+others, so a scene can be cut into contiguous shards of flights, one per worker
+process. Only compact flight records (an array of speed, altitude, heading,
+latitude and longitude per flight) and the per-request constants are sent to
+the workers. Each worker sends back the RA/Dec and the FOV test of its flights
+at every timestep. The shards are concatenated in flight order before walking
+them with integration.record_intersections, so the positions and entry/exit
+events are the same, in the same order, as without sharding.
+
+Sharding only pays off once the computation outweighs sending the shards to
+the workers, so scenes with fewer than SHARD_MIN_FLIGHTS flights are computed
+in the calling process. Scenes are only sharded from the server process: a
+compute worker (see compute_pool) computes its scenes itself, so there are
+never more than COMPUTE_WORKERS or SHARD_WORKERS worker processes, not their
+product. Like the compute workers, shard workers are not forked from the
+threaded server, see compute_pool.process_context.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+
+import utils.batch as batch
+import utils.compute_pool as compute_pool
+import utils.observer_frame as observer_frame
+from utils.datatypes import ProcessedFlightInfo
+from utils.observer_frame import ObserverFrame
+
+SHARD_WORKERS = int(os.environ.get("SHARD_WORKERS", 0)) # worker processes a scene is split across, 0 or 1 disables sharding
+SHARD_MIN_FLIGHTS = int(os.environ.get("SHARD_MIN_FLIGHTS", 5000)) # scenes with fewer flights are computed in the calling process
+
+# columns of the flight records, in the units of ProcessedFlightInfo
+RECORD_FIELDS = ("speed", "altitude", "heading", "latitude", "longitude")
+
+
+def flight_records(flight_data: list[ProcessedFlightInfo]) -> np.ndarray:
+    """
+    The fields of the flights needed to propagate them, without their ids and flight numbers.
+    :return: An array of shape (flights, len(RECORD_FIELDS)): speed in knots, altitude in feet, heading, latitude and longitude in degrees.
+    """
+    return np.array([[getattr(flight, field) for field in RECORD_FIELDS] for flight in flight_data], dtype=float).reshape(-1, len(RECORD_FIELDS))
+
+
+def shard_intersections(records: np.ndarray, user_gps: dict[str, float], elapsed_times: list, local_sidereal_times: np.ndarray,
+                        fov_center: dict[str, float], fov_size: float, vectorized: bool) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Compute the positions of one shard of flights, in a worker process.
+    :param records: The flights, see flight_records.
+    :param local_sidereal_times: The local sidereal time in radians at each elapsed time.
+    :param vectorized: Use the batch engine like integration.check_intersection_batch, otherwise the scalar
+        reference path like integration.check_intersection.
+    :return: Right Ascension, Declination and whether the flight is in the fov, each of shape (flights, timesteps).
+    """
+    if vectorized:
+        columns = {field: records[:, [index]] for index, field in enumerate(RECORD_FIELDS)}
+        flights = {**columns, "speed": columns["speed"] * batch.KNOTS_TO_METERS_PER_SECOND,
+                   "altitude": columns["altitude"] * batch.FEET_TO_METERS}
+        frame = ObserverFrame(user_gps, np.asarray(local_sidereal_times, dtype=float).reshape(1, -1))
+        directions = frame.equatorial(*batch.flight_ecef(flights, np.asarray(elapsed_times, dtype=float).reshape(1, -1)))
+        ra, dec = observer_frame.ra_dec(*directions)
+        return (ra, dec, observer_frame.is_intersecting(*directions, fov_center, fov_size))
+
+    # integration imports this module
+    from utils.integration import convert_flight_lat_lon_to_ra_dec
+    import utils.fov as fov
+
+    ra = np.empty((len(records), len(elapsed_times)))
+    dec = np.empty((len(records), len(elapsed_times)))
+    intersecting = np.zeros((len(records), len(elapsed_times)), dtype=bool)
+    for index, record in enumerate(records.tolist()):
+        flight = ProcessedFlightInfo(None, None, **dict(zip(RECORD_FIELDS, record)))
+        for step, (elapsed_time, local_sidereal_time) in enumerate(zip(elapsed_times, np.asarray(local_sidereal_times).tolist())):
+            ra[index, step], dec[index, step] = convert_flight_lat_lon_to_ra_dec(flight, None, elapsed_time, user_gps, local_sidereal_time)
+            intersecting[index, step] = fov.is_intersecting(ra[index, step], dec[index, step], fov_center["RA"], fov_center["Dec"], fov_size)
+    return (ra, dec, intersecting)
+
+
+class ShardPool:
+    """
+    A process pool computing the shards of large scenes.
+    """
+    def __init__(self, workers: int = SHARD_WORKERS, min_flights: int = SHARD_MIN_FLIGHTS):
+        self.workers = workers
+        self.min_flights = min_flights
+        self._executor: ProcessPoolExecutor = None
+        self._lock = threading.Lock()
+
+    def enabled_for(self, flights: int) -> bool:
+        """ Whether a scene with this many flights is sharded, never in a worker process (see the top of this file). """
+        return self.workers > 1 and flights >= max(self.min_flights, self.workers) and multiprocessing.parent_process() is None
+
+    def intersections(self, flight_data: list[ProcessedFlightInfo], user_gps: dict[str, float], elapsed_times: list,
+                      local_sidereal_times: np.ndarray, fov_center: dict[str, float], fov_size: float,
+                      vectorized: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Same as shard_intersections for all the flights, computed in one shard per worker.
+        :return: Right Ascension, Declination and whether the flight is in the fov, each of shape (flights, timesteps),
+            in the order of flight_data.
+        :raise BrokenProcessPool: If a worker died again after the retry.
+        """
+        local_sidereal_times = np.asarray(local_sidereal_times, dtype=float)
+        shards = np.array_split(flight_records(flight_data), self.workers)
+        try:
+            results = self._compute(shards, user_gps, list(elapsed_times), local_sidereal_times, fov_center, fov_size, vectorized)
+        except BrokenProcessPool:
+            # a worker died, the broken pool was dropped: retry once with a new one
+            results = self._compute(shards, user_gps, list(elapsed_times), local_sidereal_times, fov_center, fov_size, vectorized)
+        return tuple(np.concatenate([result[part] for result in results]) for part in range(3))
+
+    def _compute(self, shards: list[np.ndarray], *arguments) -> list[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Compute every shard with shard_intersections(shard, *arguments), one per worker.
+        :raise BrokenProcessPool: If a worker died, the pool is then replaced for the next computations.
+        """
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=compute_pool.process_context())
+            executor = self._executor
+
+        try:
+            futures = [executor.submit(shard_intersections, shard, *arguments) for shard in shards]
+            # the shards are merged in flight order, whichever worker finishes first
+            return [future.result() for future in futures]
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+shard_pool = ShardPool()
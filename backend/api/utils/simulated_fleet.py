@@ -0,0 +1,140 @@
+"""
+File to hold large simulated fleets as arrays instead of one object per flight.
+
+A simulated request can carry 50k-200k flights. SimulatedFleet parses the list
+once into numpy columns and sorts the flights by lat/lon grid cell, so the
+horizon test only computes distances for the cells around the observer and only
+creates ProcessedFlightInfo objects for the flights that pass it. Fleets sent
+with a simulatedFleetId are kept in a small LRU cache, so the same fleet can be
+reused across requests without being parsed (or even sent) again.
+"""
+import hashlib
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from utils.datatypes import ProcessedFlightInfo, stable_flight_id
+from utils.constants import EARTH_RADIUS_METER
+from utils.flight_index import haversine
+
+SIMULATED_FLEET_CELL_SIZE = 1 # degrees of latitude/longitude per grid cell
+SIMULATED_FLEET_CACHE_SIZE = 8 # number of fleets kept for reuse
+
+
+class SimulatedFleet:
+    """
+    Simulated flights as column arrays, sorted by grid cell.
+    """
+    def __init__(self, simulated_flights: list[dict], cell_size: float = SIMULATED_FLEET_CELL_SIZE):
+        """
+        :raise ValueError: If a flight misses a field or a field is not a number.
+        """
+        self.cell_size = cell_size
+        try:
+            self.flight_numbers = [flight["flightNumber"] for flight in simulated_flights]
+            self.latitude = np.array([flight["latitude"] for flight in simulated_flights], dtype=float)
+            self.longitude = np.array([flight["longitude"] for flight in simulated_flights], dtype=float)
+            self.altitude = np.array([flight["altitude"] for flight in simulated_flights], dtype=float) # in feet
+            self.speed = np.array([flight["speed"] for flight in simulated_flights], dtype=float) # in knots
+            self.heading = np.array([flight["heading"] for flight in simulated_flights], dtype=float)
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Invalid simulated flight: {e!r}") from e
+        self.digest = self._digest() # identifies the content of the fleet, e.g. for results_cache
+
+        # flight indices sorted by cell, and where each cell starts in that order
+        self._columns = math.ceil(360 / cell_size)
+        cells = self._cell_keys(self.latitude, self.longitude)
+        self._order = np.argsort(cells, kind="stable")
+        self._cells, self._starts, self._counts = np.unique(cells[self._order], return_index=True, return_counts=True)
+
+    def __len__(self):
+        return len(self.flight_numbers)
+
+    def _digest(self) -> str:
+        digest = hashlib.sha1("\0".join(map(str, self.flight_numbers)).encode())
+        for column in (self.latitude, self.longitude, self.altitude, self.speed, self.heading):
+            digest.update(column.tobytes())
+        return digest.hexdigest()
+
+    def _cell_keys(self, latitude, longitude) -> np.ndarray:
+        rows = np.floor((np.asarray(latitude) + 90) / self.cell_size).astype(np.int64)
+        columns = np.floor(np.mod(np.asarray(longitude) + 180, 360) / self.cell_size).astype(np.int64)
+        return rows * self._columns + columns
+
+    def _candidates(self, lat: float, lon: float, radius: float) -> np.ndarray:
+        """ indices of the flights in every cell that touches the bounding box of the circle """
+        delta_lat = math.degrees(radius / EARTH_RADIUS_METER)
+        cos_lat = math.cos(math.radians(min(abs(lat) + delta_lat, 90)))
+        if cos_lat < 1e-6 or radius >= math.pi * EARTH_RADIUS_METER / 2:
+            return np.arange(len(self))
+        delta_lon = min(math.degrees(radius / (EARTH_RADIUS_METER * cos_lat)), 180)
+
+        rows = np.arange(math.floor((lat - delta_lat + 90) / self.cell_size), math.floor((lat + delta_lat + 90) / self.cell_size) + 1)
+        columns = np.arange(math.floor((lon - delta_lon + 180) / self.cell_size), math.floor((lon + delta_lon + 180) / self.cell_size) + 1)
+        keys = np.unique((rows[:, None] * self._columns + np.mod(columns, self._columns)[None, :]).reshape(-1))
+
+        found = np.searchsorted(self._cells, keys)
+        found = found[(found < len(self._cells)) & (self._cells[np.minimum(found, len(self._cells) - 1)] == keys)]
+        if not len(found):
+            return np.zeros(0, dtype=np.int64)
+        return np.concatenate([self._order[start:start + count] for start, count in zip(self._starts[found], self._counts[found])])
+
+    def indices_in_radius(self, lat: float, lon: float, radius: float) -> np.ndarray:
+        """
+        Indices of the flights within radius meters of a point, in the order they were given.
+        """
+        candidates = self._candidates(lat, lon, radius)
+        distance = haversine(lat, lon, self.latitude[candidates], self.longitude[candidates])
+        return np.sort(candidates[distance <= radius])
+
+    def processed_flights(self, indices) -> list[ProcessedFlightInfo]:
+        return [
+            ProcessedFlightInfo(
+                id=stable_flight_id("simulated", index, self.flight_numbers[index]),
+                flightNumber=self.flight_numbers[index],
+                latitude=float(self.latitude[index]),
+                longitude=float(self.longitude[index]),
+                altitude=float(self.altitude[index]),
+                speed=float(self.speed[index]),
+                heading=float(self.heading[index]),
+            )
+            for index in indices
+        ]
+
+
+_fleets: OrderedDict[str, SimulatedFleet] = OrderedDict()
+_fleets_lock = threading.Lock()
+
+
+def get_simulated_fleet(simulated_flights: list[dict] = None, fleet_id: str = None) -> SimulatedFleet:
+    """
+    Parse the simulated flights, or reuse the fleet previously sent with the same fleet_id.
+    If both are given, the fleet is (re)built from simulated_flights and stored under fleet_id.
+    simulated_flights can also be an already parsed SimulatedFleet, which is returned as is.
+    :raise ValueError: If neither the flights nor a known fleet_id is given.
+    """
+    if isinstance(simulated_flights, SimulatedFleet):
+        return simulated_flights
+    if simulated_flights is None:
+        with _fleets_lock:
+            fleet = _fleets.get(fleet_id) if fleet_id is not None else None
+            if fleet is None:
+                raise ValueError("Simulated flights must be provided")
+            _fleets.move_to_end(fleet_id)
+            return fleet
+
+    fleet = SimulatedFleet(simulated_flights)
+    if fleet_id is not None:
+        with _fleets_lock:
+            _fleets[fleet_id] = fleet
+            _fleets.move_to_end(fleet_id)
+            while len(_fleets) > SIMULATED_FLEET_CACHE_SIZE:
+                _fleets.popitem(last=False)
+    return fleet
+
+
+def has_simulated_fleet(fleet_id: str) -> bool:
+    with _fleets_lock:
+        return fleet_id in _fleets
@@ -0,0 +1,235 @@
+"""
+File to push flight-prediction updates to subscribers instead of having every
+client resubmit the form.
+
+A subscription is registered once with the flight-prediction form. Subscribers
+whose forms normalize to the same key share one SubscriptionChannel, which
+recomputes the prediction every interval in a background thread for as long as
+it has subscribers. Every subscriber remembers the last state it was sent and
+only receives what changed since: new flights, updated tracks, flights that
+left and new entry/exit events. A slow subscriber simply gets the changes of
+several refreshes at once, so no per-subscriber queue can grow.
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+
+SUBSCRIPTION_INTERVAL = float(os.environ.get("SUBSCRIPTION_INTERVAL", 10)) # seconds between two refreshes of a channel
+SUBSCRIPTION_KEEPALIVE = 15 # seconds without changes after which subscribers get a keepalive
+SUBSCRIPTION_PRECISION = 4 # decimals kept of the observer and fov coordinates when normalizing
+SUBSCRIPTION_MAX_FORMS = 256 # registered forms kept, the oldest ones without subscribers are dropped first
+SUBSCRIPTION_MAX_CHANNELS = int(os.environ.get("SUBSCRIPTION_MAX_CHANNELS", 64)) # channels refreshing at once, one thread each
+
+# form fields that change the result of a prediction, the others are ignored for the key
+SUBSCRIPTION_FIELDS = ("focalLength", "cameraSensorSize", "barlowReducerFactor", "exposure", "fovCenterRaH", "fovCenterRaM",
+                       "fovCenterRaS", "fovCenterDec", "latitude", "longitude", "altitude", "flightDataType", "datetime",
+                       "simulatedFlights", "simulatedFleetId", "timeStep")
+
+
+class TooManySubscriptions(Exception):
+    """ Raised when a new channel would exceed the hub's max_channels. """
+
+
+def normalize_subscription(data: dict) -> dict:
+    """
+    The fields of a flight-prediction form that matter, with numbers rounded so nearby sites share a channel.
+    """
+    normalized = dict()
+    for field in SUBSCRIPTION_FIELDS:
+        value = data.get(field)
+        if value is None or value == "":
+            continue
+        if field not in ("flightDataType", "datetime", "simulatedFlights", "simulatedFleetId"):
+            value = round(float(value), SUBSCRIPTION_PRECISION)
+        normalized[field] = value
+    return normalized
+
+
+def subscription_key(normalized: dict) -> str:
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode()).hexdigest()
+
+
+def flight_states(flights_position: list[list[dict]], flight_results: list, time_step: float) -> dict[str, dict]:
+    """
+    The state pushed to subscribers: one entry per flight that enters the fov, with its track through the fov.
+    Flights are keyed by their id, which is the same in every refresh (see datatypes.stable_flight_id).
+    """
+    states = dict()
+    for result in flight_results:
+        if result.entry:
+            states[str(result.flight.id)] = {**result.to_dict(), "track": []}
+    for step, curr_flight_positions in enumerate(flights_position):
+        for position in curr_flight_positions:
+            key = str(position["ID"])
+            if key in states:
+                states[key]["track"].append({"elapsedTime": step * time_step, "RA": position["RA"], "Dec": position["Dec"]})
+    return states
+
+
+def diff_states(previous: dict[str, dict], current: dict[str, dict]) -> dict:
+    """
+    What changed between two states: flights added, updated (track or entry/exit) and removed, and the new entry/exit events.
+    """
+    added = [state for key, state in current.items() if key not in previous]
+    updated = [state for key, state in current.items() if key in previous and state != previous[key]]
+    removed = [key for key in previous if key not in current]
+
+    events = []
+    for state in added + updated:
+        before = previous.get(str(state["id"]), {})
+        for event in ("entry", "exit"):
+            if state[event] and state[event] != before.get(event):
+                events.append({"type": event, "FlightNumber": state["flight_number"], "ID": state["id"], "time": state[event]})
+    return {"added": added, "updated": updated, "removed": removed, "events": events}
+
+
+class SubscriptionChannel:
+    """
+    One shared computation, refreshed every interval while it has subscribers.
+    """
+    def __init__(self, key: str, compute, interval: float = SUBSCRIPTION_INTERVAL):
+        self.key = key
+        self.compute = compute # called without arguments, returns a state (see flight_states)
+        self.interval = interval
+        self.subscribers = 0
+        self.state: dict[str, dict] = dict()
+        self.version = 0
+        self.error: Exception = None
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"subscription-{self.key[:8]}", daemon=True)
+            self._thread.start()
+
+    @property
+    def stopped(self) -> bool:
+        return self._stop.is_set()
+
+    def stop(self):
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def refresh(self):
+        try:
+            state, error = self.compute(), None
+        except Exception as e:
+            # keep the last state, subscribers are told about the error
+            state, error = self.state, e
+        with self._condition:
+            self.state, self.error = state, error
+            self.version += 1
+            self._condition.notify_all()
+
+    def wait_for_update(self, seen_version: int, timeout: float) -> tuple[int, dict, Exception]:
+        """
+        Block until there is a version newer than seen_version, the channel stops, or the timeout passes.
+        :return: The latest version, its state and the error of the last refresh, if any.
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self.version != seen_version or self._stop.is_set(), timeout)
+            return self.version, self.state, self.error
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+
+class SubscriptionHub:
+    """
+    The channels by key, each shared by all subscribers of the same normalized form.
+    """
+    def __init__(self, interval: float = SUBSCRIPTION_INTERVAL, keepalive: float = SUBSCRIPTION_KEEPALIVE,
+                 max_channels: int = SUBSCRIPTION_MAX_CHANNELS):
+        self.interval = interval
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self.forms: dict[str, dict] = dict() # registered forms by key
+        self.channels: dict[str, SubscriptionChannel] = dict()
+        self._lock = threading.Lock()
+
+    def register(self, data: dict) -> str:
+        """
+        Register a flight-prediction form and return the key to subscribe to.
+        :raise ValueError: If a numeric field of the form is not a number.
+        """
+        normalized = normalize_subscription(data)
+        key = subscription_key(normalized)
+        with self._lock:
+            self.forms.pop(key, None)
+            self.forms[key] = normalized
+            for old_key in [old_key for old_key in self.forms if old_key not in self.channels][:max(len(self.forms) - SUBSCRIPTION_MAX_FORMS, 0)]:
+                del self.forms[old_key]
+        return key
+
+    def subscribe(self, key: str, compute) -> SubscriptionChannel:
+        """
+        Join the channel of a registered form, starting it if needed.
+        :param compute: Called with the normalized form, returns its state. Only used if the channel is not running yet.
+        :raise KeyError: If no form was registered under key.
+        :raise TooManySubscriptions: If the channel is not running and max_channels are.
+        """
+        with self._lock:
+            form = self.forms[key]
+            channel = self.channels.get(key)
+            if channel is None:
+                if len(self.channels) >= self.max_channels:
+                    raise TooManySubscriptions(f"{len(self.channels)} subscriptions already running")
+                channel = SubscriptionChannel(key, lambda: compute(form), self.interval)
+                self.channels[key] = channel
+            channel.subscribers += 1
+            channel.start()
+            return channel
+
+    def unsubscribe(self, channel: SubscriptionChannel):
+        with self._lock:
+            channel.subscribers -= 1
+            if channel.subscribers <= 0:
+                channel.stop()
+                if self.channels.get(channel.key) is channel:
+                    del self.channels[channel.key]
+
+    def updates(self, key: str, compute):
+        """
+        Generator of the changes a new subscriber of key should receive, see changes.
+        The subscription ends when the generator is closed.
+        """
+        channel = self.subscribe(key, compute)
+        try:
+            yield from self.changes(channel)
+        finally:
+            self.unsubscribe(channel)
+
+    def changes(self, channel: SubscriptionChannel):
+        """
+        Generator of the changes of a channel already subscribed to, starting with the full state, possibly empty,
+        once the channel's first refresh is done or after keepalive seconds.
+        Yields None as a keepalive when nothing was sent for keepalive seconds, and {"error": ...} when a refresh fails.
+        Closing it does not unsubscribe.
+        """
+        version, state, error = channel.wait_for_update(0, self.keepalive)
+        yield {"error": str(error)} if error is not None else diff_states(dict(), state)
+        seen_version, seen_state, last_sent = version, state, time.monotonic()
+        while not channel.stopped:
+            # refreshes without changes do not count as sent
+            version, state, error = channel.wait_for_update(seen_version, max(last_sent + self.keepalive - time.monotonic(), 0))
+            if version != seen_version:
+                seen_version = version
+                update = {"error": str(error)} if error is not None else diff_states(seen_state, state)
+                if error is None:
+                    seen_state = state
+                if any(update.values()):
+                    yield update
+                    last_sent = time.monotonic()
+                    continue
+            if time.monotonic() - last_sent >= self.keepalive:
+                yield None
+                last_sent = time.monotonic()
+
+hub = SubscriptionHub()
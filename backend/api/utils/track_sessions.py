@@ -0,0 +1,151 @@
+"""
+File to reuse the flight tracks of a client's previous poll.
+
+A client that re-polls the same observer every few seconds mostly gets the same
+aircraft, a few seconds further along. A TrackSession keeps the RA/Dec track of
+every flight of the last poll, by stable flight id, on a time grid anchored at
+the first poll (polls are snapped to the nearest timestep of that grid). On the
+next poll, a flight whose heading, speed and altitude did not change and whose
+reported position is where its previous track put it keeps that track: only the
+timesteps past the end of the previous exposure are computed, from the state it
+was tracked with. New and changed flights get a full track from their reported
+state.
+"""
+from __future__ import annotations
+
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import utils.batch as batch
+from utils.datatypes import ProcessedFlightInfo
+from utils.flight_index import haversine
+
+if TYPE_CHECKING:
+    from astropy.time import Time
+
+TRACK_SESSIONS = 64 # sessions kept, the least recently polled ones are dropped first
+TRACK_POSITION_TOLERANCE = 250 # meters a flight may be off its previous track and still keep it
+
+
+@dataclass(slots=True)
+class Track:
+    flight: ProcessedFlightInfo # the state the track was computed from
+    origin: float # seconds after the session anchor at which the flight was at its reported position
+    first_step: int # grid timestep of the first RA/Dec
+    ra: np.ndarray
+    dec: np.ndarray
+
+
+class TrackSession:
+    """
+    The tracks of the flights of one client's last poll of one observer.
+    """
+    def __init__(self, user_gps: dict[str, float], time_step: float, anchor: Time):
+        self.user_gps = dict(user_gps)
+        self.time_step = time_step
+        self.anchor = anchor
+        self.tracks: dict[uuid.UUID, Track] = dict()
+        self.lock = threading.Lock()
+
+    def matches(self, user_gps: dict[str, float], time_step: float) -> bool:
+        return self.user_gps == user_gps and self.time_step == time_step
+
+    def snap(self, observer_time: Time) -> tuple[Time, int, float]:
+        """
+        The timestep of the session grid closest to observer_time.
+        :return: Its time, its index and the seconds from the anchor to observer_time.
+        """
+        from astropy.time import TimeDelta
+        seconds = float((observer_time - self.anchor).sec)
+        step = round(seconds / self.time_step)
+        return self.anchor + TimeDelta(step * self.time_step, format='sec'), step, seconds
+
+    def flights_ra_dec(self, flight_data: list[ProcessedFlightInfo], first_step: int, origin: float, elapsed_times,
+                       local_sidereal_times, stats: dict = None) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Same as batch.flights_ra_dec at the grid timesteps starting at first_step, reusing the tracks of the last poll,
+        which are then replaced by the tracks of flight_data.
+        :param origin: Seconds after the anchor at which the flights were at their reported positions, see snap.
+        :param elapsed_times: The elapsed times in seconds since the first_step timestep, multiples of the time step.
+        :param local_sidereal_times: The local sidereal time in radians at each elapsed time.
+        :param stats: If given, "tracks" is set to how many flights were "reused" and "recomputed".
+        :return: Right Ascension and Declination in degrees, each of shape (flights, timesteps).
+        """
+        steps = len(elapsed_times)
+        ra, dec = np.empty((len(flight_data), steps)), np.empty((len(flight_data), steps))
+        elapsed_times = np.asarray(elapsed_times, dtype=float)
+        local_sidereal_times = np.asarray(local_sidereal_times, dtype=float)
+
+        with self.lock:
+            reused = self._reusable(flight_data, origin)
+            tracks = [self.tracks[flight.id] if reuse else Track(flight, origin, first_step, None, None)
+                      for flight, reuse in zip(flight_data, reused)]
+
+            # copy what the previous tracks already cover, and group the flights by the first timestep still missing
+            missing_from = np.zeros(len(flight_data), dtype=int)
+            for index, track in enumerate(tracks):
+                if track.ra is not None:
+                    start = first_step - track.first_step
+                    covered = max(min(len(track.ra) - start, steps), 0) if start >= 0 else 0
+                    ra[index, :covered], dec[index, :covered] = track.ra[start:start + covered], track.dec[start:start + covered]
+                    missing_from[index] = covered
+
+            for start in np.unique(missing_from[missing_from < steps]):
+                indices = np.flatnonzero(missing_from == start)
+                flights = batch.flight_arrays([tracks[index].flight for index in indices])
+                origins = np.array([tracks[index].origin for index in indices]).reshape(-1, 1)
+                times = (first_step * self.time_step + elapsed_times[start:]).reshape(1, -1) - origins
+                ra[indices, start:], dec[indices, start:] = batch.positions_ra_dec(
+                    flights, self.user_gps, times, local_sidereal_times[start:].reshape(1, -1))
+
+            self.tracks = {track.flight.id: Track(track.flight, track.origin, first_step, ra[index], dec[index])
+                           for index, track in enumerate(tracks)}
+
+        if stats is not None:
+            stats["tracks"] = {"reused": int(np.count_nonzero(reused)), "recomputed": int(len(reused) - np.count_nonzero(reused))}
+        return ra, dec
+
+    def _reusable(self, flight_data: list[ProcessedFlightInfo], origin: float) -> np.ndarray:
+        """ Whether each flight can keep its previous track: same heading, speed and altitude, and still on it. """
+        tracks = [self.tracks.get(flight.id) for flight in flight_data]
+        reused = np.array([track is not None and (track.flight.heading, track.flight.speed, track.flight.altitude) ==
+                           (flight.heading, flight.speed, flight.altitude) for flight, track in zip(flight_data, tracks)], dtype=bool)
+        candidates = np.flatnonzero(reused)
+        if not len(candidates):
+            return reused
+
+        # where the previous tracks put these flights now
+        flights = batch.flight_arrays([tracks[index].flight for index in candidates])
+        elapsed = origin - np.array([tracks[index].origin for index in candidates]).reshape(-1, 1)
+        # with the model the tracks were computed with
+        theta, phi = batch.flight_positions(flights, elapsed)
+        distance = haversine(90 - np.degrees(phi[:, 0]), np.degrees(theta[:, 0]),
+                             [flight_data[index].latitude for index in candidates], [flight_data[index].longitude for index in candidates])
+        with np.errstate(invalid="ignore"):
+            reused[candidates] = distance <= TRACK_POSITION_TOLERANCE
+        return reused
+
+
+_sessions: OrderedDict[str, TrackSession] = OrderedDict()
+_sessions_lock = threading.Lock()
+
+
+def get_track_session(session_id: str, user_gps: dict[str, float], time_step: float, observer_time: Time) -> TrackSession:
+    """
+    The session kept under session_id, or a new one anchored at observer_time if there is none
+    or it was for another observer or time step.
+    """
+    with _sessions_lock:
+        session = _sessions.get(session_id)
+        if session is None or not session.matches(user_gps, time_step):
+            session = TrackSession(user_gps, time_step, observer_time)
+            _sessions[session_id] = session
+        _sessions.move_to_end(session_id)
+        while len(_sessions) > TRACK_SESSIONS:
+            _sessions.popitem(last=False)
+        return session
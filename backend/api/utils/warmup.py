@@ -0,0 +1,51 @@
+"""
+File to load, before the first request, what a fresh worker would otherwise load during it.
+
+The heavy modules (astropy, timezonefinder, FlightRadar24) are only imported
+when first needed, so importing the app is fast, but the first prediction then
+pays for those imports, for astropy's first sidereal time computation and for
+loading the timezone polygons. warm_up does all of that once, e.g. from the
+/warmup endpoint used as a readiness probe, before the worker takes traffic.
+"""
+import importlib
+import threading
+from datetime import datetime, timezone
+
+from utils.metrics import collect, stage
+
+WARMUP_MODULES = ("astropy.time", "astropy.coordinates", "timezonefinder", "FlightRadar24")
+# any observer works, the caches filled do not depend on it
+WARMUP_OBSERVER = {"latitude": 43.6532, "longitude": -79.3832, "altitude": 100}
+WARMUP_TIME = datetime(2024, 6, 1, 2, 0, 0, tzinfo=timezone.utc) # within the IERS table shipped with astropy
+WARMUP_FLIGHTS = [{"flightNumber": "WARMUP", "latitude": 43.9002, "longitude": -80.2114, "altitude": 35000, "speed": 490, "heading": 111}]
+
+_timings: dict[str, float] = None
+_lock = threading.Lock()
+
+
+def warm_up() -> dict[str, float]:
+    """
+    Import the heavy modules and run a small prediction. Only the first call does the work, later ones return at once.
+    :return: The seconds taken by each step of the first call.
+    """
+    global _timings
+    with _lock:
+        if _timings is None:
+            from astropy.time import Time
+            from utils.integration import find_flights_intersecting
+            from utils.localsidereal import SiderealTimeTable, get_timezone_name
+
+            with collect() as timings:
+                with stage("imports"):
+                    for module in WARMUP_MODULES:
+                        importlib.import_module(module)
+                with stage("sidereal"):
+                    SiderealTimeTable(WARMUP_OBSERVER["latitude"], WARMUP_OBSERVER["longitude"], Time(WARMUP_TIME), [0])
+                with stage("timezone"):
+                    get_timezone_name(WARMUP_OBSERVER["latitude"], WARMUP_OBSERVER["longitude"])
+                with stage("prediction"), collect(): # without the stages of the prediction
+                    find_flights_intersecting(2, 60, 0, 0, 0, WARMUP_OBSERVER["latitude"], WARMUP_OBSERVER["longitude"],
+                                              WARMUP_OBSERVER["latitude"], WARMUP_OBSERVER["altitude"], "simulated", WARMUP_FLIGHTS,
+                                              Time(WARMUP_TIME))
+            _timings = timings
+        return _timings
@@ -0,0 +1,321 @@
+"""
+File to benchmark the flight-prediction pipeline on seeded synthetic fleets.
+
+Every stage is timed on its fast path (numpy batch engine, grid-indexed fleet)
+and, within SCALAR_BUDGET evaluations, on its scalar reference, and the two are
+cross-checked: the results must agree to within batch.BATCH_TOLERANCE_DEG.
+Results are written as JSON, one record per stage, path, fleet size and
+exposure, so they can be compared between commits.
+
+Run from the backend directory:
+    PYTHONPATH=api python benchmarks/bench_prediction.py --output bench.json
+The process exits with status 1 if any accuracy check fails.
+"""
+import argparse
+import json
+import math
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+from astropy.time import Time
+
+import utils.batch as batch
+import utils.conversion as conversion
+import utils.flight_trajectory as flight_trajectory
+import utils.fov as fov
+import utils.observer_frame as observer_frame
+from utils.constants import EARTH_RADIUS_METER, AIRPLANE_MAX_ALT
+from utils.integration import find_flights_intersecting
+from utils.localsidereal import get_local_sidereal_times
+from utils.observer_frame import ObserverFrame
+from utils.simulated_fleet import SimulatedFleet
+
+SIZES = (10, 100, 1_000, 10_000, 100_000) # flights per synthetic fleet
+EXPOSURES = (1, 60, 600, 1800) # seconds
+TIME_STEP = 5 # seconds between two positions
+SEED = 1234
+FLEET_SPREAD = 10 # degrees of latitude around the observer the synthetic flights are spread over
+SCALAR_BUDGET = 50_000 # max scalar evaluations per measurement, the scalar reference is skipped beyond
+BATCH_BUDGET = 20_000_000 # max flights x timesteps per batch measurement
+
+OBSERVER = {"latitude": 43.6532, "longitude": -79.3832, "altitude": 100}
+OBSERVER_TIME = Time(datetime(2024, 6, 1, 2, 0, 0, tzinfo=timezone.utc))
+FOV_SIZE = 5 # degrees, pointed at the zenith
+
+
+def synthetic_fleet(size: int, seed: int = SEED) -> list[dict]:
+    """
+    Simulated flights spread around the observer, in the format of the simulatedFlights form field.
+    The same size and seed always give the same fleet.
+    """
+    rng = np.random.default_rng(seed)
+    latitude = OBSERVER["latitude"] + rng.uniform(-FLEET_SPREAD, FLEET_SPREAD, size)
+    longitude = OBSERVER["longitude"] + rng.uniform(-FLEET_SPREAD, FLEET_SPREAD, size) / math.cos(math.radians(OBSERVER["latitude"]))
+    altitude = rng.uniform(0, 45000, size) # feet, some are on the ground
+    speed = rng.uniform(0, 550, size) # knots
+    heading = rng.uniform(0, 360, size)
+    return [{"flightNumber": f"SIM{index:06d}", "latitude": float(latitude[index]), "longitude": float(longitude[index]),
+             "altitude": float(altitude[index]), "speed": float(speed[index]), "heading": float(heading[index])}
+            for index in range(size)]
+
+
+def measure(fn, repeat: int) -> tuple[object, dict]:
+    """ Run fn repeat times, return its last result and the timings in seconds. """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return result, {"min": min(timings), "median": statistics.median(timings), "repeats": repeat}
+
+
+def scalar_sample(size: int, steps: int) -> int:
+    """ How many flights the scalar reference can evaluate over steps timesteps within SCALAR_BUDGET. """
+    return min(size, SCALAR_BUDGET // max(steps, 1))
+
+
+def ra_difference(ra1, ra2) -> np.ndarray:
+    """ Absolute RA difference in degrees, across the 0/360 wrap. """
+    difference = np.abs(np.asarray(ra1) - np.asarray(ra2)) % 360
+    return np.minimum(difference, 360 - difference)
+
+
+def max_error(errors) -> float:
+    errors = np.asarray(errors, dtype=float)
+    errors = errors[~np.isnan(errors)]
+    return float(errors.max()) if len(errors) else 0.0
+
+
+def bench_trajectory(flights: list[dict], elapsed_times: np.ndarray, repeat: int, record):
+    arrays = batch.flight_arrays([fov.convert_to_processed_flight(flight) for flight in flights])
+    times = elapsed_times.reshape(1, -1)
+
+    def fast():
+        phi = batch.phi_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], times, arrays["latitude"])
+        theta = batch.theta_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], times,
+                                             arrays["latitude"], arrays["longitude"])
+        return phi, theta
+
+    sample = scalar_sample(len(flights), len(elapsed_times))
+
+    def scalar():
+        phi, theta = np.full((sample, len(elapsed_times)), np.nan), np.full((sample, len(elapsed_times)), np.nan)
+        for index in range(sample):
+            args = (float(arrays["speed"][index, 0]), EARTH_RADIUS_METER, float(arrays["altitude"][index, 0]), float(arrays["heading"][index, 0]))
+            for step, elapsed_time in enumerate(elapsed_times):
+                phi[index, step] = flight_trajectory.phi_current_position(*args, elapsed_time, float(arrays["latitude"][index, 0]))
+                try:
+                    theta[index, step] = flight_trajectory.theta_current_position(
+                        *args, elapsed_time, float(arrays["latitude"][index, 0]), float(arrays["longitude"][index, 0]))
+                except ZeroDivisionError:
+                    pass # exactly over a pole, NaN in the batch path as well
+        return phi, theta
+
+    (phi, theta), timing = measure(fast, repeat)
+    record("trajectory", "batch", len(flights), timing)
+    if sample:
+        (scalar_phi, scalar_theta), timing = measure(scalar, 1)
+        record("trajectory", "scalar", sample, timing)
+        theta_error = np.abs(theta[:sample] - scalar_theta)
+        theta_error = np.minimum(theta_error, 2 * math.pi - theta_error)
+        return {"max_error_deg": math.degrees(max(max_error(np.abs(phi[:sample] - scalar_phi)), max_error(theta_error)))}
+
+
+def bench_conversion(flights: list[dict], elapsed_times: np.ndarray, local_sidereal_times: np.ndarray, repeat: int, record):
+    arrays = batch.flight_arrays([fov.convert_to_processed_flight(flight) for flight in flights])
+    times = elapsed_times.reshape(1, -1)
+    phi = batch.phi_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], times, arrays["latitude"])
+    theta = batch.theta_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], times,
+                                         arrays["latitude"], arrays["longitude"])
+    lst = local_sidereal_times.reshape(1, -1)
+
+    def fast():
+        return batch.aircraft_theta_phi_to_radec(theta, phi, arrays["altitude"], OBSERVER["latitude"], OBSERVER["longitude"],
+                                                 OBSERVER["altitude"], lst)
+
+    sample = scalar_sample(len(flights), len(elapsed_times))
+
+    def scalar():
+        ra, dec = np.full((sample, len(elapsed_times)), np.nan), np.full((sample, len(elapsed_times)), np.nan)
+        for index in range(sample):
+            for step in range(len(elapsed_times)):
+                try:
+                    ra[index, step], dec[index, step] = conversion.aircraft_theta_phi_to_radec(
+                        float(theta[index, step]), float(phi[index, step]), float(arrays["altitude"][index, 0]),
+                        OBSERVER["latitude"], OBSERVER["longitude"], OBSERVER["altitude"], local_sidereal_time=float(lst[0, step]))
+                except ValueError:
+                    pass # degenerate position, NaN in the batch path as well
+        return ra, dec
+
+    x, y, z = batch.spherical_to_cartesian(EARTH_RADIUS_METER + arrays["altitude"], theta, phi)
+
+    def frame():
+        return ObserverFrame(OBSERVER, lst).ra_dec(x, y, z)
+
+    (ra, dec), timing = measure(fast, repeat)
+    record("conversion", "batch", len(flights), timing)
+    (frame_ra, frame_dec), timing = measure(frame, repeat)
+    record("conversion", "frame", len(flights), timing)
+    if sample:
+        (scalar_ra, scalar_dec), timing = measure(scalar, 1)
+        record("conversion", "scalar", sample, timing)
+        return {"max_error_deg": max(max_error(ra_difference(ra[:sample], scalar_ra)), max_error(np.abs(dec[:sample] - scalar_dec)),
+                                     max_error(ra_difference(frame_ra[:sample], scalar_ra)), max_error(np.abs(frame_dec[:sample] - scalar_dec)))}
+
+
+def bench_intersection(flights: list[dict], elapsed_times: np.ndarray, local_sidereal_times: np.ndarray, repeat: int, record):
+    ra, dec = batch.flights_ra_dec([fov.convert_to_processed_flight(flight) for flight in flights], OBSERVER, elapsed_times,
+                                   local_sidereal_times)
+    center_ra, center_dec = math.degrees(local_sidereal_times[0]), OBSERVER["latitude"]
+
+    def fast():
+        return batch.is_intersecting(ra, dec, center_ra, center_dec, FOV_SIZE)
+
+    sample = scalar_sample(len(flights), len(elapsed_times))
+
+    def scalar():
+        intersecting = np.zeros((sample, len(elapsed_times)), dtype=bool)
+        for index in range(sample):
+            for step in range(len(elapsed_times)):
+                if not math.isnan(ra[index, step]):
+                    intersecting[index, step] = fov.is_intersecting(float(ra[index, step]), float(dec[index, step]), center_ra, center_dec, FOV_SIZE)
+        return intersecting
+
+    directions = observer_frame.unit_vector(ra, dec)
+    fov_center = {"RA": center_ra, "Dec": center_dec}
+
+    def dot():
+        return observer_frame.is_intersecting(*directions, fov_center, FOV_SIZE)
+
+    intersecting, timing = measure(fast, repeat)
+    record("is_intersecting", "batch", len(flights), timing)
+    dot_intersecting, timing = measure(dot, repeat)
+    record("is_intersecting", "dot", len(flights), timing)
+    if sample:
+        scalar_intersecting, timing = measure(scalar, 1)
+        record("is_intersecting", "scalar", sample, timing)
+        # a mismatch is only acceptable for a flight on the fov boundary, within the batch tolerance
+        distance = batch.angular_distance(ra[:sample], dec[:sample], center_ra, center_dec)
+        mismatches = ((intersecting[:sample] != scalar_intersecting) | (dot_intersecting[:sample] != scalar_intersecting)) & \
+            (np.abs(distance - FOV_SIZE / 2) > batch.BATCH_TOLERANCE_DEG)
+        return {"mismatches": int(np.count_nonzero(mismatches)), "max_error_deg": 0.0}
+
+
+def bench_horizon(flights: list[dict], repeat: int, record):
+    radius = math.sqrt(math.pow(EARTH_RADIUS_METER + AIRPLANE_MAX_ALT, 2) - math.pow(EARTH_RADIUS_METER, 2))
+
+    fleet, timing = measure(lambda: SimulatedFleet(flights), repeat)
+    record("horizon", "fleet-build", len(flights), timing)
+    indices, timing = measure(lambda: fleet.indices_in_radius(OBSERVER["latitude"], OBSERVER["longitude"], radius), repeat)
+    record("horizon", "fleet-query", len(flights), timing)
+
+    def scalar():
+        return [index for index, flight in enumerate(flights)
+                if fov.haversine(OBSERVER["latitude"], OBSERVER["longitude"], flight["latitude"], flight["longitude"]) <= radius]
+
+    if len(flights) <= SCALAR_BUDGET:
+        expected, timing = measure(scalar, 1)
+        record("horizon", "scalar", len(flights), timing)
+        return {"mismatches": len(set(expected).symmetric_difference(indices.tolist())), "max_error_deg": 0.0}
+
+
+def bench_end_to_end(flights: list[dict], exposure: float, repeat: int, record):
+    center_ra = math.degrees(float(get_local_sidereal_times(OBSERVER["latitude"], OBSERVER["longitude"], OBSERVER_TIME, [0])[0])) / 15
+    ra_h = int(center_ra)
+    ra_m = int((center_ra - ra_h) * 60)
+    ra_s = ((center_ra - ra_h) * 60 - ra_m) * 60
+    fleet = SimulatedFleet(flights)
+    stats = dict()
+
+    def run(vectorized):
+        return find_flights_intersecting(FOV_SIZE, exposure, ra_h, ra_m, ra_s, OBSERVER["latitude"], OBSERVER["longitude"],
+                                         OBSERVER["latitude"], OBSERVER["altitude"], "simulated", fleet, OBSERVER_TIME,
+                                         vectorized=vectorized, time_step=TIME_STEP, stats=stats)
+
+    (positions, results), timing = measure(lambda: run(True), repeat)
+    record("find_flights_intersecting", "batch", len(flights), timing, propagated=stats["propagated"])
+    if stats["propagated"] * max(len(positions), 1) <= SCALAR_BUDGET:
+        (scalar_positions, scalar_results), timing = measure(lambda: run(False), 1)
+        record("find_flights_intersecting", "scalar", len(flights), timing, propagated=stats["propagated"])
+
+        errors, mismatches = [0.0], 0
+        for step, scalar_step in zip(positions, scalar_positions):
+            by_id = {position["ID"]: position for position in scalar_step}
+            mismatches += len(set(by_id).symmetric_difference(position["ID"] for position in step))
+            errors += [max(float(ra_difference(position["RA"], by_id[position["ID"]]["RA"])), abs(position["Dec"] - by_id[position["ID"]]["Dec"]))
+                       for position in step if position["ID"] in by_id]
+        mismatches += sum((result.entry, result.exit) != (scalar.entry, scalar.exit) for result, scalar in zip(results, scalar_results))
+        return {"mismatches": mismatches, "max_error_deg": max(errors)}
+
+
+def run_benchmarks(sizes=SIZES, exposures=EXPOSURES, repeat: int = 3, seed: int = SEED) -> dict:
+    """
+    Run every stage for every fleet size and exposure.
+    :return: {"meta": {...}, "results": [timings], "accuracy": [cross-checks], "ok": whether every cross-check passed}
+    """
+    results, accuracy = [], []
+
+    for size in sizes:
+        flights = synthetic_fleet(size, seed)
+        current = {"exposure": None} # horizon filtering does not depend on the exposure
+
+        def record(stage, path, flights_count, timing, **extra):
+            results.append({"stage": stage, "path": path, "flights": flights_count, "exposure": current["exposure"],
+                            "seconds": timing, **extra})
+
+        def check(stage, outcome):
+            if outcome is not None:
+                ok = outcome["max_error_deg"] <= batch.BATCH_TOLERANCE_DEG and outcome.get("mismatches", 0) == 0
+                accuracy.append({"stage": stage, "flights": size, "exposure": current["exposure"], **outcome, "ok": ok})
+
+        check("horizon", bench_horizon(flights, repeat, record))
+
+        for exposure in exposures:
+            current["exposure"] = exposure
+            elapsed_times = np.arange(0, int(exposure), TIME_STEP, dtype=float)
+            if size * len(elapsed_times) > BATCH_BUDGET:
+                results.append({"stage": "*", "path": "batch", "flights": size, "exposure": exposure, "skipped": "over BATCH_BUDGET"})
+                continue
+            local_sidereal_times = get_local_sidereal_times(OBSERVER["latitude"], OBSERVER["longitude"], OBSERVER_TIME, elapsed_times)
+
+            check("trajectory", bench_trajectory(flights, elapsed_times, repeat, record))
+            check("conversion", bench_conversion(flights, elapsed_times, local_sidereal_times, repeat, record))
+            check("is_intersecting", bench_intersection(flights, elapsed_times, local_sidereal_times, repeat, record))
+            check("find_flights_intersecting", bench_end_to_end(flights, exposure, repeat, record))
+
+    return {
+        "meta": {"python": platform.python_version(), "numpy": np.__version__, "machine": platform.machine(), "seed": seed,
+                 "time_step": TIME_STEP, "tolerance_deg": batch.BATCH_TOLERANCE_DEG, "date": datetime.now(timezone.utc).isoformat()},
+        "results": results,
+        "accuracy": accuracy,
+        "ok": all(check["ok"] for check in accuracy),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="fleet sizes")
+    parser.add_argument("--exposures", type=float, nargs="+", default=EXPOSURES, help="exposures in seconds")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs of every fast path")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--output", help="write the results to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    report = run_benchmarks(args.sizes, args.exposures, args.repeat, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+    for check in report["accuracy"]:
+        if not check["ok"]:
+            print(f"accuracy check failed: {check}", file=sys.stderr)
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the observer, flights and fleets shared by the tests, see samples.py
+sys.path.insert(0, os.path.dirname(__file__))
@@ -0,0 +1,58 @@
+"""
+File to share the observer, flights and fleets the tests predict with.
+"""
+from datetime import datetime, timezone
+
+import numpy as np
+from astropy.time import Time, TimeDelta
+
+from utils import fov
+from utils.integration import convert_flight_lat_lon_to_ra_dec
+
+USER_GPS = {"latitude": 43.6532, "longitude": -79.3832, "altitude": 100} # Toronto
+OBSERVER_TIME = Time(datetime(2024, 6, 1, 2, 0, 0, tzinfo=timezone.utc))
+
+# west of the observer, flying east-south-east over it
+FLIGHT = {"flightNumber": "123", "latitude": 43.9002, "longitude": -80.2114, "altitude": 35000, "speed": 490, "heading": 111}
+FLIGHTS = [FLIGHT, {"flightNumber": "456", "latitude": 43.3, "longitude": -79.2, "altitude": 20000, "speed": 300, "heading": 300}]
+
+
+def prediction_arguments(**changes) -> dict:
+    """ The arguments of integration.run_find_flights_intersecting for FLIGHT seen by USER_GPS, with changes. """
+    arguments = {"fov_size": 2, "exposure": 60, "fov_center_ra_h": 1, "fov_center_ra_m": 0, "fov_center_ra_s": 0, "fov_center_dec": 40,
+                 "observer_lon": USER_GPS["longitude"], "observer_lat": USER_GPS["latitude"], "altitude": USER_GPS["altitude"],
+                 "time_step": 5, "flight_data_type": "simulated", "simulated_flights": [FLIGHT], "simulated_time": OBSERVER_TIME}
+    arguments.update(changes)
+    return arguments
+
+
+def pointing_at(flight: dict, elapsed_time: float) -> tuple[int, int, float, float]:
+    """ ra h/m/s and dec of where a simulated flight is after elapsed_time seconds, seen by USER_GPS """
+    ra, dec = convert_flight_lat_lon_to_ra_dec(fov.convert_to_processed_flight(flight), OBSERVER_TIME + TimeDelta(elapsed_time, format='sec'),
+                                               elapsed_time, USER_GPS)
+    ra_h = int(ra / 15)
+    ra_m = int((ra / 15 - ra_h) * 60)
+    ra_s = ((ra / 15 - ra_h) * 60 - ra_m) * 60
+    return ra_h, ra_m, ra_s, dec
+
+
+def random_flights(count: int, latitude: float = USER_GPS["latitude"], longitude: float = USER_GPS["longitude"],
+                   spread: tuple[float, float] = (1, 1), seed: int = 0) -> list[dict]:
+    """
+    Simulated flights around a point, like the simulatedFlights of a request.
+    :param spread: Degrees of latitude and longitude the flights are spread over on each side of the point.
+    """
+    rng = np.random.default_rng(seed)
+    return [{"flightNumber": str(index), "latitude": float(latitude + rng.uniform(-spread[0], spread[0])),
+             "longitude": float(longitude + rng.uniform(-spread[1], spread[1])), "altitude": float(rng.uniform(5000, 40000)),
+             "speed": float(rng.uniform(200, 550)), "heading": float(rng.uniform(0, 360))} for index in range(count)]
+
+
+def random_flight_arrays(count: int, max_latitude: float = 70, seed: int = 0) -> dict[str, np.ndarray]:
+    """
+    Flights anywhere below max_latitude, as column arrays in meters and meters per second, see batch.flight_arrays.
+    """
+    rng = np.random.default_rng(seed)
+    column = lambda low, high: rng.uniform(low, high, (count, 1))
+    return {"latitude": column(-max_latitude, max_latitude), "longitude": column(-180, 180), "altitude": column(0, 13000),
+            "speed": column(50, 300), "heading": column(0, 360)}
@@ -0,0 +1,194 @@
+import json
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+import app as app_module
+import utils.flight_history as flight_history
+import utils.subscriptions as subscriptions
+from app import app
+from samples import FLIGHT, USER_GPS
+from utils.compute_pool import ComputePool, ComputePoolSaturated
+
+# a 50 mm lens on a full frame sensor looking at Vega, from Toronto
+FORM = {"focalLength": 50, "cameraSensorSize": 36, "barlowReducerFactor": 1, "exposure": 60, "fovCenterRaH": 18,
+        "fovCenterRaM": 36, "fovCenterRaS": 56, "fovCenterDec": 38.78, **USER_GPS,
+        "flightDataType": "simulated", "datetime": "2024-06-01T22:00", "simulatedFlights": [FLIGHT]}
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.mark.parametrize("refine_events, status", [
+    (True, 200),
+    ("false", 200),
+    ("true", 200),
+    ("no", 400),
+    (1, 400),
+])
+def test_refine_events_must_be_a_boolean(client, refine_events, status):
+    response = client.post("/api/flight-prediction", json={**FORM, "refineEvents": refine_events},
+                           headers={"Cache-Control": "no-cache"})
+
+    assert response.status_code == status
+
+
+def test_too_many_timesteps_are_rejected(client):
+    response = client.post("/api/flight-prediction", json={**FORM, "exposure": 1800, "timeStep": 1e-6},
+                           headers={"Cache-Control": "no-cache"})
+
+    assert response.status_code == 400
+    assert "timesteps" in response.get_json()["error"]
+
+
+RISK_MAP_FORM = {**{key: value for key, value in FORM.items() if key not in ("latitude", "longitude")},
+                 "gridLatitudes": [43, 44, 3], "gridLongitudes": [-80, -79, 3]}
+
+
+@pytest.mark.parametrize("change", [
+    {"gridLatitudes": None},
+    {"gridLatitudes": [43, 44, 0]},
+    {"gridLatitudes": [-90, 90, 1000], "gridLongitudes": [-180, 180, 1000]},
+    {"fovCenterDec": 91},
+])
+def test_invalid_risk_maps_are_rejected(client, change):
+    assert client.post("/api/risk-map", json={**RISK_MAP_FORM, **change}).status_code == 400
+
+
+def test_risk_map_is_computed_by_the_compute_pool(client, monkeypatch):
+    expected = client.post("/api/risk-map", json=RISK_MAP_FORM).get_json()
+    pool = ComputePool(workers=1, queue_depth=0)
+    monkeypatch.setattr(app_module, "compute_pool", pool)
+    try:
+        response = client.post("/api/risk-map", json=RISK_MAP_FORM)
+    finally:
+        pool.shutdown()
+
+    assert response.status_code == 200
+    assert response.get_json() == expected
+
+
+def test_risk_map_answers_busy_when_the_pool_is_full(client, monkeypatch):
+    def saturated(*args, **kwargs):
+        raise ComputePoolSaturated("full")
+    monkeypatch.setattr(app_module.compute_pool, "run", saturated)
+
+    response = client.post("/api/risk-map", json=RISK_MAP_FORM)
+
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "5"
+
+
+BATCH_FORM = {**FORM, "fovs": [{"focalLength": 50}, {"focalLength": 200, "exposure": 30}]}
+
+
+def test_batch_is_computed_by_the_compute_pool(client, monkeypatch):
+    expected = client.post("/api/flight-prediction/batch", json=BATCH_FORM).get_json()
+    pool = ComputePool(workers=1, queue_depth=0)
+    monkeypatch.setattr(app_module, "compute_pool", pool)
+    try:
+        response = client.post("/api/flight-prediction/batch", json=BATCH_FORM)
+    finally:
+        pool.shutdown()
+
+    assert response.status_code == 200
+    assert len(expected["fovs"]) == 2
+    assert response.get_json() == expected
+
+
+@pytest.mark.parametrize("path, form", [
+    ("/api/flight-prediction/batch", {**BATCH_FORM, "refineEvents": True}),
+    ("/api/flight-prediction/batch", {**BATCH_FORM, "refineEvents": "maybe"}),
+    ("/api/flight-prediction/batch", {**BATCH_FORM, "fovs": [{"fovCenterDec": 91}]}),
+    ("/api/flight-prediction/stream", {**FORM, "refineEvents": True}),
+    ("/api/flight-prediction/stream", {**FORM, "fovCenterDec": 91}),
+])
+def test_unsupported_options_are_rejected(client, path, form):
+    assert client.post(path, json=form).status_code == 400
+
+
+@pytest.mark.parametrize("error", [ComputePoolSaturated("full"), BrokenProcessPool("a worker died")])
+def test_batch_answers_busy_when_the_pool_fails(client, monkeypatch, error):
+    def failing(*args, **kwargs):
+        raise error
+    monkeypatch.setattr(app_module.compute_pool, "run", failing)
+
+    assert client.post("/api/flight-prediction/batch", json=BATCH_FORM).status_code == 503
+
+
+def test_unknown_subscription_is_not_found(client):
+    assert client.get("/api/subscriptions/unknown").status_code == 404
+
+
+def test_subscription_is_joined_before_answering(client, monkeypatch):
+    hub = subscriptions.SubscriptionHub(interval=10)
+    monkeypatch.setattr(subscriptions, "hub", hub)
+    monkeypatch.setattr(app_module, "compute_subscription", lambda form: {})
+    key = client.post("/api/subscriptions", json=FORM).get_json()["key"]
+
+    response = client.get(f"/api/subscriptions/{key}", buffered=False)
+    # the form can now be dropped without breaking the stream
+    hub.forms.clear()
+
+    assert response.status_code == 200
+    assert hub.channels[key].subscribers == 1
+    response.close()
+    assert not hub.channels
+
+
+def test_invalid_subscription_form_is_rejected(client):
+    assert client.post("/api/subscriptions", json={**FORM, "latitude": "north"}).status_code == 400
+
+
+def test_too_many_subscriptions_answer_busy(client, monkeypatch):
+    hub = subscriptions.SubscriptionHub(interval=10, max_channels=0)
+    monkeypatch.setattr(subscriptions, "hub", hub)
+    key = client.post("/api/subscriptions", json=FORM).get_json()["key"]
+
+    assert client.get(f"/api/subscriptions/{key}").status_code == 503
+
+
+@pytest.mark.parametrize("change", [
+    {"simulatedFlights": None, "simulatedFleetId": "unknown"},
+    {"simulatedFlights": [{"flightNumber": "123"}]},
+])
+def test_invalid_fleets_are_rejected(client, change):
+    assert client.post("/api/flight-prediction", json={**FORM, **change}).status_code == 400
+
+
+def test_historical_predictions_are_not_cached(client, monkeypatch):
+    monkeypatch.setattr(app_module.results_cache, "get_or_compute", pytest.fail)
+    monkeypatch.setattr(flight_history, "FLIGHT_HISTORY_PATH", None)
+
+    # without a recording, but with a fleet attached
+    assert client.post("/api/flight-prediction", json={**FORM, "flightDataType": "historical"}).status_code == 400
+
+
+@pytest.fixture
+def saturated_pool(monkeypatch):
+    pool = ComputePool(workers=1, queue_depth=0)
+    monkeypatch.setattr(app_module, "compute_pool", pool)
+    pool.acquire()
+    yield pool
+    pool.release()
+    pool.shutdown()
+
+
+def test_session_requests_are_bounded(client, saturated_pool):
+    response = client.post("/api/flight-prediction", json={**FORM, "sessionId": "session"}, headers={"Cache-Control": "no-cache"})
+
+    assert response.status_code == 503
+
+
+def test_streams_are_bounded(client, saturated_pool):
+    assert client.post("/api/flight-prediction/stream", json=FORM).status_code == 503
+
+    saturated_pool.release()
+    response = client.post("/api/flight-prediction/stream", json=FORM)
+    assert response.status_code == 200
+    assert json.loads(response.get_data(as_text=True).splitlines()[-1])["type"] == "done"
+    response.close()
+    assert saturated_pool.in_flight == 0
+    saturated_pool.acquire()
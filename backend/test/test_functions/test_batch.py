@@ -0,0 +1,97 @@
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from astropy.time import Time, TimeDelta
+
+import utils.batch as batch
+import utils.flight_trajectory as flight_trajectory
+from utils import fov
+from utils.constants import EARTH_RADIUS_METER
+from utils.datatypes import ProcessedFlightInfo
+from utils.integration import find_flights_intersecting, convert_flight_lat_lon_to_ra_dec
+from utils.localsidereal import get_local_sidereal_times
+
+OBSERVER_TIME = Time(datetime(2025, 3, 30, 14, 38, 0, tzinfo=timezone.utc))
+USER_GPS = {"latitude": 43.58962, "longitude": -79.64439, "altitude": 100}
+ELAPSED_TIMES = [0, 5, 60, 300, 1800]
+
+
+def make_flights():
+    headings = [0, 45, 111, 180, 270, 333]
+    return [
+        ProcessedFlightInfo(id=uuid.uuid4(), flightNumber=str(idx), latitude=43.0 + idx * 0.3, longitude=-80.5 + idx * 0.25,
+                            altitude=5000 + idx * 6000, speed=150 + idx * 80, heading=heading)
+        for idx, heading in enumerate(headings)
+    ]
+
+
+@pytest.mark.parametrize("speed, height, bearing, latitude, longitude", [
+    (200, 10000, 90, 45, -79),
+    (150, 5000, 180, -30, 120),
+    (250, 20000, 45, 60, 179.5),
+    (240, 11000, 300, -10, -179.9),
+])
+def test_trajectory_matches_scalar(speed, height, bearing, latitude, longitude):
+    times = np.array([0, 5, 100, 1000, 5000], dtype=float)
+    phi = batch.phi_current_position(speed, EARTH_RADIUS_METER, height, bearing, times, latitude)
+    theta = batch.theta_current_position(speed, EARTH_RADIUS_METER, height, bearing, times, latitude, longitude)
+
+    for idx, time in enumerate(times):
+        assert phi[idx] == pytest.approx(flight_trajectory.phi_current_position(
+            speed, EARTH_RADIUS_METER, height, bearing, time, latitude), abs=1e-12)
+        assert theta[idx] == pytest.approx(flight_trajectory.theta_current_position(
+            speed, EARTH_RADIUS_METER, height, bearing, time, latitude, longitude), abs=1e-12)
+
+
+def test_flights_ra_dec_matches_scalar():
+    flights = make_flights()
+    lst = get_local_sidereal_times(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, ELAPSED_TIMES)
+    ra, dec = batch.flights_ra_dec(flights, USER_GPS, ELAPSED_TIMES, lst)
+
+    assert ra.shape == dec.shape == (len(flights), len(ELAPSED_TIMES))
+    for i, flight in enumerate(flights):
+        for j, elapsed_time in enumerate(ELAPSED_TIMES):
+            updated_time = OBSERVER_TIME + TimeDelta(elapsed_time, format='sec')
+            scalar_ra, scalar_dec = convert_flight_lat_lon_to_ra_dec(flight, updated_time, elapsed_time, USER_GPS)
+            # RA wraps at 360 degrees
+            assert abs((ra[i, j] - scalar_ra + 180) % 360 - 180) < batch.BATCH_TOLERANCE_DEG
+            assert abs(dec[i, j] - scalar_dec) < batch.BATCH_TOLERANCE_DEG
+
+
+def test_angular_distance_matches_scalar():
+    points = [(0, 0, 0, 5), (10, 10, 350, -10), (359, 89, 1, 89), (180, -45, 0, 45)]
+    for ra1, dec1, ra2, dec2 in points:
+        assert batch.angular_distance(ra1, dec1, ra2, dec2) == pytest.approx(fov.angular_distance(ra1, dec1, ra2, dec2), abs=1e-9)
+
+
+def test_find_flights_intersecting_vectorized_matches_scalar():
+    flights = [{"flightNumber": "123", "latitude": 43.9002, "longitude": -80.2114, "altitude": 35000, "speed": 490, "heading": 111},
+               {"flightNumber": "456", "latitude": 43.3, "longitude": -79.2, "altitude": 20000, "speed": 300, "heading": 300}]
+
+    # point the telescope where the first flight will be after one minute
+    first = fov.convert_to_processed_flight(flights[0])
+    ra, dec = convert_flight_lat_lon_to_ra_dec(first, OBSERVER_TIME + TimeDelta(60, format='sec'), 60, USER_GPS)
+    ra_h = int(ra / 15)
+    ra_m = int((ra / 15 - ra_h) * 60)
+    ra_s = ((ra / 15 - ra_h) * 60 - ra_m) * 60
+
+    results = []
+    for vectorized in (True, False):
+        flights_position, flight_data = find_flights_intersecting(
+            2, 120, ra_h, ra_m, ra_s, dec, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+            "simulated", flights, OBSERVER_TIME, vectorized=vectorized)
+        results.append((flights_position, flight_data))
+
+    (batch_positions, batch_flights), (scalar_positions, scalar_flights) = results
+    assert any(batch_positions)
+    assert len(batch_positions) == len(scalar_positions)
+    for batch_step, scalar_step in zip(batch_positions, scalar_positions):
+        assert [p["FlightNumber"] for p in batch_step] == [p["FlightNumber"] for p in scalar_step]
+        for batch_position, scalar_position in zip(batch_step, scalar_step):
+            assert batch_position["RA"] == pytest.approx(scalar_position["RA"], abs=batch.BATCH_TOLERANCE_DEG)
+            assert batch_position["Dec"] == pytest.approx(scalar_position["Dec"], abs=batch.BATCH_TOLERANCE_DEG)
+    for batch_flight, scalar_flight in zip(batch_flights, scalar_flights):
+        assert batch_flight.entry == scalar_flight.entry
+        assert batch_flight.exit == scalar_flight.exit
@@ -0,0 +1,81 @@
+import threading
+
+import pytest
+from astropy.time import TimeDelta
+
+from samples import OBSERVER_TIME, prediction_arguments
+from utils.coalescing import RequestCoalescer, coalescing_key
+
+ARGUMENTS = prediction_arguments(flight_data_type="live", simulated_flights=None)
+
+
+@pytest.mark.parametrize("change, same", [
+    ({"exposure": 60.0}, True),
+    ({"simulated_time": OBSERVER_TIME + TimeDelta(4.9, format='sec')}, True),
+    ({"simulated_time": OBSERVER_TIME + TimeDelta(5, format='sec')}, False),
+    ({"fov_center_dec": 41}, False),
+    ({"observer_lat": 43.6533}, False),
+    ({"refine_events": True}, False),
+])
+def test_key_normalizes_the_form(change, same):
+    assert (coalescing_key({**ARGUMENTS, **change}, 5) == coalescing_key(ARGUMENTS, 5)) == same
+
+
+def run_concurrently(coalescer, count, compute):
+    """ count callers of the same key, the first one computes while the others arrive """
+    results = [None] * count
+    started = threading.Event()
+    release = threading.Event()
+
+    def leader_compute():
+        started.set()
+        release.wait(5)
+        return compute()
+
+    def call(index, fn):
+        try:
+            results[index] = coalescer.run("key", fn)
+        except Exception as e:
+            results[index] = e
+
+    threads = [threading.Thread(target=call, args=(0, leader_compute))]
+    threads[0].start()
+    started.wait(5)
+    threads += [threading.Thread(target=call, args=(index, pytest.fail)) for index in range(1, count)]
+    for thread in threads[1:]:
+        thread.start()
+    while coalescer.coalesced < count - 1:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_requests_share_one_computation():
+    coalescer = RequestCoalescer(window=5)
+    result = object()
+
+    results = run_concurrently(coalescer, 4, lambda: result)
+
+    assert results == [(result, False)] + [(result, True)] * 3
+    assert (coalescer.computed, coalescer.coalesced) == (1, 3)
+    assert len(coalescer) == 0
+    # nothing is kept once the computation is done
+    assert coalescer.run("key", lambda: 1) == (1, False)
+
+
+def test_errors_are_raised_to_every_waiting_request():
+    coalescer = RequestCoalescer(window=5)
+    error = TimeoutError("busy")
+
+    def fail():
+        raise error
+
+    assert run_concurrently(coalescer, 3, fail) == [error] * 3
+    assert len(coalescer) == 0
+
+
+def test_window_zero_disables_coalescing():
+    assert not RequestCoalescer(window=0).enabled
+    assert RequestCoalescer(window=5).enabled
@@ -0,0 +1,112 @@
+import os
+import threading
+import time
+
+import pytest
+
+import utils.compute_pool as compute_pool
+import utils.localsidereal as localsidereal
+from utils.compute_pool import ComputePool, ComputePoolSaturated
+
+
+def test_runs_in_request_thread_without_workers():
+    pool = ComputePool(workers=0)
+    assert pool.run(os.getpid) == os.getpid()
+
+
+def test_runs_in_worker_process():
+    pool = ComputePool(workers=1, queue_depth=0)
+    try:
+        assert pool.run(os.getpid) != os.getpid()
+        assert pool.in_flight == 0
+    finally:
+        pool.shutdown()
+
+
+def test_rejects_when_saturated():
+    pool = ComputePool(workers=1, queue_depth=1)
+    try:
+        pool.run(abs, 1) # start the worker
+        busy = [threading.Thread(target=pool.run, args=(time.sleep, 1)) for _ in range(2)]
+        for thread in busy:
+            thread.start()
+        while pool.in_flight < 2:
+            time.sleep(0.01)
+
+        with pytest.raises(ComputePoolSaturated):
+            pool.run(abs, 1)
+
+        for thread in busy:
+            thread.join()
+        assert pool.run(abs, -1) == 1
+    finally:
+        pool.shutdown()
+
+
+def test_timeout_keeps_the_slot_until_done():
+    pool = ComputePool(workers=1, queue_depth=0, timeout=0.1)
+    try:
+        with pytest.raises(TimeoutError):
+            pool.run(time.sleep, 0.5)
+        assert pool.in_flight == 1
+        deadline = time.monotonic() + 5
+        while pool.in_flight and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert pool.in_flight == 0
+    finally:
+        pool.shutdown()
+
+
+def timezone_lock_is_free():
+    if not localsidereal._timezone_finder_lock.acquire(timeout=1):
+        return False
+    localsidereal._timezone_finder_lock.release()
+    return True
+
+
+def test_workers_do_not_inherit_locks_held_by_other_threads():
+    # a request thread holds the timezone lock while the pool starts
+    held, release = threading.Event(), threading.Event()
+
+    def hold_lock():
+        with localsidereal._timezone_finder_lock:
+            held.set()
+            release.wait(10)
+
+    thread = threading.Thread(target=hold_lock)
+    thread.start()
+    held.wait(5)
+    pool = ComputePool(workers=1, queue_depth=0)
+    try:
+        pool.start()
+        assert pool.run(timezone_lock_is_free)
+    finally:
+        release.set()
+        thread.join()
+        pool.shutdown()
+
+
+def test_fork_is_refused(monkeypatch):
+    monkeypatch.setattr(compute_pool, "COMPUTE_START_METHOD", "fork")
+    with pytest.raises(ValueError):
+        compute_pool.process_context()
+
+
+def test_local_computations_share_the_bound():
+    pool = ComputePool(workers=1, queue_depth=0, timeout=0.1)
+    try:
+        # not picklable, runs in a thread of this process
+        assert pool.run_local(lambda: threading.get_ident()) != threading.get_ident()
+        pool.acquire()
+        with pytest.raises(ComputePoolSaturated):
+            pool.run_local(abs, 1)
+        with pytest.raises(ComputePoolSaturated):
+            pool.run(abs, 1)
+        pool.release()
+
+        with pytest.raises(TimeoutError):
+            pool.run_local(time.sleep, 0.5)
+        assert pool.in_flight == 1
+    finally:
+        pool.shutdown()
+    assert pool.in_flight == 0
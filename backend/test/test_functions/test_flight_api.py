@@ -0,0 +1,134 @@
+import dataclasses
+import threading
+import uuid
+
+import pytest
+
+from utils.datatypes import ProcessedFlightInfo
+from utils.flight_api import FlightSnapshotCache, StaticFlightProvider
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_flight(lat, lon, number="123"):
+    return ProcessedFlightInfo(id=uuid.uuid4(), flightNumber=number, latitude=lat, longitude=lon, altitude=35000, speed=450, heading=90)
+
+
+@pytest.fixture
+def provider():
+    return StaticFlightProvider([
+        make_flight(43.7, -79.4, "toronto"),
+        make_flight(43.9, -80.2, "near toronto"),
+        make_flight(45.5, -73.6, "montreal"),
+        make_flight(10.0, 179.9, "east of antimeridian"),
+        make_flight(10.0, -179.9, "west of antimeridian"),
+    ])
+
+
+def test_cache_serves_repeated_requests_within_ttl(provider):
+    clock = FakeClock()
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=clock)
+
+    flights = cache.get_flights_in_circ_boundary(43.7, -79.4, 100000)
+    assert sorted(flight.flightNumber for flight in flights) == ["near toronto", "toronto"]
+    assert provider.calls == 1
+
+    # overlapping area, still fresh
+    clock.now = 9
+    flights = cache.get_flights_in_circ_boundary(43.8, -79.6, 50000)
+    assert sorted(flight.flightNumber for flight in flights) == ["near toronto", "toronto"]
+    assert provider.calls == 1
+
+    # expired
+    clock.now = 11
+    cache.get_flights_in_circ_boundary(43.7, -79.4, 100000)
+    assert provider.calls == 2
+
+
+def test_cached_flights_cannot_be_modified(provider):
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=FakeClock())
+
+    flight = cache.get_flights_in_circ_boundary(43.7, -79.4, 10000)[0]
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        flight.latitude = 0
+    assert cache.get_flights_in_circ_boundary(43.7, -79.4, 10000)[0].latitude == flight.latitude
+
+
+def test_cache_across_antimeridian(provider):
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=FakeClock())
+
+    flights = cache.get_flights_in_circ_boundary(10.0, 180.0, 50000)
+    assert sorted(flight.flightNumber for flight in flights) == ["east of antimeridian", "west of antimeridian"]
+    # one call per side of the antimeridian
+    assert provider.calls == 2
+
+
+def test_concurrent_requests_share_one_fetch(provider):
+    provider.delay = 0.2
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2)
+    results = []
+
+    def request():
+        results.append(cache.get_flights_in_circ_boundary(43.7, -79.4, 100000))
+
+    threads = [threading.Thread(target=request) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert provider.calls == 1
+    assert all(len(flights) == 2 for flights in results)
+
+
+def test_failed_fetch_is_not_cached(provider):
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=FakeClock())
+    flights = provider.flights
+    provider.flights = None # iterating None raises
+
+    with pytest.raises(TypeError):
+        cache.get_flights_in_circ_boundary(43.7, -79.4, 10000)
+
+    provider.flights = flights
+    assert len(cache.get_flights_in_circ_boundary(43.7, -79.4, 10000)) == 1
+
+
+@pytest.mark.parametrize("min_lon, min_lat, max_lon, max_lat", [
+    (-79.5, 43.6, -79.3, 43.8), # about 10 km around toronto
+    (-80.6, 42.8, -78.2, 44.6), # 100 km
+    (-80.6, 43.6, -79.4, 44.4), # across the edges of four tiles
+    (-84.4, 40.1, -74.4, 47.3), # to the horizon of an airliner
+    (178.9, 9.1, -179.9, 10.9), # across the antimeridian
+])
+def test_fetch_is_no_larger_than_the_query(provider, min_lon, min_lat, max_lon, max_lat):
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=FakeClock())
+    # a neighbour warmed some of the tiles
+    cache.get_flights_in_rect(min_lon + 1, min_lat + 1, max_lon + 1, max_lat + 1)
+    provider.bounds.clear()
+
+    cache.get_flights_in_rect(min_lon, min_lat, max_lon, max_lat)
+
+    # before the cache, the provider was asked for the rectangle itself
+    query_area = (max_lat - min_lat) * ((max_lon - min_lon) % 360)
+    assert sum((north - south) * (east - west) for north, south, west, east in provider.bounds) <= query_area + 1e-9
+    for north, south, west, east in provider.bounds:
+        assert min_lat <= south <= north <= max_lat
+        assert (min_lon <= west <= east <= max_lon) if min_lon <= max_lon else (min_lon <= west <= east or west <= east <= max_lon)
+
+
+def test_tile_part_outside_the_snapshot_is_fetched(provider):
+    cache = FlightSnapshotCache(provider, ttl=10, tile_size=2, clock=FakeClock())
+
+    # the west end of the tile of toronto, without it
+    assert cache.get_flights_in_rect(-80.5, 43.5, -80, 44) == [flight for flight in provider.flights if flight.flightNumber == "near toronto"]
+    assert sorted(flight.flightNumber for flight in cache.get_flights_in_rect(-80.5, 43.5, -79, 44)) == ["near toronto", "toronto"]
+    assert provider.calls == 2
+    # within what was fetched
+    assert len(cache.get_flights_in_rect(-80.2, 43.6, -79.2, 44)) == 2
+    assert provider.calls == 2
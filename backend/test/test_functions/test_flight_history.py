@@ -0,0 +1,102 @@
+import os
+
+import numpy as np
+import pytest
+from astropy.time import TimeDelta
+
+import samples
+import utils.batch as batch
+import utils.flight_history as flight_history
+from samples import OBSERVER_TIME, USER_GPS
+from utils import fov
+from utils.flight_history import FlightHistory, FlightRecorder, column_path
+from utils.flight_index import dead_reckon
+from utils.integration import find_flights_intersecting
+
+# and one far from the observer
+FLIGHTS = [*samples.FLIGHTS, {"flightNumber": "FAR", "latitude": 50, "longitude": 2, "altitude": 30000, "speed": 450, "heading": 90}]
+
+
+def processed(flights):
+    return [fov.convert_to_processed_flight(flight, index) for index, flight in enumerate(flights)]
+
+
+@pytest.fixture
+def recording(tmp_path):
+    recorder = FlightRecorder(str(tmp_path))
+    for seconds in (-10, 0, 10):
+        recorder.append(OBSERVER_TIME.unix + seconds, processed(FLIGHTS))
+    return str(tmp_path)
+
+
+def test_snapshots_are_found_by_time(recording):
+    history = FlightHistory(recording, max_gap=30)
+
+    assert len(history) == 3
+    assert history.time_range() == (OBSERVER_TIME.unix - 10, OBSERVER_TIME.unix + 10)
+    assert history.snapshot_at(OBSERVER_TIME.unix).snapshot_time == OBSERVER_TIME.unix
+    assert history.snapshot_at(OBSERVER_TIME.unix + 9.9).snapshot_time == OBSERVER_TIME.unix
+    assert history.snapshot_at(OBSERVER_TIME.unix + 40).snapshot_time == OBSERVER_TIME.unix + 10
+    assert len(history.snapshot_at(OBSERVER_TIME.unix)) == len(FLIGHTS)
+    with pytest.raises(ValueError):
+        history.snapshot_at(OBSERVER_TIME.unix - 11)
+    with pytest.raises(ValueError):
+        history.snapshot_at(OBSERVER_TIME.unix + 41)
+
+
+def test_flights_are_replayed_at_the_requested_time(recording):
+    snapshot = FlightHistory(recording).snapshot_at(OBSERVER_TIME.unix + 5)
+
+    flights = snapshot.flights_in_radius(USER_GPS["latitude"], USER_GPS["longitude"], fov.HORIZON_RADIUS, OBSERVER_TIME.unix + 5)
+    latitude, longitude = dead_reckon(batch.flight_arrays(processed(FLIGHTS)[:2]), 5)
+
+    assert [(flight.id, flight.flightNumber) for flight in flights] == [(flight.id, flight.flightNumber) for flight in processed(FLIGHTS)[:2]]
+    assert [flight.latitude for flight in flights] == latitude.reshape(-1).tolist()
+    assert [flight.longitude for flight in flights] == longitude.reshape(-1).tolist()
+    assert [flight.altitude for flight in flights] == [35000, 20000]
+
+
+def test_reader_sees_new_snapshots(recording):
+    history = FlightHistory(recording)
+    history.snapshot_at(OBSERVER_TIME.unix + 10)
+
+    FlightRecorder(recording).append(OBSERVER_TIME.unix + 20, processed(FLIGHTS[:1]))
+
+    assert len(history.snapshot_at(OBSERVER_TIME.unix + 20)) == 1
+    with pytest.raises(ValueError):
+        FlightRecorder(recording).append(OBSERVER_TIME.unix, processed(FLIGHTS))
+
+
+def test_interrupted_append_is_dropped(recording):
+    # the columns of a snapshot were written, but not its index
+    with open(column_path(recording, "latitude"), "ab") as file:
+        file.write(np.zeros(2).tobytes())
+
+    recorder = FlightRecorder(recording)
+    recorder.append(OBSERVER_TIME.unix + 20, processed(FLIGHTS))
+
+    assert recorder.rows == 4 * len(FLIGHTS)
+    assert os.path.getsize(column_path(recording, "latitude")) == 4 * len(FLIGHTS) * 8
+    assert [flight.latitude for flight in FlightHistory(recording).snapshot_at(OBSERVER_TIME.unix + 20).flights_in_radius(
+        0, 0, 1e8, OBSERVER_TIME.unix + 20)] == [flight["latitude"] for flight in FLIGHTS]
+
+
+def test_historical_prediction_matches_simulated(recording, monkeypatch):
+    monkeypatch.setattr(flight_history, "FLIGHT_HISTORY_PATH", recording)
+    arguments = (60, 120, 1, 0, 0, 40, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"])
+    stats = dict()
+
+    flights_position, results = find_flights_intersecting(*arguments, "historical", None, OBSERVER_TIME, stats=stats)
+    expected_position, expected_results = find_flights_intersecting(*arguments, "simulated", FLIGHTS, OBSERVER_TIME)
+
+    assert stats["candidates"] == 3 and stats["culled"]["horizon"] == 1
+    assert flights_position == expected_position
+    assert [result.to_dict() for result in results] == [result.to_dict() for result in expected_results]
+
+
+def test_historical_requires_a_recording(monkeypatch):
+    monkeypatch.setattr(flight_history, "FLIGHT_HISTORY_PATH", None)
+
+    with pytest.raises(ValueError):
+        find_flights_intersecting(2, 60, 1, 0, 0, 40, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"], "historical",
+                                  None, OBSERVER_TIME + TimeDelta(0, format='sec'))
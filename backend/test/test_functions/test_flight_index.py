@@ -0,0 +1,99 @@
+import uuid
+
+import numpy as np
+import pytest
+
+import utils.batch as batch
+import utils.flight_index as flight_index
+import utils.flight_motion as flight_motion
+from samples import random_flights
+from utils import fov
+from utils.datatypes import ProcessedFlightInfo
+from utils.flight_api import StaticFlightProvider
+from utils.flight_index import FlightIndex, FlightFeedPoller, dead_reckon
+from utils.flight_motion import FlightMotion
+
+
+def make_fleet(count, seed=0):
+    # over southern Ontario and Quebec
+    return [fov.convert_to_processed_flight(flight, index) for index, flight in enumerate(random_flights(count, 44, -79, (4, 5), seed))]
+
+
+@pytest.mark.parametrize("lat, lon, radius", [
+    (43.6, -79.6, 50000),
+    (44.0, -80.0, 250000),
+    (47.9, -74.1, 10000),
+])
+def test_radius_query_matches_linear_scan(lat, lon, radius):
+    fleet = make_fleet(2000)
+    index = FlightIndex(fleet, snapshot_time=100.0)
+
+    found = {flight.id for flight in index.flights_in_radius(lat, lon, radius, at_time=100.0)}
+    expected = {flight.id for flight in fleet if fov.haversine(lat, lon, flight.latitude, flight.longitude) <= radius}
+    assert found == expected
+
+
+def test_query_dead_reckons_to_request_time():
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="1", latitude=43.6, longitude=-79.6, altitude=35000, speed=450, heading=90)
+    index = FlightIndex([flight], snapshot_time=0.0)
+
+    moved = index.flights_in_radius(43.6, -79.6, 100000, at_time=60.0)[0]
+    latitude, longitude = dead_reckon(batch.flight_arrays([flight]), 60.0)
+    assert moved.latitude == pytest.approx(float(latitude[0, 0]))
+    assert moved.longitude == pytest.approx(float(longitude[0, 0]))
+    # flying east at 450 knots for a minute covers about 14 km
+    assert fov.haversine(43.6, -79.6, moved.latitude, moved.longitude) == pytest.approx(450 * 0.514444 * 60, rel=0.01)
+    # the snapshot itself is not modified
+    assert flight.longitude == -79.6
+
+
+def test_dead_reckoning_uses_the_configured_model(monkeypatch):
+    monkeypatch.setattr(flight_motion, "MOTION_MODEL", "great-circle")
+    flights = batch.flight_arrays(make_fleet(100))
+
+    latitude, longitude = dead_reckon(flights, 1800.0)
+    expected_latitude, expected_longitude = FlightMotion(flights).lat_lon(1800.0)
+
+    np.testing.assert_allclose(latitude, expected_latitude, atol=1e-9)
+    np.testing.assert_allclose(longitude, expected_longitude, atol=1e-9)
+
+
+def test_flight_flying_into_the_circle_is_found():
+    # 20 km west of the point, flying east at ~230 m/s, inside a 5 km circle after ~90 s
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="1", latitude=43.6, longitude=-79.848, altitude=35000, speed=450, heading=90)
+    index = FlightIndex([flight], snapshot_time=0.0)
+
+    assert index.flights_in_radius(43.6, -79.6, 5000, at_time=0.0) == []
+    assert len(index.flights_in_radius(43.6, -79.6, 5000, at_time=90.0)) == 1
+
+
+def test_poller_serves_live_horizon_queries(monkeypatch):
+    now = [1000.0]
+    provider = StaticFlightProvider(make_fleet(500))
+    poller = FlightFeedPoller(provider, 44.0, -79.0, 600000, interval=5, clock=lambda: now[0])
+    poller.poll_once()
+    assert provider.calls == 1
+
+    monkeypatch.setattr(flight_index, "poller", poller)
+    assert flight_index.find_flights_in_radius(43.6, -79.6, 50000) is not None
+    # outside of the polled region
+    assert flight_index.find_flights_in_radius(10.0, 10.0, 50000) is None
+
+    # too old to be used
+    now[0] += 5 * flight_index.FLIGHT_POLLER_MAX_AGE + 1
+    assert flight_index.find_flights_in_radius(43.6, -79.6, 50000) is None
+
+
+@pytest.mark.parametrize("lon", [179.5, -179.5])
+def test_poller_region_across_the_antimeridian(lon):
+    rng = np.random.default_rng(1)
+    fleet = [ProcessedFlightInfo(id=uuid.uuid4(), flightNumber=str(idx), latitude=rng.uniform(-2, 2), longitude=rng.uniform(-180, 180),
+                                 altitude=30000, speed=450, heading=90) for idx in range(2000)]
+    poller = FlightFeedPoller(StaticFlightProvider(fleet), 0.0, lon, 300000, clock=lambda: 0.0)
+    poller.poll_once()
+
+    assert poller.covers(0.0, 180.0, 100000)
+    expected = {flight.id for flight in fleet if flight_index.haversine(0.0, 180.0, flight.latitude, flight.longitude) <= 100000}
+    found = {flight.id for flight in poller.index.flights_in_radius(0.0, 180.0, 100000, at_time=0.0)}
+    assert expected and found == expected
+    assert any(flight.longitude < 0 for flight in poller.index.flights) and any(flight.longitude > 0 for flight in poller.index.flights)
@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import pytest
+
+import utils.batch as batch
+import utils.flight_motion as flight_motion
+from samples import FLIGHT, OBSERVER_TIME, USER_GPS, random_flight_arrays
+from utils import fov
+from utils.constants import EARTH_RADIUS_METER
+from utils.flight_index import haversine
+from utils.flight_motion import FlightMotion, MOTION_MODEL_TOLERANCE, MOTION_MODEL_VALID_SECONDS
+from utils.localsidereal import SiderealTimeTable
+
+def dawson_theta_phi(flights, elapsed_times):
+    theta = batch.theta_current_position(flights["speed"], EARTH_RADIUS_METER, flights["altitude"], flights["heading"], elapsed_times,
+                                         flights["latitude"], flights["longitude"])
+    phi = batch.phi_current_position(flights["speed"], EARTH_RADIUS_METER, flights["altitude"], flights["heading"], elapsed_times,
+                                     flights["latitude"])
+    return theta, phi
+
+
+def test_starts_at_the_flight_position():
+    flights = random_flight_arrays(100)
+    latitude, longitude = FlightMotion(flights).lat_lon(0)
+
+    np.testing.assert_allclose(latitude, flights["latitude"], atol=1e-9)
+    np.testing.assert_allclose(longitude, flights["longitude"], atol=1e-9)
+
+
+def test_agrees_with_flight_trajectory_where_valid():
+    flights = random_flight_arrays(2000)
+    elapsed_times = np.array([1, 5, 30, 60, MOTION_MODEL_VALID_SECONDS], dtype=float).reshape(1, -1)
+
+    latitude, longitude = FlightMotion(flights).lat_lon(elapsed_times)
+    theta, phi = dawson_theta_phi(flights, elapsed_times)
+    expected_latitude, expected_longitude = 90 - np.degrees(phi), np.degrees(theta)
+
+    # in meters, on the sphere of the flight
+    difference = haversine(latitude, longitude, expected_latitude, expected_longitude) * (1 + flights["altitude"] / EARTH_RADIUS_METER)
+    assert np.all(difference <= MOTION_MODEL_TOLERANCE * flights["speed"] * elapsed_times)
+
+
+@pytest.mark.parametrize("heading", [0, 90, 180, 270])
+def test_keeps_speed_and_altitude(heading):
+    flights = {"latitude": np.array([[45.0]]), "longitude": np.array([[-79.0]]), "altitude": np.array([[10000.0]]),
+               "speed": np.array([[250.0]]), "heading": np.array([[heading]], dtype=float)}
+    elapsed_times = np.arange(0, 3600, 60, dtype=float).reshape(1, -1)
+
+    x, y, z = FlightMotion(flights).ecef(elapsed_times)
+    radius = np.sqrt(x**2 + y**2 + z**2)
+    step = np.sqrt(np.diff(x)**2 + np.diff(y)**2 + np.diff(z)**2)
+
+    np.testing.assert_allclose(radius, EARTH_RADIUS_METER + 10000)
+    # chord of a 60 seconds arc
+    np.testing.assert_allclose(step, 2 * (EARTH_RADIUS_METER + 10000) * math.sin(250 * 60 / (EARTH_RADIUS_METER + 10000) / 2))
+
+
+def test_crosses_the_pole():
+    # flying north along longitude 10, the flight passes over the pole and comes back down along longitude -170
+    flights = {"latitude": np.array([[89.9]]), "longitude": np.array([[10.0]]), "altitude": np.array([[0.0]]),
+               "speed": np.array([[250.0]]), "heading": np.array([[0.0]])}
+    time_over_pole = math.radians(0.1) * EARTH_RADIUS_METER / 250
+    elapsed_times = np.array([[0, time_over_pole, 2 * time_over_pole]])
+
+    latitude, longitude = FlightMotion(flights).lat_lon(elapsed_times)
+    theta, phi = FlightMotion(flights).theta_phi(elapsed_times)
+
+    np.testing.assert_allclose(latitude, [[89.9, 90, 89.9]], atol=1e-9)
+    assert longitude[0, 2] == pytest.approx(-170)
+    assert np.all(np.isfinite(theta)) and np.all(np.isfinite(phi))
+
+
+@pytest.mark.parametrize("motion_model", ["dawson", "great-circle"])
+def test_batch_uses_the_configured_model(monkeypatch, motion_model):
+    monkeypatch.setattr(flight_motion, "MOTION_MODEL", motion_model)
+    flight_data = [fov.convert_to_processed_flight(FLIGHT)]
+    flights = batch.flight_arrays(flight_data)
+    elapsed_times = np.array([0, 60, 1800], dtype=float)
+    sidereal_table = SiderealTimeTable(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, elapsed_times)
+    if motion_model == "dawson":
+        theta, phi = dawson_theta_phi(flights, elapsed_times.reshape(1, -1))
+    else:
+        theta, phi = FlightMotion(flights).theta_phi(elapsed_times.reshape(1, -1))
+
+    ra, dec = batch.flights_ra_dec(flight_data, USER_GPS, elapsed_times, sidereal_table.at(elapsed_times))
+    expected_ra, expected_dec = batch.aircraft_theta_phi_to_radec(theta, phi, flights["altitude"], USER_GPS["latitude"],
+                                                                  USER_GPS["longitude"], USER_GPS["altitude"],
+                                                                  sidereal_table.at(elapsed_times).reshape(1, -1))
+
+    np.testing.assert_allclose(ra, expected_ra, atol=batch.BATCH_TOLERANCE_DEG)
+    np.testing.assert_allclose(dec, expected_dec, atol=batch.BATCH_TOLERANCE_DEG)
+
+
+def test_unknown_model(monkeypatch):
+    monkeypatch.setattr(flight_motion, "MOTION_MODEL", "rhumb")
+
+    with pytest.raises(ValueError):
+        batch.flight_positions(random_flight_arrays(1), 0)
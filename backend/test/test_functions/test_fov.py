@@ -1,6 +1,10 @@
 import pytest
 from utils.datatypes import ProcessedFlightInfo
-from utils import fov
+from utils import fov, batch
+from utils.localsidereal import SiderealTimeTable
+from astropy.time import Time
+from datetime import datetime, timezone
+import numpy as np
 import uuid
 
 def test_remove_ground_flights():
@@ -16,4 +20,46 @@ def test_remove_ground_flights():
 
     # Check that the ground flight was removed
     assert len(filtered_flights) == 2
-    assert all(flight.altitude > 0 for flight in filtered_flights)
\ No newline at end of file
+    assert all(flight.altitude > 0 for flight in filtered_flights)
+
+def test_remove_unreachable_flights_keeps_every_intersecting_flight():
+    user_gps = {"latitude": 43.58962, "longitude": -79.64439, "altitude": 0}
+    observer_time = Time(datetime(2025, 3, 30, 14, 38, 0, tzinfo=timezone.utc))
+    exposure = 300
+    elapsed_times = np.arange(0, exposure, 1)
+    sidereal_table = SiderealTimeTable(user_gps["latitude"], user_gps["longitude"], observer_time, elapsed_times)
+
+    rng = np.random.default_rng(0)
+    flight_data = [
+        ProcessedFlightInfo(id=uuid.uuid4(), flightNumber=str(idx), latitude=user_gps["latitude"] + rng.uniform(-2, 2),
+                            longitude=user_gps["longitude"] + rng.uniform(-2, 2), altitude=rng.uniform(2000, 40000),
+                            speed=rng.uniform(100, 550), heading=rng.uniform(0, 360))
+        for idx in range(500)
+    ]
+    # point at one of the flights half way through the exposure so something crosses
+    ra, dec = batch.flights_ra_dec(flight_data[:1], user_gps, [150], sidereal_table.at([150]))
+    fov_center = {"RA": float(ra[0, 0]), "Dec": float(dec[0, 0])}
+    fov_size = 3
+
+    ra, dec = batch.flights_ra_dec(flight_data, user_gps, elapsed_times, sidereal_table.at(elapsed_times))
+    intersecting = batch.is_intersecting(ra, dec, fov_center["RA"], fov_center["Dec"], fov_size).any(axis=1)
+
+    kept = fov.remove_unreachable_flights(flight_data, user_gps, fov_center, fov_size, exposure, sidereal_table[0])
+    kept_ids = {flight.id for flight in kept}
+
+    assert intersecting.any()
+    assert all(flight.id in kept_ids for flight, hit in zip(flight_data, intersecting) if hit)
+    # most of the sky is far from a 3 degree fov
+    assert len(kept) < len(flight_data) / 2
+
+
+def test_simulated_flight_ids_are_stable():
+    simulated_flights = [{"flightNumber": "SIM1", "latitude": 43.6, "longitude": -79.6, "altitude": 30000, "speed": 400, "heading": 90},
+                         {"flightNumber": "SIM1", "latitude": 43.7, "longitude": -79.5, "altitude": 30000, "speed": 400, "heading": 90}]
+
+    first = fov.find_simulated_flights_in_horizon(43.6, -79.6, simulated_flights)
+    second = fov.find_simulated_flights_in_horizon(43.6, -79.6, simulated_flights)
+    assert [flight.id for flight in first] == [flight.id for flight in second]
+    # flights with the same number are still told apart
+    assert first[0].id != first[1].id
+    assert fov.convert_to_processed_flight(simulated_flights[1], 1).id == first[1].id
@@ -0,0 +1,55 @@
+from datetime import datetime, timezone
+
+import pytest
+from astropy.time import Time, TimeDelta
+
+from utils import conversion
+from utils.localsidereal import get_local_sidereal_time, get_local_times, get_timezone_name, get_timezone_finder, \
+    _timezone_name_at, SiderealTimeTable
+
+OBSERVER_TIME = Time(datetime(2025, 3, 30, 14, 38, 0, tzinfo=timezone.utc))
+
+
+@pytest.mark.parametrize("lat, lon", [
+    (43.58962, -79.64439),
+    (-33.86, 151.21),
+    (0, 0),
+])
+def test_sidereal_table_matches_astropy(lat, lon):
+    table = SiderealTimeTable(lat, lon, OBSERVER_TIME, range(0, 600, 5))
+
+    # tabulated timesteps and times in between them
+    for elapsed_time in [0, 5, 300, 595, 2.5, 333.3, 600, 900]:
+        expected = get_local_sidereal_time(lat, lon, OBSERVER_TIME + TimeDelta(elapsed_time, format='sec'))
+        assert table[elapsed_time] == pytest.approx(expected, abs=1e-8)
+
+
+def test_sidereal_table_empty_timesteps():
+    table = SiderealTimeTable(43.58962, -79.64439, OBSERVER_TIME, [])
+    assert table[0] == pytest.approx(get_local_sidereal_time(43.58962, -79.64439, OBSERVER_TIME), abs=1e-8)
+
+
+def test_aziele_to_radec_with_sidereal_table():
+    lat, lon = 37.7749, 47.4194
+    table = SiderealTimeTable(lat, lon, OBSERVER_TIME, [0])
+    azele = (1.2, 0.4)
+
+    assert conversion.aziele_to_radec(azele, lat, lon, local_sidereal_time=table[0]) == \
+        pytest.approx(conversion.aziele_to_radec(azele, lat, lon, OBSERVER_TIME), abs=1e-6)
+
+
+def test_timezone_name_is_cached():
+    assert get_timezone_name(43.58962, -79.64439) == "America/Toronto"
+    hits = _timezone_name_at.cache_info().hits
+    assert get_timezone_name(43.58962, -79.64439) == "America/Toronto"
+    assert _timezone_name_at.cache_info().hits == hits + 1
+    assert get_timezone_finder() is get_timezone_finder()
+
+
+def test_get_local_times():
+    utc_times = OBSERVER_TIME + TimeDelta([0, 60, 3600], format='sec')
+    local_times = get_local_times(utc_times, "America/Toronto")
+
+    assert [local_time.hour for local_time in local_times] == [10, 10, 11]
+    assert local_times[1].minute == 39
+    assert all(local_time.utcoffset().total_seconds() == -4 * 3600 for local_time in local_times)
@@ -0,0 +1,78 @@
+import pytest
+
+from samples import prediction_arguments
+from utils import metrics
+from utils.integration import run_find_flights_intersecting
+
+
+def test_stages_are_collected_per_request():
+    with metrics.stage("outside"):
+        pass
+
+    with metrics.collect() as timings:
+        with metrics.stage("fetch"):
+            pass
+        with metrics.stage("propagate"):
+            pass
+        with metrics.stage("propagate"):
+            pass
+        with metrics.collect() as inner:
+            with metrics.stage("encode"):
+                pass
+        metrics.add_timings({"worker": 0.5, "fetch": 1})
+
+    assert set(timings) == {"fetch", "propagate", "worker"}
+    assert set(inner) == {"encode"}
+    assert timings["worker"] == 0.5
+    assert timings["fetch"] >= 1
+
+
+def test_stage_timing_survives_exceptions():
+    with metrics.collect() as timings:
+        with pytest.raises(ValueError):
+            with metrics.stage("fetch"):
+                raise ValueError()
+
+    assert "fetch" in timings
+
+
+def test_server_timing_header():
+    assert metrics.server_timing({"fetch": 0.0123, "total": 1}) == "fetch;dur=12.300, total;dur=1000.000"
+
+
+def test_worker_computation_returns_its_timings():
+    _, _, stats, timings = run_find_flights_intersecting(prediction_arguments())
+
+    assert {"horizon", "ground", "sidereal", "cull", "propagate"} <= set(timings)
+    assert stats["candidates"] == 1
+
+
+def test_histogram_rendering():
+    histogram = metrics.Histogram("test_seconds", "Test.", ("stage",), buckets=(0.1, 1))
+    metrics.registry.remove(histogram)
+    histogram.observe(0.05, stage="fetch")
+    histogram.observe(0.5, stage="fetch")
+    histogram.observe(5, stage="fetch")
+
+    assert histogram.render() == [
+        "# HELP test_seconds Test.",
+        "# TYPE test_seconds histogram",
+        'test_seconds_bucket{stage="fetch",le="0.1"} 1',
+        'test_seconds_bucket{stage="fetch",le="1"} 2',
+        'test_seconds_bucket{stage="fetch",le="+Inf"} 3',
+        'test_seconds_count{stage="fetch"} 3',
+        'test_seconds_sum{stage="fetch"} 5.55',
+    ]
+    assert histogram.count(stage="fetch") == 3
+
+
+def test_counter_rendering():
+    counter = metrics.Counter("test_total", "Test.", ("status",))
+    metrics.registry.remove(counter)
+    counter.inc(status=200)
+    counter.inc(2, status=200)
+    counter.inc(status='5"3')
+
+    assert counter.value(status=200) == 3
+    assert counter.render()[2:] == ['test_total{status="200"} 3', 'test_total{status="5\\"3"} 1']
+    assert "flight_prediction_stage_seconds" in metrics.render()
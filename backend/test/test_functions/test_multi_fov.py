@@ -0,0 +1,52 @@
+import pytest
+
+from samples import OBSERVER_TIME, USER_GPS, pointing_at, random_flights
+from utils.integration import find_flights_intersecting, find_flights_intersecting_multi
+
+
+def fov_at(flight, elapsed_time, fov_size, exposure):
+    """ a fov pointing where a simulated flight is after elapsed_time seconds """
+    ra_h, ra_m, ra_s, dec = pointing_at(flight, elapsed_time)
+    return {"fov_size": fov_size, "exposure": exposure, "fov_center_ra_h": ra_h, "fov_center_ra_m": ra_m, "fov_center_ra_s": ra_s,
+            "fov_center_dec": dec}
+
+
+def test_multi_matches_one_request_per_fov():
+    flights = random_flights(300)
+    fovs = [fov_at(flights[0], 60, 2, 120), fov_at(flights[1], 30, 5, 300), fov_at(flights[2], 100, 1, 200)]
+
+    stats = dict()
+    results = find_flights_intersecting_multi(fovs, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+                                              "simulated", flights, OBSERVER_TIME, stats=stats)
+    assert len(results) == len(fovs)
+    assert stats["propagated"] <= stats["candidates"]
+    assert len(stats["fovs"]) == len(fovs)
+
+    for fov_definition, (flights_position, flight_data) in zip(fovs, results):
+        expected_position, expected_data = find_flights_intersecting(**fov_definition, observer_lon=USER_GPS["longitude"],
+                                                                     observer_lat=USER_GPS["latitude"], altitude=USER_GPS["altitude"],
+                                                                     flight_data_type="simulated", simulated_flights=flights,
+                                                                     simulated_time=OBSERVER_TIME)
+        assert any(flights_position)
+        assert [[position["FlightNumber"] for position in step] for step in flights_position] == \
+            [[position["FlightNumber"] for position in step] for step in expected_position]
+        assert [(result.flight.id, result.entry, result.exit) for result in flight_data] == \
+            [(result.flight.id, result.entry, result.exit) for result in expected_data]
+
+
+def test_multi_fovs_have_their_own_results():
+    flights = random_flights(50, seed=1)
+    fovs = [fov_at(flights[0], 60, 2, 120), fov_at(flights[0], 60, 2, 30)]
+
+    (_, first), (_, second) = find_flights_intersecting_multi(fovs, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+                                                              "simulated", flights, OBSERVER_TIME)
+    entered_first = {result.flight.flightNumber for result in first if result.entry}
+    entered_second = {result.flight.flightNumber for result in second if result.entry}
+    assert flights[0]["flightNumber"] in entered_first
+    assert flights[0]["flightNumber"] not in entered_second
+
+
+def test_multi_needs_a_fov():
+    with pytest.raises(ValueError):
+        find_flights_intersecting_multi([], USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+                                        "simulated", random_flights(1), OBSERVER_TIME)
@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+import pytest
+
+import utils.batch as batch
+import utils.conversion as conversion
+import utils.observer_frame as observer_frame
+from samples import USER_GPS
+from utils.constants import EARTH_RADIUS_METER
+from utils.observer_frame import ObserverFrame
+
+
+def random_positions(count, seed=0):
+    rng = np.random.default_rng(seed)
+    theta = rng.uniform(0, 2 * math.pi, (count, 1))
+    phi = rng.uniform(0.01, math.pi - 0.01, (count, 1))
+    altitude = rng.uniform(0, 13000, (count, 1))
+    return theta, phi, altitude
+
+
+@pytest.mark.parametrize("user_gps", [USER_GPS, {"latitude": -33.9, "longitude": 151.2, "altitude": 0},
+                                      {"latitude": 0, "longitude": 179.9, "altitude": 2000}])
+def test_ra_dec_matches_batch_conversion(user_gps):
+    theta, phi, altitude = random_positions(500)
+    local_sidereal_times = np.linspace(0, 2 * math.pi, 9, endpoint=False).reshape(1, -1)
+
+    ra, dec = ObserverFrame(user_gps, local_sidereal_times).ra_dec(
+        *batch.spherical_to_cartesian(EARTH_RADIUS_METER + altitude, theta, phi))
+    expected_ra, expected_dec = batch.aircraft_theta_phi_to_radec(theta, phi, altitude, user_gps["latitude"], user_gps["longitude"],
+                                                                  user_gps["altitude"], local_sidereal_times)
+
+    ra_difference = np.abs(ra - expected_ra) % 360
+    assert np.all(np.minimum(ra_difference, 360 - ra_difference) * np.cos(np.radians(dec)) < batch.BATCH_TOLERANCE_DEG)
+    assert np.all(np.abs(dec - expected_dec) < batch.BATCH_TOLERANCE_DEG)
+
+
+@pytest.mark.parametrize("theta, phi, altitude, local_sidereal_time", [
+    (4.9, 0.81, 10000, 1.2),
+    (0.1, 2.5, 3000, 5.0),
+    (3.0, 1.57, 12000, 0.0),
+])
+def test_ra_dec_matches_scalar_conversion(theta, phi, altitude, local_sidereal_time):
+    ra, dec = ObserverFrame(USER_GPS, local_sidereal_time).ra_dec(*batch.spherical_to_cartesian(EARTH_RADIUS_METER + altitude, theta, phi))
+    expected_ra, expected_dec = conversion.aircraft_theta_phi_to_radec(theta, phi, altitude, USER_GPS["latitude"], USER_GPS["longitude"],
+                                                                       USER_GPS["altitude"], local_sidereal_time=local_sidereal_time)
+
+    assert ra == pytest.approx(expected_ra, abs=batch.BATCH_TOLERANCE_DEG)
+    assert dec == pytest.approx(expected_dec, abs=batch.BATCH_TOLERANCE_DEG)
+
+
+def test_unit_vector_round_trip():
+    ra, dec = np.array([0, 45, 180, 359.5]), np.array([-89, 0, 30, 89.9])
+    x, y, z = observer_frame.unit_vector(ra, dec)
+
+    np.testing.assert_allclose(x**2 + y**2 + z**2, 1)
+    np.testing.assert_allclose(observer_frame.ra_dec(x, y, z), (ra, dec), atol=1e-9)
+
+
+def test_is_intersecting_matches_angular_distance():
+    rng = np.random.default_rng(1)
+    ra, dec = rng.uniform(0, 360, 20000), np.degrees(np.arcsin(rng.uniform(-1, 1, 20000)))
+    fov_center, fov_size = {"RA": 120, "Dec": 40}, 60
+
+    intersecting = observer_frame.is_intersecting(*observer_frame.unit_vector(ra, dec), fov_center, fov_size)
+    expected = batch.is_intersecting(ra, dec, fov_center["RA"], fov_center["Dec"], fov_size)
+    boundary = np.abs(batch.angular_distance(ra, dec, fov_center["RA"], fov_center["Dec"]) - fov_size / 2) < batch.BATCH_TOLERANCE_DEG
+
+    assert np.count_nonzero(expected) > 100
+    assert np.array_equal(intersecting[~boundary], expected[~boundary])
+
+
+def test_nan_positions_are_never_intersecting():
+    x, y, z = ObserverFrame(USER_GPS, 0).equatorial(np.nan, 0, 0)
+
+    assert not observer_frame.is_intersecting(x, y, z, {"RA": 0, "Dec": 0}, 360)
@@ -0,0 +1,120 @@
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from astropy.time import Time
+
+import utils.batch as batch
+import utils.refinement as refinement
+from utils.datatypes import ProcessedFlightInfo
+from utils.integration import find_flights_intersecting
+from utils.localsidereal import SiderealTimeTable
+
+OBSERVER_TIME = Time(datetime(2025, 3, 30, 14, 38, 0, tzinfo=timezone.utc))
+USER_GPS = {"latitude": 43.58962, "longitude": -79.64439, "altitude": 0}
+
+
+def fov_center_at(flight, elapsed_time, sidereal_table):
+    """ Point the telescope at where the flight will be at the elapsed time. """
+    ra, dec = batch.flights_ra_dec([flight], USER_GPS, [elapsed_time], sidereal_table.at([elapsed_time]))
+    return {"RA": float(ra[0, 0]), "Dec": float(dec[0, 0])}
+
+
+def fine_crossings(flights, sidereal_table, fov_center, fov_size, exposure, step=0.01):
+    """ Reference entry/exit times from sampling with a very small timestep. """
+    times = np.arange(0, exposure, step)
+    distance = refinement.fov_distance(flights, USER_GPS, sidereal_table, fov_center, fov_size, times.reshape(1, -1))[0]
+    inside = distance < 0
+    changes = np.flatnonzero(inside[1:] != inside[:-1]) + 1
+    return [("entry" if inside[change] else "exit", times[change]) for change in changes]
+
+
+@pytest.mark.parametrize("altitude, speed, heading, fov_size, crossing_time", [
+    # airliner through a wide fov
+    (35000, 490, 111, 2, 63.3),
+    # fast low flight through a narrow fov near zenith, only a fraction of a second in view
+    (3000, 300, 45, 0.5, 41.7),
+])
+def test_crossings_match_fine_sampling(altitude, speed, heading, fov_size, crossing_time):
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="1", latitude=USER_GPS["latitude"] + 0.01,
+                                 longitude=USER_GPS["longitude"] - 0.02, altitude=altitude, speed=speed, heading=heading)
+    exposure = 120
+    sidereal_table = SiderealTimeTable(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, range(0, exposure, 5))
+    fov_center = fov_center_at(flight, crossing_time, sidereal_table)
+    flights = batch.flight_arrays([flight])
+
+    sample_times = refinement.sample_times_with_end(range(0, exposure, 5), exposure)
+    crossings, evaluations = refinement.find_fov_crossings(flights, USER_GPS, sidereal_table, fov_center, fov_size, sample_times)
+    expected = fine_crossings(flights, sidereal_table, fov_center, fov_size, exposure)
+
+    assert [event for _, event, _ in crossings] == [event for event, _ in expected]
+    for (_, _, time), (_, expected_time) in zip(crossings, expected):
+        assert time == pytest.approx(expected_time, abs=refinement.EVENT_TIME_TOLERANCE)
+    # far fewer evaluations than sampling every EVENT_TIME_TOLERANCE seconds
+    assert evaluations < exposure / refinement.EVENT_TIME_TOLERANCE / 5
+
+
+def test_pass_between_samples_is_found():
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="1", latitude=USER_GPS["latitude"],
+                                 longitude=USER_GPS["longitude"], altitude=3000, speed=300, heading=90)
+    sidereal_table = SiderealTimeTable(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, range(0, 60, 30))
+    fov_center = fov_center_at(flight, 12.5, sidereal_table)
+    flights = batch.flight_arrays([flight])
+    sample_times = refinement.sample_times_with_end(range(0, 60, 30), 60)
+
+    # the flight is out of the fov at every sample
+    distance = refinement.fov_distance(flights, USER_GPS, sidereal_table, fov_center, 0.5, sample_times.reshape(1, -1))
+    assert (distance > 0).all()
+
+    crossings, _ = refinement.find_fov_crossings(flights, USER_GPS, sidereal_table, fov_center, 0.5, sample_times)
+    assert [event for _, event, _ in crossings] == ["entry", "exit"]
+    assert crossings[0][2] < 12.5 < crossings[1][2]
+
+
+def test_far_flights_need_no_extra_evaluations():
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="1", latitude=USER_GPS["latitude"] + 1,
+                                 longitude=USER_GPS["longitude"] + 1, altitude=35000, speed=450, heading=0)
+    sidereal_table = SiderealTimeTable(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, range(0, 300, 5))
+    # opposite side of the sky
+    fov_center = fov_center_at(flight, 0, sidereal_table)
+    fov_center["RA"] = (fov_center["RA"] + 180) % 360
+
+    crossings, evaluations = refinement.find_fov_crossings(batch.flight_arrays([flight]), USER_GPS, sidereal_table, fov_center, 1,
+                                                           refinement.sample_times_with_end(range(0, 300, 5), 300))
+    assert crossings == []
+    assert evaluations == 0
+
+
+@pytest.mark.parametrize("elapsed_times, exposure, expected", [
+    (range(0, 3, 5), 3, [0, 3]),
+    (range(0, 20, 5), 20, [0, 5, 10, 15, 20]),
+    (range(0, 0, 5), 0, [0]),
+])
+def test_sample_times_with_end(elapsed_times, exposure, expected):
+    assert refinement.sample_times_with_end(elapsed_times, exposure).tolist() == expected
+
+
+def test_find_flights_intersecting_refined_events():
+    simulated_flights = [{"flightNumber": "123", "latitude": 43.9002, "longitude": -80.2114, "altitude": 35000, "speed": 490, "heading": 111}]
+    flight = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="123", latitude=43.9002, longitude=-80.2114, altitude=35000, speed=490, heading=111)
+    sidereal_table = SiderealTimeTable(USER_GPS["latitude"], USER_GPS["longitude"], OBSERVER_TIME, [0])
+    fov_center = fov_center_at(flight, 61.2, sidereal_table)
+    ra_hours = fov_center["RA"] / 15
+    ra_h, ra_m = int(ra_hours), int((ra_hours % 1) * 60)
+    ra_s = ((ra_hours % 1) * 60 - ra_m) * 60
+
+    results = {}
+    for refine_events in (False, True):
+        results[refine_events] = find_flights_intersecting(
+            1, 120, ra_h, ra_m, ra_s, fov_center["Dec"], USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+            "simulated", simulated_flights, OBSERVER_TIME, refine_events=refine_events)
+
+    (coarse_positions, coarse_flights), (refined_positions, refined_flights) = results[False], results[True]
+    # positions are still reported once per timestep
+    assert [[p["FlightNumber"] for p in step] for step in refined_positions] == \
+        [[p["FlightNumber"] for p in step] for step in coarse_positions]
+    # refined times are no longer multiples of the timestep, and are earlier than the sampled ones
+    assert refined_flights[0].entry.second % 5 != 0 or refined_flights[0].entry.microsecond != 0
+    assert refined_flights[0].entry < coarse_flights[0].entry
+    assert refined_flights[0].exit < coarse_flights[0].exit
@@ -0,0 +1,105 @@
+import json
+
+import pytest
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.http import parse_accept_header
+
+from samples import FLIGHTS, OBSERVER_TIME, USER_GPS, pointing_at
+from utils import response_format
+from utils.integration import find_flights_intersecting
+
+
+def predict():
+    ra_h, ra_m, ra_s, dec = pointing_at(FLIGHTS[0], 60)
+    return find_flights_intersecting(2, 120, ra_h, ra_m, ra_s, dec, USER_GPS["longitude"], USER_GPS["latitude"],
+                                     USER_GPS["altitude"], "simulated", FLIGHTS, OBSERVER_TIME)
+
+
+def test_columnar_matches_legacy_shape():
+    flights_position, flight_data = predict()
+    columnar = response_format.to_columnar(flights_position, flight_data, 5)
+
+    legacy = [result.to_dict() for result in flight_data if result.entry]
+    assert legacy
+    assert columnar["elapsed_times"] == list(range(0, 120, 5))
+    assert columnar["flights"]["id"] == [flight["id"] for flight in legacy]
+    assert columnar["flights"]["flight_number"] == [flight["flight_number"] for flight in legacy]
+
+    for row, flight_id in enumerate(columnar["flights"]["id"]):
+        assert len(columnar["ra"][row]) == len(flights_position)
+        for step, curr_flight_positions in enumerate(flights_position):
+            position = next((position for position in curr_flight_positions if str(position["ID"]) == flight_id), None)
+            assert columnar["ra"][row][step] == (position["RA"] if position else None)
+            assert columnar["dec"][row][step] == (position["Dec"] if position else None)
+
+
+@pytest.mark.parametrize("mimetype", [mimetype for mimetype in response_format.available_formats()
+                                      if mimetype in (response_format.LEGACY_JSON, response_format.COLUMNAR_JSON)])
+def test_json_encoding_is_compact_and_round_trips(mimetype):
+    body = {"flights": {"id": ["a"], "speed": [float("nan")]}, "ra": [[1.5, None]], "fov_size": 2}
+    encoded = response_format.encode(body, mimetype)
+
+    assert b" " not in encoded
+    assert json.loads(encoded) == {"flights": {"id": ["a"], "speed": [None]}, "ra": [[1.5, None]], "fov_size": 2}
+
+
+def test_optional_formats_are_only_offered_when_installed():
+    formats = response_format.available_formats()
+
+    assert formats[0] == response_format.LEGACY_JSON
+    assert (response_format.MSGPACK in formats) == (response_format.msgpack is not None)
+    assert (response_format.ARROW_STREAM in formats) == (response_format.pyarrow is not None)
+
+
+def columnar_body():
+    flights_position, flight_data = predict()
+    body = response_format.to_columnar(flights_position, flight_data, 5)
+    body.update({"fov_size": 2.0, "stats": {"candidates": 2}})
+    return body
+
+
+def test_orjson_encoding_round_trips():
+    pytest.importorskip("orjson")
+    body = columnar_body()
+
+    assert json.loads(response_format.encode(body, response_format.COLUMNAR_JSON)) == body
+
+
+def test_msgpack_encoding_round_trips():
+    msgpack = pytest.importorskip("msgpack")
+    body = columnar_body()
+
+    assert msgpack.unpackb(response_format.encode(body, response_format.MSGPACK)) == body
+
+
+def test_arrow_encoding_round_trips():
+    pyarrow = pytest.importorskip("pyarrow")
+    body = columnar_body()
+
+    table = pyarrow.ipc.open_stream(response_format.encode(body, response_format.ARROW_STREAM)).read_all()
+
+    assert table.num_rows == len(body["flights"]["id"]) > 0
+    for column, values in body["flights"].items():
+        assert table.column(column).to_pylist() == values
+    assert table.column("ra").to_pylist() == body["ra"]
+    assert table.column("dec").to_pylist() == body["dec"]
+    metadata = {key.decode(): json.loads(value) for key, value in table.schema.metadata.items()}
+    assert metadata == {"elapsed_times": body["elapsed_times"], "fov_size": 2.0, "stats": {"candidates": 2}}
+
+
+@pytest.mark.parametrize("header, expected", [
+    ("", response_format.LEGACY_JSON),
+    ("*/*", response_format.LEGACY_JSON),
+    ("text/html", response_format.LEGACY_JSON),
+    ("application/xml, text/html;q=0.9", response_format.LEGACY_JSON),
+    (response_format.COLUMNAR_JSON, response_format.COLUMNAR_JSON),
+    (f"{response_format.COLUMNAR_JSON}, application/json;q=0.5", response_format.COLUMNAR_JSON),
+])
+def test_format_is_chosen_from_the_accept_header(header, expected):
+    assert response_format.choose_format(parse_accept_header(header, MIMEAccept)) == expected
+
+
+def test_missing_columnar_format_is_not_acceptable(monkeypatch):
+    monkeypatch.setattr(response_format, "msgpack", None)
+
+    assert response_format.choose_format(parse_accept_header(response_format.MSGPACK, MIMEAccept)) is None
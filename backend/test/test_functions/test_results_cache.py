@@ -0,0 +1,58 @@
+import pytest
+from astropy.time import TimeDelta
+
+from samples import FLIGHTS, OBSERVER_TIME, prediction_arguments
+from utils.results_cache import ResultsCache, results_cache_key
+from utils.simulated_fleet import SimulatedFleet
+
+
+def arguments(**changes):
+    return prediction_arguments(**{"simulated_flights": SimulatedFleet(FLIGHTS), **changes})
+
+
+def test_key_is_canonical():
+    # same numbers as floats, a new but identical fleet and an ignored argument
+    same = arguments(fov_size=2.0, time_step=5.0, simulated_flights=SimulatedFleet([dict(flight) for flight in FLIGHTS]),
+                     simulated_fleet_id="fleet")
+    assert results_cache_key(arguments()) == results_cache_key(same)
+
+
+@pytest.mark.parametrize("changes", [
+    {"exposure": 120},
+    {"fov_center_dec": 40.0001},
+    {"simulated_time": OBSERVER_TIME + TimeDelta(1, format='sec')},
+    {"refine_events": True},
+    {"flight_data_type": "historical"},
+    {"simulated_flights": SimulatedFleet([FLIGHTS[0], {**FLIGHTS[1], "heading": 301}])},
+    {"simulated_flights": SimulatedFleet(FLIGHTS[:1])},
+])
+def test_key_depends_on_every_input(changes):
+    assert results_cache_key(arguments()) != results_cache_key(arguments(**changes))
+
+
+def test_hits_misses_and_eviction():
+    cache = ResultsCache(max_size=2)
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value
+
+    assert cache.get_or_compute("a", lambda: compute(1)) == (1, False)
+    assert cache.get_or_compute("a", lambda: compute(2)) == (1, True)
+    cache.get_or_compute("b", lambda: compute(3))
+    cache.get_or_compute("a", lambda: compute(4)) # "a" is now the most recently used
+    cache.get_or_compute("c", lambda: compute(5)) # evicts "b"
+
+    assert cache.get_or_compute("b", lambda: compute(6)) == (6, False)
+    assert calls == [1, 3, 5, 6]
+    assert (cache.hits, cache.misses) == (2, 4)
+    assert len(cache) == 2
+
+
+def test_disabled_cache_always_computes():
+    cache = ResultsCache(max_size=0)
+    cache.get_or_compute("a", lambda: 1)
+
+    assert cache.get_or_compute("a", lambda: 2) == (2, False)
+    assert len(cache) == 0
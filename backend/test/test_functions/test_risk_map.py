@@ -0,0 +1,75 @@
+import numpy as np
+import pytest
+
+import utils.risk_map as risk_map
+from samples import OBSERVER_TIME, random_flights
+from utils.integration import find_flights_intersecting
+from utils.risk_map import find_crossings_grid, grid_axis
+
+LATITUDES = np.linspace(42.5, 44.5, 4)
+LONGITUDES = np.linspace(-81, -78, 5)
+# fov_size, exposure, fov_center_ra_h, fov_center_ra_m, fov_center_ra_s, fov_center_dec
+POINTING = (10, 120, 16, 30, 0, 40)
+# over the whole grid and around it
+FLIGHTS = random_flights(2000, 43.5, -79.5, spread=(3, 4), seed=3)
+
+
+def test_crossings_match_one_prediction_per_site():
+    stats = dict()
+    result = find_crossings_grid(*POINTING, LATITUDES, LONGITUDES, 200, "simulated", FLIGHTS, OBSERVER_TIME, stats=stats)
+
+    expected = np.zeros((len(LATITUDES), len(LONGITUDES)), dtype=int)
+    for row, latitude in enumerate(LATITUDES):
+        for column, longitude in enumerate(LONGITUDES):
+            _, flight_data = find_flights_intersecting(*POINTING, longitude, latitude, 200, "simulated", FLIGHTS, OBSERVER_TIME)
+            expected[row, column] = sum(1 for flight in flight_data if flight.entry)
+
+    assert expected.any()
+    np.testing.assert_array_equal(result["crossings"], expected)
+    assert stats["sites"] == len(LATITUDES) * len(LONGITUDES)
+    assert stats["propagated"] == len(FLIGHTS)
+
+
+def test_batching_does_not_change_the_counts(monkeypatch):
+    expected = find_crossings_grid(*POINTING, LATITUDES, LONGITUDES, 200, "simulated", FLIGHTS, OBSERVER_TIME)
+
+    # one site per batch
+    monkeypatch.setattr(risk_map, "RISK_MAP_BATCH_SIZE", 1)
+    result = find_crossings_grid(*POINTING, LATITUDES, LONGITUDES, 200, "simulated", FLIGHTS, OBSERVER_TIME)
+
+    np.testing.assert_array_equal(result["crossings"], expected["crossings"])
+    np.testing.assert_array_equal(result["elevation"], expected["elevation"])
+
+
+def test_elevation_of_the_pole():
+    # the celestial pole is as high as the site's latitude
+    result = find_crossings_grid(2, 60, 0, 0, 0, 90, LATITUDES, LONGITUDES, 0, "simulated", FLIGHTS, OBSERVER_TIME)
+
+    np.testing.assert_allclose(result["elevation"], np.repeat(LATITUDES[:, None], len(LONGITUDES), axis=1), atol=1e-6)
+
+
+@pytest.mark.parametrize("latitudes, longitudes, fov_center_dec", [
+    ([], LONGITUDES, 40),
+    (LATITUDES, [], 40),
+    ([91], LONGITUDES, 40),
+    (LATITUDES, [181], 40),
+    (LATITUDES, LONGITUDES, 91),
+    (np.zeros(200), np.zeros(100), 40),
+])
+def test_invalid_grids_are_rejected(latitudes, longitudes, fov_center_dec):
+    with pytest.raises(ValueError):
+        find_crossings_grid(2, 60, 1, 0, 0, fov_center_dec, latitudes, longitudes, 0, "simulated", FLIGHTS, OBSERVER_TIME)
+
+
+@pytest.mark.parametrize("start, stop, count, expected", [
+    (40, 44, 3, [40, 42, 44]),
+    (40, 44, 1, [40]),
+    (-80, -80, 2, [-80, -80]),
+])
+def test_grid_axis(start, stop, count, expected):
+    assert grid_axis(start, stop, count).tolist() == expected
+
+
+def test_grid_axis_needs_a_value():
+    with pytest.raises(ValueError):
+        grid_axis(40, 44, 0)
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+
+import utils.sharding as sharding
+from samples import OBSERVER_TIME, USER_GPS, random_flights
+from utils import fov
+from utils.compute_pool import ComputePool
+from utils.integration import find_flights_intersecting
+from utils.sharding import ShardPool, flight_records, shard_intersections
+
+def predict(flights, vectorized=True, stats=None):
+    # a wide fov towards the zenith, so many flights enter and exit it
+    return find_flights_intersecting(60, 120, 17, 0, 0, USER_GPS["latitude"], USER_GPS["longitude"], USER_GPS["latitude"],
+                                     USER_GPS["altitude"], "simulated", flights, OBSERVER_TIME, vectorized=vectorized, stats=stats)
+
+
+@pytest.fixture
+def shard_pool(monkeypatch):
+    pool = ShardPool(workers=3, min_flights=10)
+    monkeypatch.setattr(sharding, "shard_pool", pool)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.mark.parametrize("vectorized", [True, False])
+def test_sharded_matches_single_process(shard_pool, vectorized):
+    flights = random_flights(40)
+    shard_pool.workers = 0
+    expected_position, expected_results = predict(flights, vectorized)
+    shard_pool.workers = 3
+    stats = dict()
+
+    flights_position, results = predict(flights, vectorized, stats)
+
+    assert stats["shards"] == 3
+    assert any(expected_position)
+    assert flights_position == expected_position
+    assert [result.to_dict() for result in results] == [result.to_dict() for result in expected_results]
+
+
+def test_dead_workers_are_replaced(shard_pool):
+    flights = random_flights(40)
+    expected = predict(flights)
+    executor = shard_pool._executor
+    for process in list(executor._processes.values()):
+        process.kill()
+        process.join()
+
+    assert predict(flights) == expected
+    assert shard_pool._executor is not executor
+
+
+def test_small_scenes_are_not_sharded(shard_pool):
+    stats = dict()
+    predict(random_flights(5), stats=stats)
+
+    assert "shards" not in stats
+    assert not ShardPool(workers=1, min_flights=0).enabled_for(100)
+    assert not ShardPool(workers=4, min_flights=0).enabled_for(3)
+
+
+def sharding_enabled():
+    return ShardPool(workers=3, min_flights=0).enabled_for(100)
+
+
+def test_compute_workers_do_not_shard():
+    pool = ComputePool(workers=1, queue_depth=0)
+    try:
+        assert sharding_enabled()
+        assert not pool.run(sharding_enabled)
+    finally:
+        pool.shutdown()
+
+
+def test_records_only_keep_the_trajectory():
+    flight_data = [fov.convert_to_processed_flight(flight) for flight in random_flights(3)]
+    records = flight_records(flight_data)
+
+    assert records.shape == (3, len(sharding.RECORD_FIELDS))
+    assert records[1].tolist() == [flight_data[1].speed, flight_data[1].altitude, flight_data[1].heading, flight_data[1].latitude,
+                                   flight_data[1].longitude]
+    assert flight_records([]).shape == (0, len(sharding.RECORD_FIELDS))
+
+
+def test_shards_are_independent():
+    records = flight_records([fov.convert_to_processed_flight(flight) for flight in random_flights(6)])
+    arguments = (USER_GPS, [0, 5, 10], np.array([1.0, 1.01, 1.02]), {"RA": 255, "Dec": 43}, 60, True)
+
+    whole = shard_intersections(records, *arguments)
+    parts = [shard_intersections(part, *arguments) for part in np.array_split(records, 4)]
+
+    for index in range(3):
+        assert np.array_equal(whole[index], np.concatenate([part[index] for part in parts]))
@@ -0,0 +1,65 @@
+import math
+
+import numpy as np
+import pytest
+
+from utils import fov
+import utils.simulated_fleet as simulated_fleet
+from utils.simulated_fleet import SimulatedFleet, get_simulated_fleet
+from utils.constants import EARTH_RADIUS_METER, AIRPLANE_MAX_ALT
+
+
+def make_simulated_flights(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {"flightNumber": f"SIM{idx}", "latitude": rng.uniform(-90, 90), "longitude": rng.uniform(-180, 180),
+         "altitude": rng.uniform(0, 40000), "speed": rng.uniform(100, 500), "heading": rng.uniform(0, 360)}
+        for idx in range(count)
+    ]
+
+
+@pytest.mark.parametrize("lat, lon, radius", [
+    (43.6, -79.6, 400000),
+    (0.0, 179.9, 400000),
+    (89.5, 10.0, 400000),
+    (-60.0, -30.0, 2000000),
+    (10.0, 20.0, 10000),
+])
+def test_radius_query_matches_scalar_haversine(lat, lon, radius):
+    flights = make_simulated_flights(20000)
+    fleet = SimulatedFleet(flights)
+
+    found = fleet.indices_in_radius(lat, lon, radius).tolist()
+    expected = [idx for idx, flight in enumerate(flights)
+                if fov.haversine(lat, lon, flight["latitude"], flight["longitude"]) <= radius]
+    assert found == expected
+
+
+def test_horizon_keeps_order_and_fields():
+    flights = make_simulated_flights(5000, seed=1)
+    query_radius = math.sqrt((EARTH_RADIUS_METER + AIRPLANE_MAX_ALT)**2 - EARTH_RADIUS_METER**2)
+
+    result = fov.find_simulated_flights_in_horizon(45.0, -75.0, flights)
+    expected = [flight for flight in flights if fov.haversine(45.0, -75.0, flight["latitude"], flight["longitude"]) <= query_radius]
+
+    assert [flight.flightNumber for flight in result] == [flight["flightNumber"] for flight in expected]
+    for processed, flight in zip(result, expected):
+        assert (processed.latitude, processed.longitude, processed.altitude, processed.speed, processed.heading) == \
+            (flight["latitude"], flight["longitude"], flight["altitude"], flight["speed"], flight["heading"])
+
+
+def test_fleet_is_reused_by_id():
+    flights = make_simulated_flights(100, seed=2)
+    fleet = get_simulated_fleet(flights, "reuse-test")
+
+    assert get_simulated_fleet(None, "reuse-test") is fleet
+    with pytest.raises(ValueError):
+        get_simulated_fleet(None, "unknown-fleet")
+
+
+def test_fleet_cache_is_bounded():
+    for idx in range(simulated_fleet.SIMULATED_FLEET_CACHE_SIZE + 1):
+        get_simulated_fleet(make_simulated_flights(1, seed=idx), f"bounded-{idx}")
+
+    assert not simulated_fleet.has_simulated_fleet("bounded-0")
+    assert simulated_fleet.has_simulated_fleet(f"bounded-{simulated_fleet.SIMULATED_FLEET_CACHE_SIZE}")
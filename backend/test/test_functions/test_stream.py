@@ -0,0 +1,43 @@
+import pytest
+
+from samples import FLIGHTS, OBSERVER_TIME, USER_GPS, pointing_at
+from utils.integration import find_flights_intersecting, stream_flights_intersecting
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_stream_matches_find_flights_intersecting(chunk_size):
+    ra_h, ra_m, ra_s, dec = pointing_at(FLIGHTS[0], 60)
+    arguments = (2, 120, ra_h, ra_m, ra_s, dec, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+                 "simulated", FLIGHTS, OBSERVER_TIME)
+
+    flights_position, flight_data = find_flights_intersecting(*arguments)
+    records = list(stream_flights_intersecting(*arguments, chunk_size=chunk_size))
+
+    timesteps = [record for record in records if record["type"] == "timestep"]
+    assert [record["elapsedTime"] for record in timesteps] == list(range(0, 120, 5))
+    assert [[position["FlightNumber"] for position in record["flights_position"]] for record in timesteps] == \
+        [[position["FlightNumber"] for position in step] for step in flights_position]
+
+    events = [(record["FlightNumber"], record["type"], record["time"]) for record in records if record["type"] != "timestep"]
+    expected = [(result.flight.flightNumber, event, getattr(result, event).isoformat())
+                for result in flight_data for event in ("entry", "exit") if getattr(result, event)]
+    assert events
+    assert sorted(events) == sorted(expected)
+
+
+def test_stream_events_follow_their_timestep():
+    ra_h, ra_m, ra_s, dec = pointing_at(FLIGHTS[0], 60)
+    records = list(stream_flights_intersecting(2, 120, ra_h, ra_m, ra_s, dec, USER_GPS["longitude"], USER_GPS["latitude"],
+                                               USER_GPS["altitude"], "simulated", FLIGHTS, OBSERVER_TIME, chunk_size=4))
+
+    current_time = None
+    for record in records:
+        if record["type"] == "timestep":
+            current_time = record["elapsedTime"]
+        else:
+            assert record["elapsedTime"] == current_time
+
+
+def test_stream_validates_before_streaming():
+    with pytest.raises(ValueError):
+        stream_flights_intersecting(2, 120, 0, 0, 0, 0, 0, 91, 0, "simulated", FLIGHTS, OBSERVER_TIME)
@@ -0,0 +1,117 @@
+import threading
+from datetime import datetime
+import uuid
+
+import pytest
+
+from utils.datatypes import FlightResult, ProcessedFlightInfo
+from utils.subscriptions import SubscriptionHub, TooManySubscriptions, diff_states, flight_states, normalize_subscription, subscription_key
+
+FORM = {"focalLength": "20", "cameraSensorSize": "10", "barlowReducerFactor": "0.5", "exposure": "250", "fovCenterRaH": "1",
+        "fovCenterRaM": "51", "fovCenterRaS": "5", "fovCenterDec": "43.5", "latitude": "43.589621", "longitude": "-79.644391",
+        "altitude": "0", "altitudeUnit": "m", "flightDataType": "live", "datetime": ""}
+
+
+def state(flight_number, entry="2025-03-30T10:38:00-04:00", exit=None, track=()):
+    return {"id": flight_number, "flight_number": flight_number, "entry": entry, "exit": exit, "track": list(track)}
+
+
+def test_nearby_forms_share_a_key():
+    nearby = {**FORM, "latitude": "43.58962", "longitude": -79.64439, "altitudeUnit": "ft"}
+    elsewhere = {**FORM, "latitude": "44.58962"}
+
+    assert subscription_key(normalize_subscription(FORM)) == subscription_key(normalize_subscription(nearby))
+    assert subscription_key(normalize_subscription(FORM)) != subscription_key(normalize_subscription(elsewhere))
+
+
+def test_diff_states():
+    previous = {"A": state("A", track=[1]), "B": state("B"), "C": state("C")}
+    current = {"A": state("A", track=[1, 2], exit="2025-03-30T10:40:00-04:00"), "B": state("B"), "D": state("D")}
+
+    diff = diff_states(previous, current)
+    assert [flight["flight_number"] for flight in diff["added"]] == ["D"]
+    assert [flight["flight_number"] for flight in diff["updated"]] == ["A"]
+    assert diff["removed"] == ["C"]
+    assert [(event["FlightNumber"], event["type"]) for event in diff["events"]] == [("D", "entry"), ("A", "exit")]
+    assert not any(diff_states(current, current).values())
+
+
+def test_flight_states_keep_flights_entering_the_fov():
+    entering = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="A", latitude=0, longitude=0, altitude=30000, speed=400, heading=0)
+    passing = ProcessedFlightInfo(id=uuid.uuid4(), flightNumber="B", latitude=0, longitude=0, altitude=30000, speed=400, heading=0)
+    positions = [[], [{"ID": entering.id, "RA": 1.0, "Dec": 2.0}]]
+
+    states = flight_states(positions, [FlightResult(entering, entry=datetime(2025, 3, 30, 10, 38)), FlightResult(passing)], time_step=5)
+    assert list(states) == [str(entering.id)]
+    assert states[str(entering.id)]["track"] == [{"elapsedTime": 5, "RA": 1.0, "Dec": 2.0}]
+
+
+def test_subscribers_share_one_computation():
+    hub = SubscriptionHub(interval=0.05, keepalive=0.05)
+    calls = []
+    lock = threading.Lock()
+
+    def compute(form):
+        with lock:
+            calls.append(form)
+            count = len(calls)
+        return {"A": state("A", track=list(range(count)))}
+
+    key = hub.register(FORM)
+    first, second = hub.updates(key, compute), hub.updates(key, compute)
+
+    first_diff, second_diff = next(first), next(second)
+    assert [flight["flight_number"] for flight in first_diff["added"]] == ["A"]
+    assert [flight["flight_number"] for flight in second_diff["added"]] == ["A"]
+    assert len(hub.channels) == 1
+
+    # later refreshes only send what changed
+    update = next(diff for diff in first if diff is not None)
+    assert update["updated"] and not update["added"]
+
+    first.close()
+    assert len(hub.channels) == 1
+    second.close()
+    assert not hub.channels
+    assert all(form == calls[0] for form in calls)
+
+
+def test_refresh_errors_are_reported():
+    hub = SubscriptionHub(interval=10, keepalive=1)
+
+    def compute(form):
+        raise ValueError("Observer latitude must be in the range [-90, 90].")
+
+    updates = hub.updates(hub.register(FORM), compute)
+    assert next(updates) == {"error": "Observer latitude must be in the range [-90, 90]."}
+    updates.close()
+
+
+def test_unknown_subscription():
+    with pytest.raises(KeyError):
+        next(SubscriptionHub().updates("unknown", lambda form: {}))
+
+
+def test_unchanged_state_still_gets_keepalives():
+    # refreshes more often than the keepalive, never changing anything
+    hub = SubscriptionHub(interval=0.01, keepalive=0.1)
+    updates = hub.updates(hub.register(FORM), lambda form: {})
+
+    assert next(updates) == {"added": [], "updated": [], "removed": [], "events": []}
+    assert next(updates) is None
+    assert next(updates) is None
+    updates.close()
+    assert not hub.channels
+
+
+def test_channels_are_limited():
+    hub = SubscriptionHub(interval=10, keepalive=1, max_channels=1)
+    first = hub.subscribe(hub.register(FORM), lambda form: {})
+
+    with pytest.raises(TooManySubscriptions):
+        hub.subscribe(hub.register({**FORM, "latitude": "44"}), lambda form: {})
+    # joining a running channel is always possible
+    assert hub.subscribe(first.key, lambda form: {}) is first
+    hub.unsubscribe(first)
+    hub.unsubscribe(first)
+    assert not hub.channels
@@ -0,0 +1,98 @@
+import math
+
+import pytest
+from astropy.time import TimeDelta
+
+import utils.flight_motion as flight_motion
+from samples import FLIGHTS, OBSERVER_TIME, USER_GPS, pointing_at
+from utils import fov, batch
+from utils.constants import EARTH_RADIUS_METER
+from utils.flight_motion import FlightMotion
+from utils.integration import find_flights_intersecting
+from utils.track_sessions import TrackSession, get_track_session
+
+
+def advance(flight, seconds):
+    """ a simulated flight where it is after seconds """
+    arrays = batch.flight_arrays([fov.convert_to_processed_flight(flight)])
+    phi = batch.phi_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], seconds, arrays["latitude"])
+    theta = batch.theta_current_position(arrays["speed"], EARTH_RADIUS_METER, arrays["altitude"], arrays["heading"], seconds,
+                                         arrays["latitude"], arrays["longitude"])
+    return {**flight, "latitude": 90 - math.degrees(phi[0, 0]), "longitude": (math.degrees(theta[0, 0]) + 180) % 360 - 180}
+
+
+def predict(flights, seconds, track_session=None, stats=None):
+    ra_h, ra_m, ra_s, dec = pointing_at(FLIGHTS[0], 60)
+    return find_flights_intersecting(2, 120, ra_h, ra_m, ra_s, dec, USER_GPS["longitude"], USER_GPS["latitude"], USER_GPS["altitude"],
+                                     "simulated", flights, OBSERVER_TIME + TimeDelta(seconds, format='sec'),
+                                     track_session=track_session, stats=stats)
+
+
+def assert_same_positions(flights_position, expected_position, tolerance):
+    assert [[position["ID"] for position in positions] for positions in flights_position] == \
+        [[position["ID"] for position in positions] for positions in expected_position]
+    for positions, expected_positions in zip(flights_position, expected_position):
+        for position, expected in zip(positions, expected_positions):
+            assert position["RA"] == pytest.approx(expected["RA"], abs=tolerance)
+            assert position["Dec"] == pytest.approx(expected["Dec"], abs=tolerance)
+
+
+def test_first_poll_matches_full_computation():
+    session = TrackSession(USER_GPS, 5, OBSERVER_TIME)
+    stats = dict()
+
+    assert predict(FLIGHTS, 0, session, stats)[0] == predict(FLIGHTS, 0)[0]
+    assert stats["tracks"] == {"reused": 0, "recomputed": 2}
+
+
+@pytest.mark.parametrize("seconds", [10, 11, 200])
+def test_next_poll_reuses_unchanged_flights(seconds):
+    session = TrackSession(USER_GPS, 5, OBSERVER_TIME)
+    predict(FLIGHTS, 0, session)
+    moved = [advance(flight, seconds) for flight in FLIGHTS]
+    stats = dict()
+
+    flights_position, flight_data = predict(moved, seconds, session, stats)
+    # polls are snapped to the session's timesteps
+    expected_position, expected_data = predict([advance(flight, -(seconds % 5)) for flight in moved], seconds - seconds % 5)
+
+    assert stats["tracks"] == {"reused": 2, "recomputed": 0}
+    assert [result.entry for result in flight_data] == [result.entry for result in expected_data]
+    assert [result.exit for result in flight_data] == [result.exit for result in expected_data]
+    assert_same_positions(flights_position, expected_position, 0.01)
+
+
+@pytest.mark.parametrize("change", [{"heading": 112}, {"speed": 480}, {"altitude": 36000}, {"latitude": 43.92}])
+def test_changed_flights_are_recomputed(change):
+    session = TrackSession(USER_GPS, 5, OBSERVER_TIME)
+    predict(FLIGHTS, 0, session)
+    moved = [advance(flight, 10) for flight in FLIGHTS]
+    stats = dict()
+
+    flights_position, _ = predict([{**moved[0], **change}, moved[1]], 10, session, stats)
+
+    assert stats["tracks"] == {"reused": 1, "recomputed": 1}
+    assert_same_positions(flights_position, predict([{**moved[0], **change}, moved[1]], 10)[0], 1e-9)
+
+
+def test_sessions_are_per_observer():
+    session = get_track_session("test-session", USER_GPS, 5, OBSERVER_TIME)
+
+    assert get_track_session("test-session", dict(USER_GPS), 5, OBSERVER_TIME + TimeDelta(10, format='sec')) is session
+    assert get_track_session("test-session", {**USER_GPS, "altitude": 0}, 5, OBSERVER_TIME) is not session
+    assert get_track_session("test-session", USER_GPS, 10, OBSERVER_TIME) is not session
+
+
+def test_reuse_is_checked_with_the_configured_model(monkeypatch):
+    monkeypatch.setattr(flight_motion, "MOTION_MODEL", "great-circle")
+    session = TrackSession(USER_GPS, 5, OBSERVER_TIME)
+    predict(FLIGHTS, 0, session)
+    moved = []
+    for flight in FLIGHTS:
+        latitude, longitude = FlightMotion(batch.flight_arrays([fov.convert_to_processed_flight(flight)])).lat_lon(400)
+        moved.append({**flight, "latitude": float(latitude[0, 0]), "longitude": float(longitude[0, 0])})
+    stats = dict()
+
+    predict(moved, 400, session, stats)
+
+    assert stats["tracks"] == {"reused": 2, "recomputed": 0}
@@ -0,0 +1,39 @@
+import os
+import subprocess
+import sys
+
+from utils import warmup
+
+API_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "..", "api")
+IMPORT_TIME_BUDGET = 0.75 # seconds to import the app, best of 3 runs
+# imported on first use or by warmup.warm_up, not when the app is imported
+HEAVY_MODULES = ("astropy", "timezonefinder", "FlightRadar24")
+
+IMPORT_APP = """
+import sys, time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start)
+print(",".join(module for module in {modules} if module in sys.modules))
+"""
+
+
+def import_app() -> tuple[float, list[str]]:
+    output = subprocess.run([sys.executable, "-c", IMPORT_APP.format(modules=HEAVY_MODULES)], cwd=API_DIRECTORY, check=True,
+                            capture_output=True, text=True, env={**os.environ, "PYTHONPATH": API_DIRECTORY}).stdout.splitlines()
+    return float(output[0]), [module for module in output[1].split(",") if module]
+
+
+def test_app_import_defers_heavy_modules():
+    runs = [import_app() for _ in range(3)]
+
+    assert runs[0][1] == []
+    assert min(seconds for seconds, _ in runs) < IMPORT_TIME_BUDGET
+
+
+def test_warm_up_runs_once():
+    timings = warmup.warm_up()
+
+    assert set(timings) == {"imports", "sidereal", "timezone", "prediction"}
+    assert warmup.warm_up() is timings
+    assert all(module in sys.modules for module in warmup.WARMUP_MODULES)